@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Benchmark of splitting the energy of a run across many overlapping intervals, e.g. the
+requests batched together by an inference server, with attribution.apportion.
+
+Usage: python benchmarks/attribution.py [--intervals N] [--samples N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Benchmark the working tree rather than an installed copy of energymeter.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from energymeter.attribution import apportion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--intervals", type=int, default=50000)
+    parser.add_argument("--samples", type=int, default=6000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # 10 W and 2 W components sampled every 10 ms, and intervals of up to 1 s.
+    rng = np.random.default_rng(0)
+    timestamps = np.arange(args.samples) * 0.01
+    counters = np.column_stack([10 * timestamps, 2 * timestamps])
+    duration = timestamps[-1]
+    starts = rng.uniform(0, duration - 1, args.intervals)
+    ends = starts + rng.uniform(0, 1, args.intervals)
+    weights = rng.integers(1, 500, args.intervals)
+
+    best = float("inf")
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        apportion(timestamps, counters, starts, ends, weights)
+        best = min(best, time.perf_counter() - t)
+    print("{:<45} {:>9.2f} ms".format("apportion ({} intervals)".format(args.intervals),
+                                      best * 1e3))
+
+
+if __name__ == "__main__":
+    main()
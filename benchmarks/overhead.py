@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Benchmark of the overhead of the meters themselves: begin/end latency, CPU time and wakeups
+of the sampling threads, memory growth per hour of sampling and the time to compute results.
+Hardware is replaced by the stand-ins of energymeter.testing (a fake powercap tree, a fake
+NVML and a command that prints bpftrace's output), so it runs on any Linux host.
+
+Usage: python benchmarks/overhead.py [--seconds S] [--gpus N] [--json PATH]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Benchmark the working tree rather than an installed copy of energymeter.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from energymeter.bpftrace import BpftraceSession
+from energymeter.energy_meter import EnergyMeter, ThreadGpuSamplingPyNvml
+from energymeter.sampler import (DiskStatsSource, EnergySampler, NvmlSource, ProcIoSource,
+                                 RaplSource, SharedEnergyMeter)
+from energymeter.testing import (FakeGpu, FakeNvml, fake_bpftrace_command, write_fake_diskstats,
+                                 write_fake_powercap)
+
+DISK = dict(disk_avg_speed=1600 * 1e6, disk_active_power=6, disk_idle_power=1.42)
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def thread_usage(thread):
+    """Get the resources used by a running thread from /proc.
+    :param thread: the thread.
+    :returns: the CPU seconds used by the thread and the number of times it was woken up
+        (voluntary context switches).
+    """
+    task = "/proc/self/task/{}/".format(thread.native_id)
+    with open(task + "status") as f:
+        status = dict(line.split(":", 1) for line in f)
+    try:
+        # Nanoseconds on the CPU, utime and stime only have a resolution of clock ticks.
+        with open(task + "schedstat") as f:
+            cpu_seconds = int(f.read().split()[0]) / 1e9
+    except OSError:
+        with open(task + "stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu_seconds, int(status["voluntary_ctxt_switches"])
+
+
+def percentiles(times):
+    """Summarize latencies.
+    :param times: the latencies in seconds.
+    :returns: a dictionary with the median and the 99th percentile in microseconds.
+    """
+    return {"p50_us": float(np.percentile(times, 50) * 1e6),
+            "p99_us": float(np.percentile(times, 99) * 1e6)}
+
+
+def time_begin_end(make_meter, repeat, work=0.0):
+    """Time begin() and end() of meters.
+    :param make_meter: a function that returns a new meter.
+    :param repeat: the number of meters to run.
+    :param work: the seconds to sleep between begin() and end().
+    :returns: a dictionary with the latency percentiles of begin() and end().
+    """
+    begins, ends = [], []
+    for _ in range(repeat):
+        meter = make_meter()
+        t = time.perf_counter()
+        meter.begin()
+        begins.append(time.perf_counter() - t)
+        if work:
+            time.sleep(work)
+        t = time.perf_counter()
+        meter.end()
+        ends.append(time.perf_counter() - t)
+    return {"begin": percentiles(begins), "end": percentiles(ends)}
+
+
+def time_call(fn, repeat):
+    """Time a function.
+    :param fn: the function, called without parameters.
+    :param repeat: the number of calls.
+    :returns: the mean time of a call in microseconds.
+    """
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat * 1e6
+
+
+def thread_overhead(thread, samples, row_bytes, seconds):
+    """Measure a sampling thread while it runs.
+    :param thread: the started thread.
+    :param samples: a function that returns the number of rows the thread has stored.
+    :param row_bytes: the bytes used to store a row.
+    :param seconds: how long to measure the thread.
+    :returns: a dictionary with the fraction of a core used by the thread, its wakeups per
+        second and the memory it would accumulate in an hour.
+    """
+    cpu_begin, wakeups_begin = thread_usage(thread)
+    samples_begin, t = samples(), time.time()
+    time.sleep(seconds)
+    cpu_end, wakeups_end = thread_usage(thread)
+    elapsed = time.time() - t
+    return {
+        "cpu_fraction": (cpu_end - cpu_begin) / elapsed,
+        "wakeups_per_second": (wakeups_end - wakeups_begin) / elapsed,
+        "mb_per_hour": (samples() - samples_begin) / elapsed * 3600 * row_bytes / 1e6,
+    }
+
+
+def measure_overhead(args, tmp):
+    """Measure the latency of the meters and the resources used by the sampling threads.
+    :param args: the command line arguments.
+    :param tmp: a directory where the fake hardware files are written.
+    :returns: a dictionary with the results of each measurement.
+    """
+    powercap = write_fake_powercap(os.path.join(tmp, "powercap"), packages=2)
+    diskstats = write_fake_diskstats(os.path.join(tmp, "diskstats"))
+    nvml = FakeNvml([FakeGpu(processes={os.getpid(): 50}) for _ in range(args.gpus)])
+    session = BpftraceSession(command=fake_bpftrace_command(threads=args.threads))
+    session.start()
+    results = {}
+
+    # Latency of begin() and end().
+    results["EnergyMeter bpftrace"] = time_begin_end(
+        lambda: EnergyMeter(rapl_root=powercap, nvml=nvml, bpftrace_session=session, **DISK),
+        args.repeat)
+    results["EnergyMeter diskstats"] = time_begin_end(
+        lambda: EnergyMeter(rapl_root=powercap, nvml=nvml, disk_backend="diskstats",
+                            diskstats_path=diskstats, **DISK), args.repeat)
+
+    sources = [RaplSource(powercap), NvmlSource(nvml), ProcIoSource(),
+               DiskStatsSource(diskstats)]
+    sampler = EnergySampler(sources=sources)
+    sampler.start()
+    results["SharedEnergyMeter"] = time_begin_end(
+        lambda: SharedEnergyMeter(sampler=sampler, **DISK), 10000)
+
+    # Resources used by the sampling threads.
+    results["EnergySampler thread"] = thread_overhead(
+        sampler, lambda: len(sampler.buffer),
+        sampler.buffer.values.itemsize * (sampler.buffer.values.shape[1] + 1), args.seconds)
+    gpu_thread = ThreadGpuSamplingPyNvml("GPU Sampling Thread", nvml=nvml)
+    gpu_thread.start()
+    time.sleep(0.1)
+    results["GPU sampling thread"] = thread_overhead(
+        gpu_thread, lambda: len(gpu_thread.samples), 8 * (4 * args.gpus + 1), args.seconds)
+    gpu_thread.stop()
+    results["bpftrace reading thread"] = thread_overhead(
+        session.thread, lambda: len(session.samples), 8 * 4, args.seconds)
+    session.stop()
+
+    # Results over an hour of samples, 36000 samples at the default period.
+    columns = sampler.buffer.values.shape[1]
+    hour = EnergySampler(sources=sources)
+    for t in range(36000):
+        hour.append(t * 0.1, np.full(columns, t * 0.1))
+    meter = SharedEnergyMeter(sampler=hour, **DISK)
+    meter.start_time, meter.end_time, meter.duration = 600.0, 3000.0, 2400.0
+
+    def compute():
+        meter.energy = None
+        meter.get_total_joules_per_component()
+
+    starts = np.random.default_rng(0).uniform(0, 3590, 10000)
+    results["results over 1 h of samples"] = {
+        "SharedEnergyMeter_us": time_call(compute, 1000),
+        "energy_per_interval_10k_requests_us": time_call(
+            lambda: hour.energy_per_interval(starts, starts + 10), 10),
+    }
+    sampler.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0,
+                        help="how long each sampling thread is measured")
+    parser.add_argument("--gpus", type=int, default=4, help="the number of fake GPUs")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="the threads of this process in the fake bpftrace output")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="the number of EnergyMeters whose begin/end is timed")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = measure_overhead(args, tmp)
+
+    for name, result in results.items():
+        print(name)
+        for key, value in result.items():
+            if isinstance(value, dict):
+                value = "   ".join("{} {:.1f}".format(k, v) for k, v in value.items())
+            else:
+                value = "{:.4g}".format(value)
+            print("    {:<40} {}".format(key, value))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark of the steps of plotting a power timeline with millions of samples: reducing the
+cumulative counters, computing the power of each component, downsampling it with LTTB and
+drawing the figure. Each step is timed separately, so the slow one is easy to spot.
+
+Usage: python benchmarks/plotting.py [--samples N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Benchmark the working tree rather than an installed copy of energymeter.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from energymeter.plotting import (BUCKETS_PER_POINT, MAX_POINTS, component_power,
+                                  decimate_counters, lttb, plot_power_timeline)
+
+LAYOUT = {"cpu": [0, 1], "gpu": [2]}
+
+
+def best_time(fn, repeat):
+    """Time a function.
+    :param fn: the function, called without parameters.
+    :param repeat: the number of calls.
+    :returns: the best time of a call in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=2000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    n = args.samples
+    timestamps = np.arange(n) * 0.01
+    counters = np.column_stack([np.cumsum(np.full(n, 0.5)), np.cumsum(np.full(n, 1.0)),
+                                np.cumsum(np.random.rand(n))])
+    reduced = decimate_counters(timestamps, counters, BUCKETS_PER_POINT * MAX_POINTS + 1)
+    middle, power = component_power(*reduced, LAYOUT)
+    full_middle, full_power = component_power(timestamps, counters, LAYOUT)
+
+    steps = {
+        "decimate_counters": lambda: decimate_counters(
+            timestamps, counters, BUCKETS_PER_POINT * MAX_POINTS + 1),
+        "component_power (reduced)": lambda: component_power(*reduced, LAYOUT),
+        "lttb (reduced, per component)": lambda: lttb(middle, power["gpu"], MAX_POINTS),
+        "component_power (all samples)": lambda: component_power(timestamps, counters, LAYOUT),
+        "lttb (all samples, per component)": lambda: lttb(full_middle, full_power["gpu"],
+                                                          MAX_POINTS),
+        "plot_power_timeline": lambda: plot_power_timeline(timestamps, counters, LAYOUT),
+    }
+    for name, fn in steps.items():
+        print("{:<45} {:>9.2f} ms".format(name, best_time(fn, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Benchmark of the time it takes to import energymeter and to construct meters. Each import is
+timed in a fresh interpreter, so modules cached by previous runs do not hide regressions.
+
+Usage: python benchmarks/startup.py [--repeat N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Benchmark the working tree rather than an installed copy of energymeter.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+IMPORTS = {
+    "import energymeter": "import energymeter",
+    "from energymeter import EnergyMeter": "from energymeter import EnergyMeter",
+    "from energymeter import SharedEnergyMeter": "from energymeter import SharedEnergyMeter",
+}
+
+# Modules that must not be loaded just by importing the meters.
+HEAVY_MODULES = ["matplotlib", "pandas", "pynvml", "pynvml_utils", "pyRAPL"]
+
+
+def time_import(statement, repeat):
+    """Time an import statement in fresh interpreters.
+    :param statement: the import statement.
+    :param repeat: the number of interpreters to run.
+    :returns: the best time in seconds and the heavy modules loaded by the statement.
+    """
+    code = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "{}\n"
+        "t = time.perf_counter() - t\n"
+        "print(t)\n"
+        "print(','.join(m for m in {!r} if m in sys.modules))\n"
+    ).format(statement, HEAVY_MODULES)
+    best, loaded = float("inf"), ""
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT).decode().splitlines()
+        best = min(best, float(out[0]))
+        loaded = out[1] if len(out) > 1 else ""
+    return best, loaded
+
+
+def time_construction(cls, repeat, **kwargs):
+    """Time the construction of meters.
+    :param cls: the meter class.
+    :param repeat: the number of meters to construct.
+    :returns: the mean time in seconds to construct a meter.
+    """
+    t = time.perf_counter()
+    for _ in range(repeat):
+        cls(**kwargs)
+    return (time.perf_counter() - t) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, statement in IMPORTS.items():
+        best, loaded = time_import(statement, args.repeat)
+        print("{:<45} {:>9.2f} ms   heavy modules loaded: {}".format(
+            name, best * 1e3, loaded or "none"))
+
+    from energymeter import EnergyMeter, SharedEnergyMeter
+    for cls in (EnergyMeter, SharedEnergyMeter):
+        t = time_construction(cls, 1000, ignore_disk=True)
+        print("{:<45} {:>9.2f} us".format(cls.__name__ + "()", t * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,35 @@
-from .energy_meter import EnergyMeter
\ No newline at end of file
+"""
+EnergyMeter measures the energy consumption of Python functions or code chunks per component
+(CPU, DRAM, GPU and Hard Disk). Submodules are imported when the names they define are first
+accessed, so importing the package is almost free.
+"""
+import importlib
+
+# Public name -> submodule where it is defined.
+_EXPORTS = {
+    "EnergyMeter": ".energy_meter",
+    "EnergySampler": ".sampler",
+    "SharedEnergyMeter": ".sampler",
+    "get_sampler": ".sampler",
+    "measure_energy": ".context",
+    "get_current_meter": ".context",
+    "apportion": ".attribution",
+    "Coordinator": ".coordinator",
+    "CoordinatedMeter": ".coordinator",
+    "EnergyProfiler": ".profiler",
+    "register_backend": ".backends",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
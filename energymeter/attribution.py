@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+This module splits the energy measured by the sampler across many concurrent requests, e.g.
+the requests batched together in the forward passes of an inference server. Each request
+draws energy at a rate proportional to its weight spread over its duration, so the energy
+used while several requests overlap is shared by all of them in proportion to their rates.
+"""
+import numpy as np
+
+
+def interpolate_counters(timestamps, counters, times):
+    """Get the cumulative counters at many times, interpolating linearly between the two
+    closest samples and clamping times outside the samples, as EnergySampler.counters_at.
+    :param timestamps: the sorted timestamps of the samples.
+    :param counters: an array with a row of cumulative counters per sample.
+    :param times: the times at which the counters are required.
+    :returns: an array with a row of counters per time.
+    """
+    return np.column_stack([np.interp(times, timestamps, counters[:, c])
+                            for c in range(counters.shape[1])])
+
+
+def apportion(timestamps, counters, starts, ends, weights=None):
+    """Split the increase of cumulative counters across (possibly overlapping) intervals.
+
+    The timeline is cut at every start and end into elementary segments during which the
+    same intervals are active. The energy of each segment is shared by its active intervals
+    in proportion to their rate, weight / (end - start), so the cost is O(n log n) in the
+    number of intervals. Energy used while no interval is active is not attributed.
+
+    :param timestamps: the sorted timestamps of the samples.
+    :param counters: an array with a row of cumulative counters per sample.
+    :param starts: the start time of each interval.
+    :param ends: the end time of each interval.
+    :param weights: the weight of each interval, e.g. the tokens it processed. Defaults to
+        the duration of each interval, i.e. all active intervals get the same share.
+    :returns: an array with a row per interval with its share of the increase of each counter.
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    if starts.shape != ends.shape:
+        raise Exception("starts and ends must have the same length.")
+    durations = ends - starts
+    if np.any(durations < 0):
+        raise Exception("Intervals must not end before they start.")
+    if weights is None:
+        weights = durations
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != starts.shape or np.any(weights < 0):
+        raise Exception("There must be a non-negative weight per interval.")
+
+    n_columns = counters.shape[1]
+    if len(starts) == 0 or len(timestamps) == 0:
+        return np.zeros((len(starts), n_columns))
+
+    active = durations > 0
+    rates = np.zeros(len(starts))
+    rates[active] = weights[active] / durations[active]
+
+    bounds = np.unique(np.concatenate([starts, ends]))
+    start_idx = np.searchsorted(bounds, starts)
+    end_idx = np.searchsorted(bounds, ends)
+
+    # Total rate of the intervals active in each segment [bounds[i], bounds[i + 1]).
+    load = np.cumsum(np.bincount(start_idx, rates, len(bounds)) -
+                     np.bincount(end_idx, rates, len(bounds)))[:-1]
+    segment_energy = np.diff(interpolate_counters(timestamps, counters, bounds), axis=0)
+
+    # Energy per unit of rate in each segment; segments without active intervals (or with
+    # only the rounding error of the cumulative sum) are not attributed.
+    shared = load > 1e-9 * rates.max() if rates.max() > 0 else np.zeros(len(load), bool)
+    per_rate = np.zeros_like(segment_energy)
+    per_rate[shared] = segment_energy[shared] / load[shared, None]
+    cumulative = np.vstack([np.zeros(n_columns), np.cumsum(per_rate, axis=0)])
+
+    return rates[:, None] * (cumulative[end_idx] - cumulative[start_idx])
+
+
+def attributed_between(timestamps, counters, start_time, end_time, energy_columns,
+                       tree_column, host_column):
+    """Get the energy used by a process tree between two instants, scaling the energy of
+    each interval between samples by the share of the host's usage of the tree in that
+    interval.
+    :param timestamps: the sorted timestamps of the samples.
+    :param counters: an array with a row of cumulative counters per sample.
+    :param start_time: the beginning of the window.
+    :param end_time: the end of the window.
+    :param energy_columns: the columns with the energy to attribute.
+    :param tree_column: the column with the cumulative usage of the tree.
+    :param host_column: the column with the cumulative usage of the host.
+    :returns: an array with the energy of each energy column attributed to the tree.
+    """
+    # Only the samples inside the window and the closest ones outside it are needed.
+    lo = max(np.searchsorted(timestamps, start_time, side="right") - 1, 0)
+    hi = np.searchsorted(timestamps, end_time, side="left") + 1
+    timestamps, counters = timestamps[lo:hi], counters[lo:hi]
+    inside = timestamps[(timestamps > start_time) & (timestamps < end_time)]
+    bounds = np.concatenate([[start_time], inside, [end_time]])
+    delta = np.diff(interpolate_counters(timestamps, counters, bounds), axis=0)
+    share = np.zeros(len(delta))
+    used = delta[:, host_column] > 0
+    share[used] = np.clip(delta[used, tree_column] / delta[used, host_column], 0, 1)
+    return (delta[:, energy_columns] * share[:, None]).sum(axis=0)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+This module defines the protocol of the power sources polled by EnergySampler, a registry
+where built-in and user backends are registered by name, and the timer wheel with which a
+single sampling thread polls every source at its own rate.
+
+A source is any object with:
+
+- columns: a list with the component name of each value it reads (e.g. cpu, gpu). Columns
+  with the same name are grouped, e.g. one per CPU package.
+- read(timestamp): returns the value of each column at timestamp.
+- cumulative (optional, defaults to True): if read() returns cumulative counters (e.g.
+  joules) or instantaneous values (e.g. watts), which are then integrated over time.
+- seconds_between_samples (optional): how often the source is polled. Defaults to the
+  sampling period of the sampler.
+- open() and close() (optional): called when the sampler starts and shuts down.
+
+Backends are registered with a factory (usually the class of the source) that is called
+without arguments to create the default sources. Plugins can also be installed as
+packages that declare an entry point in the group energymeter.backends.
+"""
+import threading
+
+import numpy as np
+
+ENTRY_POINT_GROUP = "energymeter.backends"
+# Columns of the built-in sources that do not hold joules. The columns of every other
+# component, including those of plugins (e.g. node), are energy.
+NON_ENERGY_COMPONENTS = ("gpu_active", "rbytes", "wbytes", "proc_cpu", "host_cpu", "proc_rss",
+                         "host_rss")
+
+# Name -> (factory, label, default).
+_registry = {}
+_registry_lock = threading.Lock()
+_entry_points_loaded = False
+
+
+def energy_components(layout):
+    """Get the components whose columns hold joules.
+    :param layout: a dictionary mapping each component to its columns, see
+        EnergySampler.layout.
+    :returns: a list with the names of the components.
+    """
+    return [name for name in layout
+            if name not in NON_ENERGY_COMPONENTS and not name.startswith("disk_busy:")]
+
+
+def register_backend(name, factory, label=None, default=False):
+    """Register a backend.
+    :param name: the name of the backend, e.g. rapl.
+    :param factory: a callable that creates the source, called with the keyword arguments
+        given to create_backend.
+    :param label: the name shown when the backend is not accessible. Defaults to name.
+    :param default: if the backend is part of the default sources of the sampler.
+    """
+    with _registry_lock:
+        _registry[name] = (factory, label or name, default)
+
+
+def unregister_backend(name):
+    """Remove a backend from the registry.
+    :param name: the name of the backend.
+    """
+    with _registry_lock:
+        _registry.pop(name, None)
+
+
+def load_entry_points():
+    """Register the backends declared by installed packages in the entry point group
+    energymeter.backends. Each entry point is named after the backend and refers to its
+    factory. This is done once, the first time the registry is queried.
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+        found = entry_points()
+        if hasattr(found, "select"):
+            found = found.select(group=ENTRY_POINT_GROUP)
+        else:
+            found = found.get(ENTRY_POINT_GROUP, [])
+    except Exception:
+        return
+    for entry_point in found:
+        if entry_point.name in _registry:
+            continue
+        try:
+            register_backend(entry_point.name, entry_point.load())
+        except Exception:
+            print("The backend {} could not be loaded!".format(entry_point.name))
+
+
+def backend_names(default_only=False):
+    """Get the names of the registered backends.
+    :param default_only: if only the backends that are part of the default sources must be
+        returned.
+    :returns: a list with the names, in registration order.
+    """
+    load_entry_points()
+    with _registry_lock:
+        return [name for name, (_, _, default) in _registry.items()
+                if default or not default_only]
+
+
+def create_backend(name, **options):
+    """Create a source from a registered backend.
+    :param name: the name of the backend.
+    :param options: the keyword arguments of its factory.
+    :returns: the source.
+    """
+    load_entry_points()
+    with _registry_lock:
+        if name not in _registry:
+            raise Exception("Unknown backend {}, the registered backends are: {}.".format(
+                name, ", ".join(_registry)))
+        factory = _registry[name][0]
+    return factory(**options)
+
+
+def create_sources(names=None):
+    """Create the sources of several backends, skipping those that cannot be set up in
+    this host.
+    :param names: the names of the backends. Defaults to the default backends.
+    :returns: a list of sources.
+    """
+    names = backend_names(default_only=True) if names is None else names
+    sources = []
+    for name in names:
+        try:
+            sources.append(create_backend(name))
+        except Exception:
+            with _registry_lock:
+                label = _registry[name][1] if name in _registry else name
+            print("{} is not accessible, its energy metrics will not be available!".format(label))
+    return sources
+
+
+class IntegratingSource:
+    """Wraps a source that reads instantaneous values (e.g. watts) and integrates them over
+    time with the trapezoidal rule, so the sampler can store cumulative counters (e.g.
+    joules) for every source.
+    """
+
+    def __init__(self, source):
+        """Wrap a source.
+        :param source: the source with instantaneous values.
+        """
+        self.source = source
+        self.columns = source.columns
+        self.seconds_between_samples = getattr(source, "seconds_between_samples", None)
+        self.last = None
+        self.total = np.zeros(len(self.columns))
+
+    def open(self):
+        if hasattr(self.source, "open"):
+            self.source.open()
+
+    def read(self, timestamp):
+        """Read the source and accumulate its values since the previous reading.
+        :param timestamp: the time at which the source is read.
+        :returns: an array with the integral of each column.
+        """
+        values = np.asarray(self.source.read(timestamp), dtype=float)
+        if self.last is not None:
+            last_timestamp, last_values = self.last
+            self.total = self.total + (values + last_values) / 2 * (timestamp - last_timestamp)
+        self.last = (timestamp, values)
+        return self.total
+
+    def close(self):
+        if hasattr(self.source, "close"):
+            self.source.close()
+
+
+class PowerFileSource:
+    """Reads the power draw from a text file, e.g. a hwmon power*_input file or a file
+    updated by a daemon that polls IPMI or Redfish. The power is integrated by the sampler.
+    """
+
+    cumulative = False
+
+    def __init__(self, path, column="node", scale=1.0, seconds_between_samples=1.0):
+        """Check that the file can be read.
+        :param path: the file, which contains a single number.
+        :param column: the component name of the power.
+        :param scale: the factor that converts the number to watts, e.g. 1e-6 for hwmon.
+        :param seconds_between_samples: how often the file is read.
+        """
+        self.path = path
+        self.columns = [column]
+        self.scale = scale
+        self.seconds_between_samples = seconds_between_samples
+        self.read(None)
+
+    def read(self, timestamp):
+        """Read the power draw.
+        :param timestamp: the time at which the file is read.
+        :returns: a list with the watts.
+        """
+        with open(self.path) as f:
+            return [float(f.read().strip()) * self.scale]
+
+
+class TimerWheel:
+    """Hashed timer wheel that decides which tasks are due at every tick of a single
+    thread. Each task is stored in the slot of the tick at which it is due next, with the
+    number of full turns of the wheel left, so advancing a tick only touches one slot,
+    regardless of the number of tasks and their periods.
+    """
+
+    SLOTS = 64
+
+    def __init__(self, seconds_per_tick, slots=None):
+        """Create an empty wheel.
+        :param seconds_per_tick: the duration of a tick.
+        :param slots: the number of slots. Defaults to SLOTS.
+        """
+        self.seconds_per_tick = seconds_per_tick
+        self.slots = [[] for _ in range(slots or TimerWheel.SLOTS)]
+        self.position = 0
+
+    def ticks(self, seconds):
+        """Get the number of ticks closest to a period, at least one.
+        :param seconds: the period.
+        :returns: the number of ticks.
+        """
+        return max(1, int(round(seconds / self.seconds_per_tick)))
+
+    def schedule(self, task, seconds):
+        """Add a task that is due every period.
+        :param task: the task, any object.
+        :param seconds: the period of the task, rounded to a whole number of ticks.
+        """
+        ticks = self.ticks(seconds)
+        self.insert([0, ticks, task], ticks)
+
+    def insert(self, entry, delay):
+        """Store an entry in the slot where it is due after delay ticks.
+        :param entry: a list with the turns left, the period in ticks and the task.
+        :param delay: the number of ticks until it is due.
+        """
+        n = len(self.slots)
+        entry[0] = (delay - 1) // n
+        self.slots[(self.position + delay) % n].append(entry)
+
+    def advance(self):
+        """Move to the next tick.
+        :returns: a list with the tasks due at this tick.
+        """
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        self.slots[self.position] = []
+        due = []
+        for entry in slot:
+            if entry[0] == 0:
+                due.append(entry)
+            else:
+                entry[0] -= 1
+                self.slots[self.position].append(entry)
+        for entry in due:
+            self.insert(entry, entry[1])
+        return [entry[2] for entry in due]
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+This module implements BpftraceSession, a long-lived bpftrace process that counts the bytes
+read and written by every process and thread of the host. The counters are printed as JSON
+lines at a fixed interval and parsed as they arrive into a timestamped buffer, so any number
+of meters can get the disk I/O of their own processes during their time window without
+starting bpftrace each time. The forks are traced too, so the bytes of children that exit
+before a meter ends are still attributed to it.
+"""
+import atexit
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from .buffers import SampleBuffer
+
+
+def parse_bpftrace_line(line):
+    """Parse a line printed by bpftrace -f json running BpftraceSession.SCRIPT.
+    :param line: a line of the output of bpftrace (str or bytes).
+    :returns: a tuple (map name, {(pid, tid): value}) for the maps printed by the script,
+        ("attached_probes", number of probes) when bpftrace is ready, or None for any other
+        line.
+    """
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(message, dict):
+        return None
+    if message.get("type") == "attached_probes":
+        return "attached_probes", message.get("data", {}).get("probes", 0)
+    if message.get("type") != "map":
+        return None
+
+    counters = {}
+    for name, values in message.get("data", {}).items():
+        for key, value in values.items():
+            # Maps indexed by [pid, tid] (or [parent pid, child pid]) are printed with keys
+            # "pid,tid".
+            ids = [int(i) for i in str(key).split(",")]
+            counters[(ids[0], ids[-1])] = value
+        return name, counters
+    return None
+
+
+class BpftraceSession:
+    """Runs bpftrace in the background, counting the bytes returned by the read and write
+    syscalls per process and thread (pid, tid). Every INTERVAL_MS milliseconds the counters
+    are printed and cleared, and a thread adds up the threads of each process into a
+    SampleBuffer of rows (pid, read bytes, written bytes) timestamped with the time at which
+    they were received. Each row thus counts the bytes of the interval that ended at its
+    timestamp. The parent of every process forked is recorded too, see forked_from.
+
+    Rows are only kept while they can be needed: every TRIM_SECONDS, the rows (and forks)
+    older than the oldest meter that holds the session (see hold) and older than
+    RETENTION_SECONDS are dropped.
+    """
+
+    INTERVAL_MS = 100
+    SCRIPT = (
+        "tracepoint:syscalls:sys_exit_read /args->ret > 0/ {{@rbytes[pid, tid] = sum(args->ret);}} "
+        "tracepoint:syscalls:sys_exit_write /args->ret > 0/ {{@wbytes[pid, tid] = sum(args->ret);}} "
+        "tracepoint:sched:sched_process_fork {{@forks[pid, args->child_pid] = count();}} "
+        "interval:ms:{interval} {{print(@forks); print(@rbytes); print(@wbytes); "
+        "clear(@forks); clear(@rbytes); clear(@wbytes);}}"
+    )
+    STARTUP_TIMEOUT = 10
+    RETENTION_SECONDS = 60
+    TRIM_SECONDS = 10
+
+    def __init__(self, interval_ms=None, command=None):
+        """Init the session, bpftrace is not started until start() is called.
+        :param interval_ms: the interval at which counters are printed, in milliseconds.
+            Defaults to INTERVAL_MS.
+        :param command: the command that runs bpftrace. Defaults to running SCRIPT with
+            sudo bpftrace, this can be changed to replay recorded output, e.g. for testing.
+        """
+        interval_ms = interval_ms or BpftraceSession.INTERVAL_MS
+        self.interval = interval_ms / 1000
+        if command is None:
+            script = BpftraceSession.SCRIPT.format(interval=interval_ms)
+            command = shlex.split("sudo bpftrace -B line -f json -e '{}'".format(script))
+        self.command = command
+        self.samples = SampleBuffer(3)
+        # The bytes read in the current interval, until the bytes written are printed.
+        self.pending_rbytes = {}
+        # Child pid -> (parent pid, time at which the fork was received).
+        self.forks = {}
+        # The start time of each meter that holds the session.
+        self.holders = []
+        self.trimmed_at = None
+        self.condition = threading.Condition()
+        self.attached = threading.Event()
+        self.last_timestamp = -np.inf
+        self.popen = None
+        self.thread = None
+
+    def start(self):
+        """Start bpftrace and wait until its probes are attached.
+        """
+        self.popen = subprocess.Popen(
+            self.command, stdout=subprocess.PIPE, preexec_fn=os.setpgrp
+        )
+        self.thread = threading.Thread(target=self.read_output, name="bpftrace Reading Thread",
+                                       daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+        self.attached.wait(BpftraceSession.STARTUP_TIMEOUT)
+
+    def read_output(self):
+        """Parse the output of bpftrace line by line until it finishes.
+        """
+        for line in self.popen.stdout:
+            self.feed(line, time.time())
+        self.popen.wait()
+        with self.condition:
+            self.attached.set()
+            self.condition.notify_all()
+
+    def feed(self, line, timestamp):
+        """Parse a line of the output of bpftrace and store its counters.
+        :param line: the line printed by bpftrace.
+        :param timestamp: the time at which the line was received.
+        """
+        parsed = parse_bpftrace_line(line)
+        if parsed is None:
+            return
+        name, counters = parsed
+        if name == "attached_probes":
+            self.attached.set()
+            return
+
+        with self.condition:
+            if name == "@forks":
+                for parent, child in counters:
+                    self.forks[child] = (parent, timestamp)
+            elif name == "@rbytes":
+                self.pending_rbytes = counters
+            elif name == "@wbytes":
+                # The written bytes are the last map printed in each interval.
+                totals = {}
+                for (pid, _), value in self.pending_rbytes.items():
+                    totals.setdefault(pid, [0, 0])[0] += value
+                for (pid, _), value in counters.items():
+                    totals.setdefault(pid, [0, 0])[1] += value
+                for pid, (rbytes, wbytes) in totals.items():
+                    self.samples.append(timestamp, [pid, rbytes, wbytes])
+                self.pending_rbytes = {}
+                self.last_timestamp = timestamp
+                self.condition.notify_all()
+                if self.trimmed_at is None:
+                    self.trimmed_at = timestamp
+                elif timestamp - self.trimmed_at >= BpftraceSession.TRIM_SECONDS:
+                    self.trim(timestamp)
+
+    def trim(self, timestamp):
+        """Drop the rows and forks that no meter can need anymore. The caller must hold the
+        condition.
+        :param timestamp: the current time.
+        """
+        cutoff = min(self.holders + [timestamp - BpftraceSession.RETENTION_SECONDS])
+        timestamps, values = self.samples.get()
+        # Rows ending after cutoff overlap windows that begin at cutoff. A new buffer is
+        # allocated, as views of the old one may be in use by bytes_between.
+        first = np.searchsorted(timestamps, cutoff, side="right")
+        samples = SampleBuffer(3, max(2 * (len(timestamps) - first), 1))
+        samples.timestamps[:len(timestamps) - first] = timestamps[first:]
+        samples.values[:len(timestamps) - first] = values[first:]
+        samples.n_samples = len(timestamps) - first
+        self.samples = samples
+        self.forks = {child: fork for child, fork in self.forks.items() if fork[1] > cutoff}
+        self.trimmed_at = timestamp
+
+    def hold(self, start_time):
+        """Keep the rows from start_time on until release is called, e.g. while a meter runs.
+        :param start_time: the beginning of the window of the meter.
+        """
+        with self.condition:
+            self.holders.append(start_time)
+
+    def release(self, start_time):
+        """Allow the rows kept for a meter to be dropped.
+        :param start_time: the time given to hold.
+        """
+        with self.condition:
+            self.holders.remove(start_time)
+
+    def forked_from(self, pids):
+        """Get the processes forked by some processes (and by their children, recursively)
+        since the oldest forks kept, including those that have already exited.
+        :param pids: the processes.
+        :returns: a set with the pids of the processes and of their descendants.
+        """
+        with self.condition:
+            children = {}
+            for child, (parent, _) in self.forks.items():
+                children.setdefault(parent, []).append(child)
+        tree = set(pids)
+        pending = list(tree)
+        while pending:
+            for child in children.get(pending.pop(), []):
+                if child not in tree:
+                    tree.add(child)
+                    pending.append(child)
+        return tree
+
+    def is_running(self):
+        """Check if bpftrace is running.
+        :returns: True if bpftrace was started and has not finished.
+        """
+        return self.popen is not None and self.popen.poll() is None
+
+    def wait_for(self, timestamp, timeout=None):
+        """Wait until the counters of the interval that contains timestamp are received.
+        :param timestamp: the time that must be covered by the counters.
+        :param timeout: the maximum number of seconds to wait. Defaults to two intervals plus
+            one second.
+        """
+        deadline = time.monotonic() + (timeout or 2 * self.interval + 1)
+        with self.condition:
+            while self.last_timestamp < timestamp and self.is_running():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+    def bytes_between(self, start_time, end_time, pids=None):
+        """Get the bytes read and written between start_time and end_time. The counters of an
+        interval that only partially overlaps the window are prorated.
+        :param start_time: the beginning of the window.
+        :param end_time: the end of the window.
+        :param pids: the processes whose bytes are counted. Defaults to all processes.
+        :returns: the total bytes read (float) and the total bytes written (float).
+        """
+        with self.condition:
+            timestamps, values = self.samples.get()
+        # Only intervals ending after start_time and starting before end_time overlap.
+        lo = np.searchsorted(timestamps, start_time, side="right")
+        hi = np.searchsorted(timestamps, end_time + self.interval, side="right")
+        timestamps, values = timestamps[lo:hi], values[lo:hi]
+
+        overlap = (np.minimum(timestamps, end_time)
+                   - np.maximum(timestamps - self.interval, start_time))
+        weights = np.clip(overlap, 0, self.interval) / self.interval
+        if pids is not None:
+            weights = weights * np.isin(values[:, 0], list(pids))
+        return float(weights @ values[:, 1]), float(weights @ values[:, 2])
+
+    def stop(self):
+        """Stop bpftrace. As it runs with sudo, it is killed with sudo too.
+        """
+        if not self.is_running():
+            return
+        if self.command[0] == "sudo":
+            subprocess.run(shlex.split("sudo kill {}".format(self.popen.pid)),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            self.popen.terminate()
+        self.popen.wait()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_bpftrace_session():
+    """Get the bpftrace session shared by the whole process, starting it if it is not running.
+    :returns: the BpftraceSession.
+    """
+    global _session
+    with _session_lock:
+        if _session is None or not _session.is_running():
+            _session = BpftraceSession()
+            try:
+                _session.start()
+            except OSError:
+                print("bpftrace could not be started, no disk energy metrics are available!")
+        return _session
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+This module implements SampleBuffer, the array-backed storage used by the samplers to keep
+timestamped samples without growing Python lists.
+"""
+import numpy as np
+
+
+class SampleBuffer:
+    """Preallocated NumPy buffers for timestamped samples with a fixed number of columns.
+    When the buffers are full, their capacity is doubled, so appending a sample is amortized
+    O(1) and never allocates Python objects. Views returned by get() remain valid after the
+    buffers grow, as samples are never modified once appended.
+    """
+
+    INITIAL_CAPACITY = 4096
+
+    def __init__(self, n_columns, capacity=None):
+        """Allocate the buffers.
+        :param n_columns: the number of values stored with each timestamp.
+        :param capacity: the number of samples initially allocated. Defaults to
+            INITIAL_CAPACITY.
+        """
+        capacity = capacity or SampleBuffer.INITIAL_CAPACITY
+        self.timestamps = np.empty(capacity)
+        self.values = np.empty((capacity, n_columns))
+        self.n_samples = 0
+
+    def __len__(self):
+        return self.n_samples
+
+    def append(self, timestamp, row):
+        """Append a sample. This is not thread-safe, callers that share the buffer between
+        threads must hold a lock.
+        :param timestamp: the time at which the sample was taken.
+        :param row: the value of each column.
+        """
+        if self.n_samples == len(self.timestamps):
+            self.timestamps = np.concatenate([self.timestamps, np.empty(len(self.timestamps))])
+            self.values = np.concatenate([self.values, np.empty(self.values.shape)])
+        self.timestamps[self.n_samples] = timestamp
+        self.values[self.n_samples] = row
+        self.n_samples += 1
+
+    def get(self, start_time=None, end_time=None):
+        """Get the samples stored so far, or those that cover a window.
+        :param start_time: the beginning of the window, the latest sample taken at or before
+            it is the first returned. Defaults to the first sample.
+        :param end_time: the end of the window, the earliest sample taken at or after it is
+            the last returned. Defaults to the last sample.
+        :returns: a view of the timestamps and a view of the values (one row per sample).
+        """
+        n = self.n_samples
+        timestamps, values = self.timestamps[:n], self.values[:n]
+        covering = window(timestamps, start_time, end_time)
+        return timestamps[covering], values[covering]
+
+    def last_timestamp(self):
+        """Get the time of the latest sample.
+        :returns: the timestamp of the latest sample or -inf if there are no samples yet.
+        """
+        if self.n_samples == 0:
+            return -np.inf
+        return self.timestamps[self.n_samples - 1]
+
+    def counters_at(self, timestamp):
+        """Get the (cumulative) values at timestamp, interpolating linearly between the two
+        closest samples and clamping times outside the samples.
+        :param timestamp: the time at which the values are required.
+        :returns: an array with the value of each column.
+        """
+        timestamps, counters = self.get()
+        n = len(timestamps)
+        i = np.searchsorted(timestamps, timestamp, side="right")
+        if i == 0:
+            return counters[0].copy()
+        if i == n:
+            return counters[n - 1].copy()
+        w = (timestamp - timestamps[i - 1]) / (timestamps[i] - timestamps[i - 1])
+        return counters[i - 1] + w * (counters[i] - counters[i - 1])
+
+
+def window(timestamps, start_time=None, end_time=None):
+    """Get the samples needed to interpolate at any time of a window.
+    :param timestamps: the sorted timestamps of the samples.
+    :param start_time: the beginning of the window, None for the first sample.
+    :param end_time: the end of the window, None for the last sample.
+    :returns: a slice from the latest sample at or before start_time to the earliest sample
+        at or after end_time.
+    """
+    first = 0 if start_time is None else max(
+        np.searchsorted(timestamps, start_time, side="right") - 1, 0)
+    last = len(timestamps) if end_time is None else np.searchsorted(
+        timestamps, end_time, side="left") + 1
+    return slice(first, last)
+
+
+def trapezoid(values, timestamps):
+    """Integrate values over timestamps with the trapezoidal rule.
+    :param values: the values sampled at each timestamp.
+    :param timestamps: the times at which values were sampled.
+    :returns: an array with the integral of each segment between consecutive samples.
+    """
+    return (values[1:] + values[:-1]) / 2 * np.diff(timestamps)
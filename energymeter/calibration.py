@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+This module measures the sequential and random read and write throughput of a disk with
+direct I/O on a temporary file, and keeps the results in a profile per device, keyed by
+its model and serial number. EnergyMeter and SharedEnergyMeter load the profile of the disk
+where the current directory is when disk speeds are not given, so disk_avg_speed does not
+have to be measured by hand. As disks have no power sensors, their active and idle power
+(usually found in their specs) can be stored in the profile too.
+
+Run it with:
+    python -m energymeter.calibration --directory /data --active-power 6 --idle-power 1.42
+"""
+import argparse
+import json
+import mmap
+import os
+import random
+import tempfile
+import time
+
+PROFILE_VERSION = 1
+BLOCK_SIZE = 1024 * 1024
+RANDOM_BLOCK_SIZE = 4096
+FILE_SIZE = 1024 ** 3
+SECONDS_PER_TEST = 5.0
+
+# Profile field -> meter parameter.
+PARAMETERS = {"read_speed": "disk_read_speed", "write_speed": "disk_write_speed",
+              "active_power": "disk_active_power", "idle_power": "disk_idle_power"}
+
+# (device or path, file with the profiles) -> profile or None, see cached_disk_profile.
+_profile_cache = {}
+
+
+def profiles_path():
+    """Get the file where the profiles are cached, ENERGYMETER_DISK_PROFILES if set, or
+    energymeter/disk_profiles.json in the user's cache directory.
+    :returns: the path.
+    """
+    if os.environ.get("ENERGYMETER_DISK_PROFILES"):
+        return os.environ["ENERGYMETER_DISK_PROFILES"]
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "energymeter", "disk_profiles.json")
+
+
+def device_for_path(path, sys_root="/sys"):
+    """Get the whole block device where a file or directory is stored.
+    :param path: the file or directory.
+    :param sys_root: the path where sysfs is mounted.
+    :returns: the name of the device, e.g. nvme0n1, or None if it is not a block device
+        (e.g. tmpfs or overlay file systems).
+    """
+    dev = os.stat(path).st_dev
+    block = os.path.join(sys_root, "dev", "block", "{}:{}".format(os.major(dev), os.minor(dev)))
+    if not os.path.exists(block):
+        return None
+    block = os.path.realpath(block)
+    # Partitions are subdirectories of their disk.
+    if os.path.exists(os.path.join(block, "partition")):
+        block = os.path.dirname(block)
+    return os.path.basename(block)
+
+
+def read_sysfs(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def device_identity(device, sys_root="/sys"):
+    """Get the model and serial number of a block device.
+    :param device: the name of the device, e.g. sda.
+    :param sys_root: the path where sysfs is mounted.
+    :returns: a tuple with the model and the serial number (empty if unknown).
+    """
+    base = os.path.join(sys_root, "block", device, "device")
+    model = (read_sysfs(os.path.join(base, "model")) or b"").decode(errors="replace").strip()
+    serial = read_sysfs(os.path.join(base, "serial"))
+    if serial is None:
+        # SCSI and SATA disks expose the serial number in the unit serial number page.
+        page = read_sysfs(os.path.join(base, "vpd_pg80"))
+        serial = page[4:] if page else b""
+    return model or device, serial.decode(errors="replace").strip("\x00 \n")
+
+
+def profile_key(model, serial):
+    return "{}:{}".format(model, serial)
+
+
+def load_profiles(path=None):
+    """Load the cached profiles.
+    :param path: the file. Defaults to profiles_path().
+    :returns: a dictionary mapping the key of each device to its profile.
+    """
+    path = path or profiles_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != PROFILE_VERSION:
+        raise Exception("Unsupported disk profile version in {}.".format(path))
+    return data["devices"]
+
+
+def save_profile(profile, path=None):
+    """Add or replace the profile of a device in the cache.
+    :param profile: the profile, see calibrate.
+    :param path: the file. Defaults to profiles_path().
+    """
+    path = path or profiles_path()
+    devices = load_profiles(path)
+    devices[profile_key(profile["model"], profile["serial"])] = profile
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"version": PROFILE_VERSION, "devices": devices}, f, indent=2, sort_keys=True)
+        f.write("\n")
+    _profile_cache.clear()
+
+
+def find_disk_profile(device=None, path=None, sys_root="/sys"):
+    """Find the cached profile of a device.
+    :param device: the name of the device (e.g. nvme0n1) or a path stored in it. Defaults
+        to the device of the current directory.
+    :param path: the file with the profiles. Defaults to profiles_path().
+    :param sys_root: the path where sysfs is mounted.
+    :returns: the profile, or None if the device is unknown or was not calibrated.
+    """
+    try:
+        if device is None or os.path.sep in device:
+            device = device_for_path(device or os.getcwd(), sys_root)
+        if device is None:
+            return None
+        return load_profiles(path).get(profile_key(*device_identity(device, sys_root)))
+    except Exception:
+        return None
+
+
+def cached_disk_profile(device=None):
+    """Find the cached profile of a device once per process, so constructing meters does not
+    read sysfs and the profiles every time. Saving a profile clears the cache.
+    :param device: the device, see find_disk_profile.
+    :returns: the profile, or None if the device is unknown or was not calibrated.
+    """
+    key = (device or os.getcwd(), profiles_path())
+    if key not in _profile_cache:
+        _profile_cache[key] = find_disk_profile(device)
+    return _profile_cache[key]
+
+
+def complete_disk_parameters(device=None, **parameters):
+    """Fill the disk parameters of a meter that were not given from the profile of a device.
+    :param device: the device, see find_disk_profile.
+    :param parameters: the values of disk_read_speed, disk_write_speed, disk_active_power
+        and disk_idle_power, None if they were not given.
+    :returns: a dictionary with the values of the parameters.
+    """
+    profile = cached_disk_profile(device) or {}
+    for field, name in PARAMETERS.items():
+        if parameters.get(name) is None:
+            parameters[name] = profile.get(field)
+    return parameters
+
+
+def run_io(fd, write, offsets, block_size, seconds):
+    """Read or write blocks at some offsets until they are done or time runs out.
+    :param fd: the file descriptor.
+    :param write: True to write, False to read.
+    :param offsets: the offset of each block.
+    :param block_size: the size of each block, a multiple of the logical block size of the
+        device for direct I/O.
+    :param seconds: the maximum duration.
+    :returns: the bytes transferred and the seconds it took.
+    """
+    # Anonymous maps are page-aligned, as direct I/O requires.
+    buffer = mmap.mmap(-1, block_size)
+    if write:
+        buffer.write(os.urandom(block_size))
+    transferred = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    for offset in offsets:
+        if write:
+            transferred += os.pwrite(fd, buffer, offset)
+        else:
+            transferred += os.preadv(fd, [buffer], offset)
+        if time.perf_counter() > deadline:
+            break
+    if write:
+        os.fsync(fd)
+    return transferred, time.perf_counter() - start
+
+
+def measure_throughput(directory, size=None, seconds=None, block_size=None,
+                       random_block_size=None, direct=True):
+    """Measure the throughput of the disk where a directory is stored, on a temporary file.
+    The file is written sequentially, read sequentially, and then written and read at
+    random offsets.
+    :param directory: the directory.
+    :param size: the size of the file. Defaults to FILE_SIZE.
+    :param seconds: the maximum duration of each test. Defaults to SECONDS_PER_TEST.
+    :param block_size: the size of the sequential requests. Defaults to BLOCK_SIZE.
+    :param random_block_size: the size of the random requests. Defaults to RANDOM_BLOCK_SIZE.
+    :param direct: if the page cache is bypassed with O_DIRECT. Without it, the file is
+        dropped from the cache before reading, which only approximates direct I/O.
+    :returns: a dictionary with the bytes per second of the sequential and random reads and
+        writes.
+    """
+    size = size or FILE_SIZE
+    seconds = seconds or SECONDS_PER_TEST
+    block_size = block_size or BLOCK_SIZE
+    random_block_size = random_block_size or RANDOM_BLOCK_SIZE
+
+    handle, path = tempfile.mkstemp(prefix=".energymeter-calibration-", dir=directory)
+    os.close(handle)
+    flags = os.O_RDWR | (os.O_DIRECT if direct else 0)
+    try:
+        try:
+            fd = os.open(path, flags)
+        except OSError as e:
+            raise Exception("Direct I/O is not supported in {} ({}), calibrate with "
+                            "direct=False.".format(directory, e))
+        try:
+            speeds = {}
+            written, elapsed = run_io(fd, True, range(0, size, block_size), block_size, seconds)
+            speeds["write_speed"] = written / elapsed
+            # The rest of tests use the part of the file that was written.
+            size = written
+            if not direct:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            read, elapsed = run_io(fd, False, range(0, size, block_size), block_size, seconds)
+            speeds["read_speed"] = read / elapsed
+
+            blocks = max(size // random_block_size, 1)
+            for name, write in (("random_write_speed", True), ("random_read_speed", False)):
+                if not direct:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                offsets = (random.randrange(blocks) * random_block_size for _ in range(blocks))
+                done, elapsed = run_io(fd, write, offsets, random_block_size, seconds)
+                speeds[name] = done / elapsed
+            return speeds
+        finally:
+            os.close(fd)
+    finally:
+        os.remove(path)
+
+
+def calibrate(directory=".", active_power=None, idle_power=None, sys_root="/sys", **options):
+    """Measure the disk where a directory is stored and build its profile.
+    :param directory: the directory.
+    :param active_power: the power used by the disk when active, in Watts, e.g. from its
+        specs.
+    :param idle_power: the power used by the disk when idle, in Watts.
+    :param sys_root: the path where sysfs is mounted.
+    :param options: see measure_throughput.
+    :returns: the profile, a dictionary with the device, model, serial, speeds (in bytes per
+        second), powers and the time of the calibration.
+    """
+    device = device_for_path(directory, sys_root)
+    if device is None:
+        raise Exception("{} is not stored in a block device.".format(directory))
+    model, serial = device_identity(device, sys_root)
+    profile = {"device": device, "model": model, "serial": serial,
+               "active_power": active_power, "idle_power": idle_power,
+               "calibrated_at": time.time()}
+    profile.update(measure_throughput(directory, **options))
+    return profile
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of a disk and store its profile for EnergyMeter.")
+    parser.add_argument("--directory", default=".",
+                        help="a directory in the disk, where a temporary file is written.")
+    parser.add_argument("--size", type=int, default=FILE_SIZE,
+                        help="the size of the temporary file in bytes.")
+    parser.add_argument("--seconds", type=float, default=SECONDS_PER_TEST,
+                        help="the maximum duration of each test.")
+    parser.add_argument("--active-power", type=float, default=None,
+                        help="the power of the disk when active, in Watts.")
+    parser.add_argument("--idle-power", type=float, default=None,
+                        help="the power of the disk when idle, in Watts.")
+    parser.add_argument("--no-direct", action="store_true",
+                        help="do not use direct I/O, for file systems that do not support it.")
+    parser.add_argument("--sys-root", default="/sys", help="the path where sysfs is mounted.")
+    parser.add_argument("--profiles", default=None,
+                        help="the file where profiles are stored (default {}).".format(
+                            profiles_path()))
+    args = parser.parse_args(args)
+
+    profile = calibrate(args.directory, args.active_power, args.idle_power, args.sys_root,
+                        size=args.size, seconds=args.seconds, direct=not args.no_direct)
+    save_profile(profile, args.profiles)
+    print("{} ({} {}):".format(profile["device"], profile["model"], profile["serial"]))
+    for name in ("read_speed", "write_speed", "random_read_speed", "random_write_speed"):
+        print("  {}: {:.1f} MB/s".format(name, profile[name] / 1e6))
+    print("Profile saved to {}.".format(args.profiles or profiles_path()))
+
+
+if __name__ == "__main__":
+    main()
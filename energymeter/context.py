@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+This module implements the context manager and decorator interfaces of the meters. The meter
+that is running in the current thread or asyncio task is tracked with a context variable, so
+each task of an asyncio application sees its own meter even when tasks are interleaved.
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+
+current_meter = contextvars.ContextVar("current_meter", default=None)
+
+
+def get_current_meter():
+    """Get the innermost meter running in the current thread or asyncio task.
+    :returns: the meter or None if no meter is running.
+    """
+    return current_meter.get()
+
+
+class MeterContext:
+    """Mixin that lets meters be used as `with meter:` and `async with meter:`, calling begin()
+    when entering and end() when exiting. Meters whose begin() or end() may block (e.g. waiting
+    for a sampling thread) set BLOCKING to True, so that they are run in a thread of the event
+    loop's executor and do not block the event loop. It also provides measure(), which
+    repeats a function under the meter until its energy per call is known precisely.
+    """
+
+    BLOCKING = False
+
+    def __enter__(self):
+        self.begin()
+        self.context_token = current_meter.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+        current_meter.reset(self.context_token)
+        return False
+
+    async def __aenter__(self):
+        if self.BLOCKING:
+            await asyncio.get_running_loop().run_in_executor(None, self.begin)
+        else:
+            self.begin()
+        self.context_token = current_meter.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.BLOCKING:
+            await asyncio.get_running_loop().run_in_executor(None, self.end)
+        else:
+            self.end()
+        current_meter.reset(self.context_token)
+        return False
+
+    def measure(self, fn, *args, **options):
+        """Measure the energy per call of fn, with warmup runs, subtracting the idle power of
+        the host and repeating runs until the confidence interval is narrow enough. The
+        meter is restarted for every run, see runner.measure for the options.
+
+            em = EnergyMeter(ignore_disk=True)
+            result = em.measure(model, batch, target_ci=0.02)
+            print(result["joules_per_call"], result["ci"])
+
+        :param fn: the function.
+        :param args: the positional arguments of fn.
+        :param options: the options of runner.measure and the keyword arguments of fn, in
+            kwargs.
+        :returns: a dictionary with the statistics of the joules per call, see runner.measure.
+        """
+        from .runner import measure
+        return measure(self, fn, args, **options)
+
+
+def measure_energy(_func=None, *, meter_cls=None, callback=None, **meter_kwargs):
+    """Decorator that measures the energy of every call to a function or coroutine function
+    with a new meter.
+
+        @measure_energy(ignore_disk=True, callback=lambda m: print(m.get_total_joules_per_component()))
+        async def handle(request):
+            ...
+
+    :param meter_cls: the class of the meters. Defaults to SharedEnergyMeter, which is cheap
+        enough to wrap each request handler.
+    :param callback: a function called with the meter after each call, even if the call
+        raised an exception. If None, the meter of the latest call is kept in the attribute
+        last_meter of the decorated function.
+    :param meter_kwargs: the parameters used to create the meters, e.g. label or ignore_disk.
+    """
+    def decorator(func):
+        cls = meter_cls
+        if cls is None:
+            from .sampler import SharedEnergyMeter
+            cls = SharedEnergyMeter
+        kwargs = dict(meter_kwargs)
+        kwargs.setdefault("label", func.__qualname__)
+
+        def finish(meter):
+            if callback is not None:
+                callback(meter)
+            else:
+                wrapper.last_meter = meter
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kw):
+                meter = cls(**kwargs)
+                try:
+                    async with meter:
+                        return await func(*args, **kw)
+                finally:
+                    finish(meter)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kw):
+                meter = cls(**kwargs)
+                try:
+                    with meter:
+                        return func(*args, **kw)
+                finally:
+                    finish(meter)
+
+        wrapper.last_meter = None
+        return wrapper
+
+    if _func is None:
+        return decorator
+    return decorator(_func)
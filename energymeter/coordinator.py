@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+"""
+This module measures the energy of many worker processes of the same node (e.g. the
+processes of a multiprocessing pool or the ranks started by torchrun) without counting the
+shared RAPL packages and GPUs once per process. A single Coordinator per node samples the
+counters and publishes them in shared memory. Workers register the intervals in which they
+work with CoordinatedMeters, and the energy of the node is split across the intervals of
+all workers by time overlap and weight, see attribution.apportion.
+"""
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .attribution import apportion
+from .backends import energy_components
+from .context import MeterContext
+
+DEFAULT_NAME = "energymeter"
+# Bytes reserved at the beginning of the samples segment for its JSON description.
+DESCRIPTION_BYTES = 4096
+# Columns of the intervals table.
+INTERVAL_COLUMNS = ["pid", "rank", "start_time", "end_time", "weight"]
+
+
+def attach_shared_memory(name):
+    """Attach to a shared memory segment created by another process, without letting this
+    process unlink it when it exits.
+    :param name: the name of the segment.
+    :returns: the SharedMemory.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    # Before Python 3.13, every process that attaches registers the segment with its
+    # resource tracker, which would unlink it when the worker exits.
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedSegments:
+    """The shared memory of a node: a ring buffer with the latest samples of the
+    coordinator's sampler, protected by a sequence counter, and a ring buffer of the
+    intervals registered by workers, protected by a file lock. Both are arrays of float64
+    preceded by two int64: a sequence counter (odd while a writer is modifying the buffer)
+    and the number of rows ever written.
+    """
+
+    def __init__(self, name, samples, intervals, description, owner):
+        """Map the segments.
+        :param name: the name of the node's segments.
+        :param samples: the SharedMemory of the samples.
+        :param intervals: the SharedMemory of the intervals.
+        :param description: a dictionary with the layout of the sampler's columns and the
+            capacity of the buffers.
+        :param owner: if this process created the segments and must unlink them.
+        """
+        self.name = name
+        self.samples_shm = samples
+        self.intervals_shm = intervals
+        self.owner = owner
+        self.layout = description["layout"]
+        self.n_columns = sum(len(columns) for columns in self.layout.values())
+        self.samples_header = np.ndarray(2, np.int64, samples.buf, DESCRIPTION_BYTES)
+        self.samples = np.ndarray((description["samples"], self.n_columns + 1), np.float64,
+                                  samples.buf, DESCRIPTION_BYTES + 16)
+        self.intervals_header = np.ndarray(2, np.int64, intervals.buf, 0)
+        self.intervals = np.ndarray((description["intervals"], len(INTERVAL_COLUMNS)),
+                                    np.float64, intervals.buf, 16)
+        self.lock_path = os.path.join(tempfile.gettempdir(), name + ".lock")
+
+    @staticmethod
+    def create(name, layout, samples, intervals):
+        """Create the segments of a node.
+        :param name: the name of the node's segments.
+        :param layout: the layout of the sampler's columns, see EnergySampler.layout.
+        :param samples: the number of samples kept in shared memory.
+        :param intervals: the number of intervals kept in shared memory.
+        :returns: the SharedSegments.
+        """
+        description = {"layout": layout, "samples": samples, "intervals": intervals}
+        encoded = json.dumps(description).encode()
+        if len(encoded) >= DESCRIPTION_BYTES:
+            raise Exception("The sampler has too many columns to be shared.")
+        n_columns = sum(len(columns) for columns in layout.values())
+        samples_shm = shared_memory.SharedMemory(
+            name + "-samples", create=True,
+            size=DESCRIPTION_BYTES + 16 + 8 * samples * (n_columns + 1))
+        intervals_shm = shared_memory.SharedMemory(
+            name + "-intervals", create=True, size=16 + 8 * intervals * len(INTERVAL_COLUMNS))
+        samples_shm.buf[:len(encoded)] = encoded
+        samples_shm.buf[len(encoded):DESCRIPTION_BYTES] = bytes(DESCRIPTION_BYTES - len(encoded))
+        segments = SharedSegments(name, samples_shm, intervals_shm, description, owner=True)
+        segments.samples_header[:] = 0
+        segments.intervals_header[:] = 0
+        return segments
+
+    @staticmethod
+    def attach(name):
+        """Attach to the segments created by the coordinator of the node.
+        :param name: the name of the node's segments.
+        :returns: the SharedSegments.
+        """
+        samples_shm = attach_shared_memory(name + "-samples")
+        intervals_shm = attach_shared_memory(name + "-intervals")
+        description = bytes(samples_shm.buf[:DESCRIPTION_BYTES]).rstrip(b"\0")
+        return SharedSegments(name, samples_shm, intervals_shm, json.loads(description),
+                              owner=False)
+
+    def publish(self, timestamp, row):
+        """Append a sample, this is only called by the coordinator's sampler.
+        :param timestamp: the time at which the sample was taken.
+        :param row: the counters of the sample.
+        """
+        header = self.samples_header
+        header[0] += 1
+        self.samples[header[1] % len(self.samples)] = [timestamp] + list(row)
+        header[1] += 1
+        header[0] += 1
+
+    def read_samples(self):
+        """Get a consistent copy of the samples kept in shared memory.
+        :returns: an array of timestamps and an array of counters (one row per sample).
+        """
+        header, capacity = self.samples_header, len(self.samples)
+        while True:
+            sequence = int(header[0])
+            if sequence % 2 == 0:
+                n = int(header[1])
+                rows = np.take(self.samples, np.arange(max(0, n - capacity), n) % capacity,
+                               axis=0)
+                if int(header[0]) == sequence:
+                    return rows[:, 0], rows[:, 1:]
+            time.sleep(0)
+
+    def locked(self):
+        """Get a file locked exclusively, so that one process at a time modifies the
+        intervals. The lock is released when the file is closed.
+        :returns: the open file.
+        """
+        f = open(self.lock_path, "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def register(self, pid, rank, start_time, weight):
+        """Register the interval of a worker that has begun.
+        :param pid: the pid of the worker.
+        :param rank: the rank of the worker, -1 if it has none.
+        :param start_time: the time at which the interval began.
+        :param weight: the weight of the interval.
+        :returns: the sequence number of the interval.
+        """
+        with self.locked():
+            n = int(self.intervals_header[1])
+            self.intervals[n % len(self.intervals)] = [pid, rank, start_time, np.nan, weight]
+            self.intervals_header[1] = n + 1
+        return n
+
+    def finish(self, number, end_time, weight=None):
+        """Set the end of an interval.
+        :param number: the sequence number of the interval.
+        :param end_time: the time at which the interval ended.
+        :param weight: the final weight of the interval, None to keep it.
+        """
+        with self.locked():
+            if int(self.intervals_header[1]) - number <= len(self.intervals):
+                row = self.intervals[number % len(self.intervals)]
+                row[3] = end_time
+                if weight is not None:
+                    row[4] = weight
+
+    def read_intervals(self):
+        """Get a copy of the intervals kept in shared memory.
+        :returns: an array with the sequence number of each interval and an array with a row
+            per interval with the columns INTERVAL_COLUMNS.
+        """
+        with self.locked():
+            n = int(self.intervals_header[1])
+            numbers = np.arange(max(0, n - len(self.intervals)), n)
+            return numbers, np.take(self.intervals, numbers % len(self.intervals), axis=0)
+
+    def close(self):
+        """Unmap the segments, and remove them if this process created them.
+        """
+        # The arrays must be released before the memory can be unmapped.
+        del self.samples_header, self.samples, self.intervals_header, self.intervals
+        for shm in (self.samples_shm, self.intervals_shm):
+            shm.close()
+            if self.owner:
+                shm.unlink()
+        if self.owner and os.path.exists(self.lock_path):
+            os.remove(self.lock_path)
+
+
+def split_energy(timestamps, counters, intervals):
+    """Split the energy of the node across intervals, intervals that have not ended are
+    considered to end at the latest sample.
+    :param timestamps: the timestamps of the samples.
+    :param counters: the counters of the samples.
+    :param intervals: an array with a row per interval with the columns INTERVAL_COLUMNS.
+    :returns: an array with a row per interval and its share of each column.
+    """
+    starts = intervals[:, 2]
+    ends = np.where(np.isnan(intervals[:, 3]), timestamps[-1], intervals[:, 3])
+    # Intervals that began after the latest sample have not used any energy yet.
+    ends = np.maximum(ends, starts)
+    durations = ends - starts
+    return apportion(timestamps, counters, starts, ends, intervals[:, 4] * durations)
+
+
+class Coordinator:
+    """Publishes the samples of an EnergySampler in shared memory and reports the energy of
+    the node and its split across the intervals registered by the workers. There must be one
+    Coordinator per node and name, e.g. created by the launcher or by rank 0.
+    """
+
+    SAMPLES = 36000
+    INTERVALS = 100000
+
+    def __init__(self, name=None, sampler=None, samples=None, intervals=None):
+        """Create the shared memory and start publishing samples.
+        :param name: the name of the shared memory, which workers use to find it. Defaults to
+            DEFAULT_NAME.
+        :param sampler: the EnergySampler whose samples are published. Defaults to the
+            process-wide sampler.
+        :param samples: the number of latest samples kept in shared memory. Defaults to
+            SAMPLES, i.e. one hour at the default sampling period.
+        :param intervals: the number of latest intervals kept in shared memory. Defaults to
+            INTERVALS.
+        """
+        if sampler is None:
+            from .sampler import get_sampler
+            sampler = get_sampler()
+        self.name = name or DEFAULT_NAME
+        self.sampler = sampler
+        self.segments = SharedSegments.create(self.name, sampler.layout,
+                                              samples or Coordinator.SAMPLES,
+                                              intervals or Coordinator.INTERVALS)
+        if len(sampler.buffer):
+            self.segments.publish(sampler.last_timestamp(),
+                                  sampler.counters_at(sampler.last_timestamp()))
+        # The same bound method must be given to remove_listener in close().
+        self.publish = self.segments.publish
+        sampler.add_listener(self.publish)
+
+    def report(self, start_time=None, end_time=None):
+        """Get the energy used by the node and by each worker.
+        :param start_time: the beginning of the report. Defaults to the beginning of the
+            first interval registered.
+        :param end_time: the end of the report. Defaults to the end of the last interval.
+        :returns: a dictionary with the energy of the node, the energy of each worker (by
+            rank, or by pid for workers without a rank) and the energy not attributed to any
+            worker. Each is a dictionary with an array per component.
+        """
+        _, intervals = self.segments.read_intervals()
+        running = np.isnan(intervals[:, 3])
+        if end_time is None:
+            end_time = (np.nanmax(intervals[:, 3]) if not running.any() and len(intervals)
+                        else time.time())
+        self.sampler.wait_for(end_time)
+        if start_time is None:
+            start_time = intervals[:, 2].min() if len(intervals) else end_time
+
+        # Only the energy of the report's window is split.
+        intervals = intervals.copy()
+        intervals[:, 2] = np.clip(intervals[:, 2], start_time, end_time)
+        intervals[:, 3] = np.clip(np.where(running, end_time, intervals[:, 3]),
+                                  start_time, end_time)
+        with self.sampler.condition:
+            timestamps, counters = self.sampler.buffer.get(start_time, end_time)
+        shares = split_energy(timestamps, counters, intervals)
+
+        # Only energy is split, the rest of columns (e.g. the bytes read and written or the
+        # CPU time) are those of the coordinator, not of the node.
+        components = energy_components(self.sampler.layout)
+        node = self.sampler.energy_between(start_time, end_time)
+        node = {name: node[name] for name in components}
+        workers = {}
+        keys = np.where(intervals[:, 1] >= 0, intervals[:, 1], intervals[:, 0]).astype(int)
+        for key in np.unique(keys):
+            total = shares[keys == key].sum(axis=0)
+            prefix = "rank" if intervals[keys == key][0, 1] >= 0 else "pid"
+            workers["{}{}".format(prefix, key)] = {
+                name: total[self.sampler.layout[name]] for name in components}
+        attributed = shares.sum(axis=0)
+        return {
+            "node": node,
+            "workers": workers,
+            "unattributed": {name: node[name] - attributed[self.sampler.layout[name]]
+                             for name in components},
+        }
+
+    def close(self):
+        """Stop publishing samples and remove the shared memory.
+        """
+        self.sampler.remove_listener(self.publish)
+        self.segments.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class CoordinatedMeter(MeterContext):
+    """A meter for worker processes, which registers the interval between begin() and end()
+    with the coordinator of the node. Its energy is its share of the energy of the node, split
+    across the intervals of all workers, so shared packages and GPUs are not counted more than
+    once. Shares are final once every interval that overlaps with it has ended.
+    """
+
+    TIMEOUT = 5.0
+
+    def __init__(self, label=None, name=None, weight=1.0, rank=None):
+        """Init the meter, nothing is shared until it begins.
+        :param label: this is just an optional string to identify the meter.
+        :param name: the name of the coordinator's shared memory. Defaults to DEFAULT_NAME.
+        :param weight: the weight of the meter per second, e.g. the tokens processed per
+            second. Defaults to 1, i.e. meters that run at the same time use the same energy.
+        :param rank: the rank of the worker. Defaults to the environment variable RANK set by
+            torchrun, or -1.
+        """
+        self.label = label or "Meter"
+        self.name = name or DEFAULT_NAME
+        self.weight = weight
+        self.rank = int(os.environ.get("RANK", -1)) if rank is None else rank
+        self.segments = None
+
+    def begin(self):
+        """Register the beginning of the interval with the coordinator.
+        """
+        if self.segments is None:
+            self.segments = get_segments(self.name)
+        self.start_time = time.time()
+        self.number = self.segments.register(os.getpid(), self.rank, self.start_time,
+                                             self.weight)
+
+    def end(self, weight=None):
+        """Register the end of the interval with the coordinator.
+        :param weight: the final weight of the meter per second, if it was not known when it
+            began.
+        """
+        self.end_time = time.time()
+        self.duration = self.end_time - self.start_time
+        if weight is not None:
+            self.weight = weight
+        self.segments.finish(self.number, self.end_time, weight)
+
+    def get_energy(self):
+        """Get the share of this meter of the energy used by the node, waiting for the
+        coordinator to publish a sample taken after the meter ended.
+        :returns: a dictionary with an array per component.
+        """
+        deadline = time.time() + CoordinatedMeter.TIMEOUT
+        while True:
+            timestamps, counters = self.segments.read_samples()
+            if len(timestamps) and timestamps[-1] >= self.end_time or time.time() > deadline:
+                break
+            time.sleep(0.01)
+        if len(timestamps) == 0:
+            raise Exception("The coordinator {} has not published any sample.".format(self.name))
+        numbers, intervals = self.segments.read_intervals()
+        shares = split_energy(timestamps, counters, intervals)
+        own = shares[numbers == self.number]
+        if len(own) == 0:
+            raise Exception("The interval of the meter is no longer kept by the coordinator.")
+        layout = self.segments.layout
+        return {name: own[0][layout[name]] for name in energy_components(layout)}
+
+
+_segments = {}
+
+
+def get_segments(name):
+    """Get the shared memory of a coordinator, attached once per process.
+    :param name: the name of the coordinator's shared memory.
+    :returns: the SharedSegments.
+    """
+    if name not in _segments:
+        _segments[name] = SharedSegments.attach(name)
+    return _segments[name]
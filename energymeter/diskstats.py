@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+This module implements DiskStatsReader, which reads the I/O statistics that the kernel keeps
+for each block device in /proc/diskstats (or /sys/block/<device>/stat). Unlike the syscalls
+traced with bpftrace, these only count the bytes that actually reached the device, not page
+cache hits, pipes or sockets, and include the time during which the device was busy
+(io_ticks). Reading them does not require root.
+"""
+import os
+import re
+import threading
+
+import numpy as np
+
+
+class DiskStatsReader:
+    """Reads the cumulative bytes read, bytes written and busy time of block devices. The
+    statistics files are kept open and re-read with os.pread, so polling them costs a single
+    syscall per file.
+    """
+
+    DEFAULT_PATH = "/proc/diskstats"
+    # The kernel reports sectors of 512 bytes regardless of the sector size of the device.
+    SECTOR_SIZE = 512
+    # Whole physical disks, this leaves out partitions (which would be counted twice) and
+    # virtual devices (loop, ram, device mapper...).
+    WHOLE_DISK_PATTERN = re.compile(r"^(sd[a-z]+|hd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme\d+n\d+|mmcblk\d+)$")
+
+    def __init__(self, path=None, devices=None):
+        """Open the statistics files and select the devices.
+        :param path: a file in the format of /proc/diskstats or a directory in the format of
+            /sys/block, i.e. with a file <device>/stat per device. Defaults to DEFAULT_PATH,
+            this can be changed to replay synthetic counters, e.g. for testing.
+        :param devices: the names of the devices to read, e.g. ["nvme0n1"]. Defaults to all
+            the whole disks found.
+        """
+        self.path = path or DiskStatsReader.DEFAULT_PATH
+        self.per_device_files = os.path.isdir(self.path)
+        if self.per_device_files:
+            available = sorted(os.listdir(self.path))
+        else:
+            self.fd = os.open(self.path, os.O_RDONLY)
+            available = list(self.read_fields())
+
+        if devices is None:
+            devices = [d for d in available if DiskStatsReader.WHOLE_DISK_PATTERN.match(d)]
+        missing = set(devices) - set(available)
+        if missing:
+            raise Exception("Devices {} were not found in {}.".format(sorted(missing), self.path))
+        self.devices = list(devices)
+
+        if self.per_device_files:
+            self.fds = [os.open(os.path.join(self.path, d, "stat"), os.O_RDONLY)
+                        for d in self.devices]
+
+    def read_fields(self):
+        """Read the statistics of every device in the diskstats file.
+        :returns: a dictionary with the list of statistics fields of each device.
+        """
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(self.fd, 65536, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        fields = {}
+        for line in b"".join(chunks).decode().splitlines():
+            # major minor name reads merged sectors_read ms_reading writes merged ...
+            parts = line.split()
+            if len(parts) >= 14:
+                fields[parts[2]] = parts[3:]
+        return fields
+
+    def read(self):
+        """Read the counters of the selected devices.
+        :returns: an array with one row per device and the columns bytes read, bytes written
+            and busy seconds.
+        """
+        if self.per_device_files:
+            fields = [os.pread(fd, 4096, 0).split() for fd in self.fds]
+        else:
+            all_fields = self.read_fields()
+            fields = [all_fields[d] for d in self.devices]
+        # Fields: 2 sectors read, 6 sectors written, 9 milliseconds spent doing I/O.
+        counters = np.array([[float(f[2]), float(f[6]), float(f[9])] for f in fields])
+        counters = counters.reshape(len(self.devices), 3)
+        counters[:, :2] *= DiskStatsReader.SECTOR_SIZE
+        counters[:, 2] *= 1e-3
+        return counters
+
+    def close(self):
+        """Close the statistics files.
+        """
+        if self.per_device_files:
+            for fd in self.fds:
+                os.close(fd)
+        else:
+            os.close(self.fd)
+
+
+def diskstats_joules(busy_seconds, devices, duration, disk_active_power, disk_idle_power,
+                     disk_power=None, include_idle=False):
+    """Estimate the energy used by each disk from the time it was busy.
+    :param busy_seconds: an array with the seconds each device was busy.
+    :param devices: the names of the devices.
+    :param duration: the duration of the measurement in seconds.
+    :param disk_active_power: the power used by a disk when active, in Watts.
+    :param disk_idle_power: the power used by a disk when idle, in Watts.
+    :param disk_power: a dictionary with the (active power, idle power) of devices whose power
+        differs from disk_active_power and disk_idle_power, e.g. {"sda": (6, 1.42)}.
+    :param include_idle: if the energy used while the disks were idle should be included.
+    :returns: a dictionary with the joules used by each device.
+    """
+    disk_power = disk_power or {}
+    joules = {}
+    for device, busy in zip(devices, busy_seconds):
+        active_power, idle_power = disk_power.get(device, (disk_active_power, disk_idle_power))
+        # io_ticks has a resolution of a jiffy, so it can slightly exceed the duration.
+        busy = min(busy, duration)
+        joules[device] = busy * active_power
+        if include_idle:
+            joules[device] += (duration - busy) * idle_power
+    return joules
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_diskstats_reader(path=None):
+    """Get the DiskStatsReader of the whole disks in path shared by the whole process, opening
+    it the first time it is requested.
+    :param path: the statistics file or directory, see DiskStatsReader.
+    :returns: the DiskStatsReader or None if the statistics are not accessible.
+    """
+    path = path or DiskStatsReader.DEFAULT_PATH
+    with _readers_lock:
+        if path not in _readers:
+            try:
+                _readers[path] = DiskStatsReader(path)
+            except Exception:
+                _readers[path] = None
+        return _readers[path]
@@ -4,28 +4,106 @@ This module implements the class EnergyMeter, to measure the energy consumption
 functions or code chunks, segregating their energy usage per component (CPU, DRAM, GPU and 
 Hard Disk). 
 """
-from datetime import datetime
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import pyRAPL
-from pynvml_utils import nvidia_smi
 
 import subprocess
-import os
 import shlex
-import json
-import pandas as pd
 import time
 import threading
 
+from .bpftrace import get_bpftrace_session
+from .buffers import SampleBuffer, trapezoid
+from .context import MeterContext
+from .diskstats import diskstats_joules, get_diskstats_reader
+from .nvml import NvmlReader
+from .procfs import ProcessShareReader, process_tree, usage_share
+from .rapl import get_rapl_reader
+
+def disk_joules(tot_bytes, duration, disk_avg_speed, disk_active_power, disk_idle_power,
+                include_idle=False, read_bytes=None, read_speed=None, write_speed=None):
+    """Estimate the energy used by the disk to read and write tot_bytes in duration seconds.
+    :param tot_bytes: the bytes read and written during the measurement.
+    :param duration: the duration of the measurement in seconds.
+    :param disk_avg_speed: the average read and write speed of the disk in bytes per second.
+    :param disk_active_power: the power used by the disk when active, in Watts.
+    :param disk_idle_power: the power used by the disk when idle, in Watts.
+    :param include_idle: if the energy used while the disk was idle should be included.
+    :param read_bytes: the part of tot_bytes that was read.
+    :param read_speed: the read speed of the disk in bytes per second. If read_bytes,
+        read_speed and write_speed are given, they are used instead of disk_avg_speed.
+    :param write_speed: the write speed of the disk in bytes per second.
+    :returns: the total joules used by the disk.
+    """
+    if read_bytes is not None and read_speed and write_speed:
+        # disk_active_time = bytes_read / READ_SPEED + bytes_written / WRITE_SPEED
+        disk_active_time = read_bytes / read_speed + (tot_bytes - read_bytes) / write_speed
+    else:
+        # disk_active_time (in seconds) = (bytes_read + bytes_written) / DISK_SPEED
+        disk_active_time = tot_bytes / disk_avg_speed
+
+    # disk_idle_time (in seconds) = total_meter_time - disk_active_time
+    disk_idle_time = duration - disk_active_time
+
+    # total_energy = disk_active_time * DISK_ACTIVE_POWER (+ disk_idle_time * DISK_IDLE_POWER)
+    te = disk_active_time * disk_active_power
+    if include_idle:
+        te += disk_idle_time * disk_idle_power
+    return te
+
+
+def check_disk_parameters(disk_backend, disk_avg_speed, disk_active_power, disk_idle_power,
+                          disk_power=None, disk_read_speed=None, disk_write_speed=None):
+    """Check that the parameters required to estimate the disk's energy were given.
+    :param disk_backend: "diskstats" if the disk's busy time is read from the kernel, or the
+        name of the backend that counts the bytes read and written.
+    :param disk_avg_speed: the average read and write speed of the disk in bytes per second.
+    :param disk_active_power: the power used by the disk when active, in Watts.
+    :param disk_idle_power: the power used by the disk when idle, in Watts.
+    :param disk_power: a dictionary with the (active power, idle power) of each device.
+    :param disk_read_speed: the read speed of the disk in bytes per second, which together
+        with disk_write_speed replaces disk_avg_speed.
+    :param disk_write_speed: the write speed of the disk in bytes per second.
+    """
+    if disk_read_speed is not None and disk_write_speed is not None:
+        disk_avg_speed = disk_avg_speed or (disk_read_speed + disk_write_speed) / 2
+    if disk_backend == "diskstats":
+        if disk_power is None and (disk_active_power is None or disk_idle_power is None):
+            raise Exception("disk_active_power and disk_idle_power (or disk_power) are necessary values if disk energy will be monitored with diskstats; if you want to ignore the disk, set ignore_disk=True when calling init.")
+    elif disk_avg_speed is None or disk_active_power is None or disk_idle_power is None:
+        raise Exception("disk_avg_speed (or disk_read_speed and disk_write_speed), disk_active_power, and disk_idle_power are necessary values if disk energy will be monitored; they can be measured and stored for this disk with python -m energymeter.calibration; if you want to ignore the disk, set ignore_disk=True when calling init.")
+
+
+def load_disk_parameters(disk_device, disk_avg_speed, disk_read_speed, disk_write_speed,
+                         disk_active_power, disk_idle_power):
+    """Complete the disk parameters that were not given with the profile of the disk stored
+    by python -m energymeter.calibration, if there is one.
+    :param disk_device: the device (e.g. nvme0n1) or a path stored in it. Defaults to the
+        device of the current directory.
+    :returns: a tuple with disk_read_speed, disk_write_speed, disk_active_power and
+        disk_idle_power.
+    """
+    missing_speed = disk_avg_speed is None and None in (disk_read_speed, disk_write_speed)
+    if missing_speed or None in (disk_active_power, disk_idle_power):
+        from .calibration import complete_disk_parameters
+
+        parameters = complete_disk_parameters(
+            disk_device, disk_read_speed=disk_read_speed, disk_write_speed=disk_write_speed,
+            disk_active_power=disk_active_power, disk_idle_power=disk_idle_power)
+        if missing_speed:
+            disk_read_speed = parameters["disk_read_speed"]
+            disk_write_speed = parameters["disk_write_speed"]
+        disk_active_power = parameters["disk_active_power"]
+        disk_idle_power = parameters["disk_idle_power"]
+    return disk_read_speed, disk_write_speed, disk_active_power, disk_idle_power
+
 
 class ThreadGpuSamplingCmd(threading.Thread):
     """Thread to sample the power draw of the GPU. It uses nvidia-smi via subprocess check_output 
     to get the immediate power draw of the GPU in Watts every SECONDS_BETWEEN_SAMPLES seconds 
     until self.stop is set to True. The samples are stored in the array self.power_draw_history.
-    Note that this process takes much longer than using pynvml (76ms vs. 1ms) but obtains also 
-    info about the processes running on the GPU while pynvml doesn't.
+    Note that this process takes much longer than using pynvml (76ms vs. 1ms). 
+    ThreadGpuSamplingPyNvml, which also obtains the utilization of the GPU by each process,
+    should be preferred.
     """
     
     SECONDS_BETWEEN_SAMPLES = 0.5
@@ -59,88 +137,183 @@ class ThreadGpuSamplingCmd(threading.Thread):
             self.activity_history.append(activity)
 
             # Sleep until next cycle.
-            time.sleep(ThreadGpuSampling.SECONDS_BETWEEN_SAMPLES)
+            time.sleep(ThreadGpuSamplingCmd.SECONDS_BETWEEN_SAMPLES)
 
 
 class ThreadGpuSamplingPyNvml(threading.Thread):
-    """Thread to sample the power draw of the GPU. It uses pynvml to get the immediate power
-    draw of the GPU in Watts every SECONDS_BETWEEN_SAMPLES seconds until self.stop is set to
-    True. The samples are stored in the array self.power_draw_history.
+    """Thread to sample the GPUs. It uses an NvmlReader to get, for every GPU in one pass, its
+    immediate power draw in Watts, its utilization, its utilization by this process and its
+    children, and its energy counter, every seconds_between_samples seconds until stop() is
+    called. Samples are taken on a fixed schedule, so the time spent querying the GPUs does not
+    make the sampling period drift, and the thread sleeps between samples. The samples are
+    stored with their timestamp in a SampleBuffer with a block of columns per quantity, each
+    with one column per device.
     """
     
-    SECONDS_BETWEEN_SAMPLES = 0.5
+    SECONDS_BETWEEN_SAMPLES = 0.1
     
-    def __init__(self, name):
-        """Init the thread variables and the nvsmi instance to be queried later on.
+    def __init__(self, name, seconds_between_samples=None, nvml=None):
+        """Init the thread variables, NVML is set up when the thread starts.
+        :param name: the name of the thread.
+        :param seconds_between_samples: the sampling period. Defaults to
+            SECONDS_BETWEEN_SAMPLES.
+        :param nvml: the NVML bindings, see NvmlReader.
         """
         threading.Thread.__init__(self)
         self.name = name
-        self.stop = False
-        self.power_draw_history = []
-        self.activity_history = []
-        self.nvsmi = nvidia_smi.getInstance()
+        self.seconds_between_samples = (seconds_between_samples or
+                                        ThreadGpuSamplingPyNvml.SECONDS_BETWEEN_SAMPLES)
+        self.stop_event = threading.Event()
+        self.nvml = nvml
+        self.reader = None
+        self.devices = []
+        self.samples = SampleBuffer(0)
+        self.lock = threading.Lock()
+
+        # Overhead of the sampler itself.
+        self.cpu_time = 0.0
+        self.missed_samples = 0
+        self.start_time = None
+        self.stop_time = None
+
+    @property
+    def power_draw_history(self):
+        return self.get_samples()[1].sum(axis=1)
+
+    @property
+    def activity_history(self):
+        return self.get_samples()[2].sum(axis=1)
+
+    def get_samples(self):
+        """Get the samples taken so far.
+        :returns: an array with the timestamps and 2D arrays, with a column per device, with
+            the power draws (W), the utilizations by this process (%) and the energy counters
+            (J, NaN if not supported by the device).
+        """
+        with self.lock:
+            timestamps, values = self.samples.get()
+        n = len(self.devices)
+        return timestamps, values[:, :n], values[:, 2 * n:3 * n], values[:, 3 * n:]
+
+    def sample(self):
+        """Query the state of all the GPUs and store it.
+        """
+        timestamp = time.time()
+        try:
+            rows = self.reader.read()
+        except Exception:
+            return
+        with self.lock:
+            # Store the columns of the reader (one row per device) as blocks of columns.
+            self.samples.append(timestamp, rows.T.ravel())
 
     def run(self):
-        """Start the sampling and stop when self.stop == True.
+        """Start the sampling and stop when stop() is called. A last sample is taken when
+        stopping, so the samples cover the whole time the thread was running.
         """
-        while self.stop == False:
-            nvml_output = self.nvsmi.DeviceQuery("power.draw,utilization.gpu").get("gpu")[0]
-            # Get power draw.
-            try:
-                self.power_draw_history.append(float(nvml_output.get("power_readings").get("power_draw")))
-            except:
-                pass
-            # Get utilization at each time step.
-            try:
-                self.activity_history.append(float(nvml_output.get("utilization").get("gpu_util")))
-            except:
-                pass
-
-
-class EnergyMeter:
+        cpu_start = time.thread_time()
+        self.start_time = time.time()
+        try:
+            self.reader = NvmlReader(self.nvml)
+        except Exception:
+            print("NVML is not accessible, no GPU energy metrics are available!")
+            return
+        with self.lock:
+            self.devices = self.reader.devices
+            self.samples = SampleBuffer(4 * len(self.devices))
+        next_time = time.monotonic()
+        while True:
+            self.sample()
+            next_time += self.seconds_between_samples
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                # Querying the GPU took longer than the period, so we skip the samples we
+                # missed instead of taking them in a burst.
+                self.missed_samples += int(-delay // self.seconds_between_samples) + 1
+                next_time = time.monotonic()
+                delay = 0
+            if self.stop_event.wait(delay):
+                break
+        self.sample()
+        self.reader.close()
+        self.stop_time = time.time()
+        self.cpu_time = time.thread_time() - cpu_start
+
+    def stop(self):
+        """Stop the sampling and wait until the thread finishes.
+        """
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def get_overhead(self):
+        """Get how many resources the sampling thread used.
+        :returns: a dictionary with the CPU seconds used by the thread, the fraction of a CPU
+            core that this represents, the number of samples taken and the number of samples
+            missed because querying the GPU took longer than the sampling period.
+        """
+        wall_time = (self.stop_time or time.time()) - (self.start_time or time.time())
+        return {
+            "cpu_seconds": self.cpu_time,
+            "cpu_fraction": self.cpu_time / wall_time if wall_time > 0 else 0.0,
+            "samples": len(self.samples),
+            "missed_samples": self.missed_samples,
+        }
+
+
+class EnergyMeter(MeterContext):
     """
     The consumption of each component is measured as follows:
 
-    - CPU: the energy consumption of the CPU is measured with RAPL via the pyRAPL
-        library. RAPL is an API from Intel, which is also semi-compatible with
+    - CPU: the energy consumption of the CPU is measured with RAPL, reading its
+        counters from the powercap interface. RAPL is an API from Intel, which is also semi-compatible with
         AMD. RAPL on Intel has been shown to be accurate thanks to the usage of
         embedded sensors in the processor and memory while AMD uses performance
         counters and is therefore, not so accurate.
 
-    - DRAM: the energy used by the memory is also measure with RAPL via pyRAPL.
+    - DRAM: the energy used by the memory is also measure with RAPL.
         This might not be available for AMD processors and pre-Haswell Intel
         processors. You can find more info here:
         https://dl.acm.org/doi/pdf/10.1145/2989081.2989088.
 
-    - GPU: we measure the energy consumption of the GPU with nvidia-smi. For this, we
-        run a separate thread that samples the power draw of the GPU while the meter
-        is running. We then calculate the mean of this and multiply it by the 
-        duration of the meter.
+    - GPU: we measure the energy consumption of every GPU with NVML. For this, we
+        run a separate thread that samples the energy counter (or the power draw, on
+        GPUs without energy counters) of all the GPUs while the meter is running. We
+        then take the difference of the counters, or integrate the power draw over the
+        timestamps of the samples with the trapezoidal rule, in the intervals in which
+        this process used each GPU.
 
     - Disk: we cannot directly measure the energy consumption of the disk in the same
         way that we do for the other components, so we have implemented an bpftrace
-        probe that tracks all the bytes read and written to disk. This probe is run 
-        as a separate thread inside EnergyMeter. We then calculate the energy 
-        consumption with the following formulae:
+        probe that tracks all the bytes read and written by each process. This probe
+        runs in a bpftrace session shared by all meters, see BpftraceSession, and each
+        meter counts the bytes of its process and children during its time window. We
+        then calculate the energy consumption with the following formulae:
         disk_active_time = (bytes_read + bytes_written) / DISK_SPEED
         disk_idle_time = total_meter_time - disk_active_time
         total_energy = disk_active_time * DISK_ACTIVE_POWER +
                         disk_idle_time * DISK_IDLE_POWER
         Note that you are required the provide the parameters DISK_SPEED,
         DISK_ACTIVE_POWER and DISK_IDLE_POWER.
+
+        Alternatively, with disk_backend="diskstats", the time during which each disk
+        was actually busy and the bytes that reached it are read from /proc/diskstats,
+        see DiskStatsReader. This does not require sudo nor DISK_SPEED and is not
+        fooled by reads served from the page cache, but it counts the I/O of all the
+        processes in the host.
     """
 
-    #################################### CONSTANTS ####################################
-    SCRIPT = (
-        "tracepoint:syscalls:sys_enter_write {@wbytes[comm] = sum(args->count);} "
-        "tracepoint:syscalls:sys_enter_read {@rbytes[comm] = sum(args->count);}"
-    )
-    ###################################################################################
+    # begin() may start bpftrace and end() waits for the sampling thread.
+    BLOCKING = True
 
     def __init__(self, disk_avg_speed=None, disk_active_power=None, disk_idle_power=None, 
-                 label=None, include_idle=False, ignore_disk=False):
+                 label=None, include_idle=False, ignore_disk=False,
+                 gpu_seconds_between_samples=None, rapl_root=None, disk_backend="bpftrace",
+                 disk_power=None, diskstats_path=None, nvml=None, bpftrace_session=None,
+                 attribute_to_process=False, proc_root="/proc", disk_read_speed=None,
+                 disk_write_speed=None, disk_device=None):
         """Initiates the variables required to meter the energy consumption of all
-        components and sets up the pyRAPL library.
+        components and opens the RAPL counters.
         :param disk_avg_speed: the average read and write speed of the hard disk where
             the code will be run. We recommend measuring this with a speed test such as
             this: https://cloud.google.com/compute/docs/disks/benchmarking-pd-performance.
@@ -154,6 +327,35 @@ class EnergyMeter:
             GPU.
         :param ignore_disk: False by default, when set to True, disk will not be tracked (used
             for compatibility with systems without access to sudo or bpftrace)
+        :param gpu_seconds_between_samples: the period at which the power draw of the GPU is
+            sampled. Defaults to ThreadGpuSamplingPyNvml.SECONDS_BETWEEN_SAMPLES.
+        :param rapl_root: the directory where the RAPL domains are found. Defaults to
+            RaplReader.DEFAULT_ROOT (/sys/class/powercap).
+        :param disk_backend: "bpftrace" (default) to estimate the disk's active time from the
+            bytes read and written by this process, or "diskstats" to read the busy time of
+            each disk from /proc/diskstats.
+        :param disk_power: with the diskstats backend, a dictionary with the (active power,
+            idle power) of the devices whose power differs from disk_active_power and
+            disk_idle_power, e.g. {"nvme0n1": (6, 1.42)}.
+        :param diskstats_path: the file or directory where the disk statistics are read, see
+            DiskStatsReader. Defaults to /proc/diskstats.
+        :param nvml: the NVML bindings used to sample the GPUs. Defaults to pynvml, this can be
+            changed to a fake module, e.g. energymeter.testing.FakeNvml.
+        :param bpftrace_session: the BpftraceSession that counts the bytes read and written.
+            Defaults to the session shared by the whole process, this can be changed to a
+            session running a fake command, e.g. energymeter.testing.fake_bpftrace_command.
+        :param attribute_to_process: if True, the CPU time and resident memory of this
+            process and its descendants and of the whole host are read when the meter begins
+            and ends, to attribute the CPU and DRAM energy of shared hosts to the process, see
+            get_attributed_joules_per_component.
+        :param proc_root: the path where procfs is mounted.
+        :param disk_read_speed: the read speed of the disk in bytes per second. Together with
+            disk_write_speed, it replaces disk_avg_speed, so reads and writes are weighted
+            by their own speed.
+        :param disk_write_speed: the write speed of the disk in bytes per second.
+        :param disk_device: the disk whose profile is loaded when the disk parameters are
+            not given (see energymeter.calibration), a device name (e.g. nvme0n1) or a path
+            stored in it. Defaults to the disk of the current directory.
         """
         if label:
             self.label = label
@@ -162,195 +364,265 @@ class EnergyMeter:
 
         self.include_idle = include_idle
 
-        # Setup pyRAPL to measure CPU and DRAM.
-        try:
-            pyRAPL.setup()
-
-            # Create the pyRAPL meter to measure CPU and DRAM energy consumption.
-            self.meter = pyRAPL.Measurement(self.label)
-        except:
-            self.meter = None
+        # The RAPL counters to measure CPU and DRAM are opened when the meter begins.
+        self.rapl_root = rapl_root
+        self.rapl = None
+        self.rapl_begin = None
+        self.rapl_end = None
+        self.rapl_held = False
 
         # Setup disk parameters.
         self.ignore_disk = ignore_disk
-        if ignore_disk == False and (disk_avg_speed is None or disk_active_power is None or disk_idle_power is None):
-            raise Exception("disk_avg_speed, disk_active_power, and disk_idle_power are necessary values if disk energy will be monitored; if you want to ignore the disk, set ignore_disk=True when calling init.")
-        else:
-            self.disk_avg_speed = disk_avg_speed
-            self.disk_active_power = disk_active_power
-            self.disk_idle_power = disk_idle_power
-
-        # Create thread for sampling the power draw of the GPU, this sets up pynvm.
-        self.thread_gpu = ThreadGpuSamplingPyNvml("GPU Sampling Thread")
-
-        # Create command for bpftrace subprocess that will count the bytes read and
-        # written to disk.
-        self.bpftrace_command = shlex.split(
-            "sudo bpftrace -f json -e '{}'".format(EnergyMeter.SCRIPT)
-        )
+        if disk_backend not in ("bpftrace", "diskstats"):
+            raise Exception("disk_backend must be either bpftrace or diskstats.")
+        if ignore_disk == False:
+            if disk_backend != "diskstats":
+                (disk_read_speed, disk_write_speed, disk_active_power,
+                 disk_idle_power) = load_disk_parameters(disk_device, disk_avg_speed,
+                                                         disk_read_speed, disk_write_speed,
+                                                         disk_active_power, disk_idle_power)
+            check_disk_parameters(disk_backend, disk_avg_speed, disk_active_power,
+                                  disk_idle_power, disk_power, disk_read_speed,
+                                  disk_write_speed)
+        self.disk_backend = disk_backend
+        self.disk_avg_speed = disk_avg_speed
+        self.disk_read_speed = disk_read_speed
+        self.disk_write_speed = disk_write_speed
+        self.disk_active_power = disk_active_power
+        self.disk_idle_power = disk_idle_power
+        self.disk_power = disk_power
+        self.diskstats_path = diskstats_path
+        self.diskstats = None
+        self.diskstats_begin = None
+        self.diskstats_end = None
+
+        # The thread for sampling the power draw of the GPU is created when the meter begins.
+        self.gpu_seconds_between_samples = gpu_seconds_between_samples
+        self.nvml = nvml
+        self.thread_gpu = None
+
+        # The bpftrace session that counts the bytes read and written is shared by all
+        # meters and started when the first meter begins.
+        self.bpftrace_session = bpftrace_session
+        self.bpftrace = None
+        self.tree_begin = None
+
+        # The usage of this process tree, to attribute the CPU and DRAM energy on shared hosts.
+        self.attribute_to_process = attribute_to_process
+        self.proc_root = proc_root
+        self.usage_begin = None
+        self.usage_end = None
 
     def begin(self):
         """Begin measuring the energy consumption. This sets the starting datetime and
-        reads the current RAPL counters. You should have start the bash script
-        start_meters.sh BEFORE calling this function.
+        reads the current RAPL counters.
         """
+        # /proc/diskstats for disk.
+        if not self.ignore_disk and self.disk_backend == "diskstats":
+            self.diskstats = get_diskstats_reader(self.diskstats_path)
+            if self.diskstats is None:
+                print("Disk statistics are not accessible, no disk energy metrics are available!")
+
+        # bpftrace for disk, this takes a while to start the first time.
+        if not self.ignore_disk and self.disk_backend == "bpftrace":
+            self.bpftrace = self.bpftrace_session or get_bpftrace_session()
+            if not self.bpftrace.is_running():
+                print("bpftrace is not running, no disk energy metrics are available!")
+
         self.start_time = time.time()
-        
-        # pyRAPL for CPU and DRAM.
-        if self.meter:
-            self.meter.begin()
+        if self.bpftrace:
+            # Keep the bytes of the window until end(), and the processes that may exit
+            # before then.
+            self.bpftrace.hold(self.start_time)
+            self.tree_begin = process_tree()
+
+        # RAPL for CPU and DRAM.
+        self.rapl = get_rapl_reader(self.rapl_root)
+        if self.rapl:
+            self.rapl_begin = self.rapl.read()
+            # The counters are also read periodically while the meter runs, so that their
+            # wraparounds are not missed.
+            if not self.rapl_held:
+                self.rapl.hold()
+                self.rapl_held = True
         else:
             print("RAPL is not accessible, no CPU or memory energy metrics are available!")
-
-        # bpftrace for disk.
-        if not self.ignore_disk:
-            self.popen = subprocess.Popen(
-                self.bpftrace_command, stdout=subprocess.PIPE, preexec_fn=os.setpgrp
-            )
-            self.bpftrace_pid = os.getpgid(self.popen.pid)
-
-        # Thread for GPU.
+        if self.diskstats:
+            self.diskstats_begin = self.diskstats.read()
+        if self.attribute_to_process:
+            self.usage_begin = ProcessShareReader(proc_root=self.proc_root).read()
+
+        # Thread for GPU, this sets up pynvml the first time.
+        self.thread_gpu = ThreadGpuSamplingPyNvml("GPU Sampling Thread",
+                                                  self.gpu_seconds_between_samples, self.nvml)
         self.thread_gpu.start()
 
     def end(self):
         """Finish the measurements and calculate results for CPU and DRAM. This sets the
         duration of the meter and reads again the RAPL counters, calculating how much energy
-        was used since the meter began. You should stop running the bash script
-        start_meters.sh AFTER calling this method.
+        was used since the meter began.
         """
-        # PyRAPL.
-        if self.meter:
-            self.meter.end()
-
-        # Kill bpftrace subprocess.
-        if not self.ignore_disk:
-            subprocess.check_output(shlex.split("sudo kill {}".format(self.bpftrace_pid)))
-
-        # Stop tracking GPU power usage.
-        self.thread_gpu.stop = True
-
-        # Process bpftrace output.
-        if not self.ignore_disk:
-            po = self.popen.stdout.read()
-            self.total_rbytes, self.total_wbytes = self.__preprocess_bpftrace_output(po)
-        else:
-            self.total_rbytes, self.total_wbytes = 0, 0
+        # RAPL.
+        if self.rapl:
+            self.rapl_end = self.rapl.read()
+            if self.rapl_held:
+                self.rapl.release()
+                self.rapl_held = False
+        if self.diskstats:
+            self.diskstats_end = self.diskstats.read()
+        if self.attribute_to_process:
+            self.usage_end = ProcessShareReader(proc_root=self.proc_root).read()
 
         self.end_time = time.time()
         self.duration = self.end_time - self.start_time
 
-    def __preprocess_bpftrace_output(self, bpftrace_output):
-        """Preprocess the output of out bpftrace script and extract the bytes read and
-        written. Attention: This must be changed if the bpftrace script changes!
-        :param bpftrace_output: the output of the bpftrace script.
-        :returns: total_rbytes (float), total_wbytes (float).
-        """
-        bpftrace_output = bpftrace_output.decode()
-        if len(bpftrace_output.strip()) > 0:
-            po = bpftrace_output.split("\n")
-            rbytes = json.loads(po[3]).get("data").get("@rbytes")
-            wbytes = json.loads(po[4]).get("data").get("@wbytes")
-            # Do we want to measure other programs disk IO too?
-            total_rbytes = rbytes.get("python", 0) + rbytes.get("python3", 0)
-            total_wbytes = wbytes.get("python", 0) + wbytes.get("python3", 0)
+        # Stop tracking GPU power usage.
+        self.thread_gpu.stop()
+
+        # Count the bytes read and written. With bpftrace, we count those of this process
+        # and its children, waiting for the counters of the interval in which the meter ended.
+        # The children are those alive when the meter began or ended, and those forked while
+        # it ran, even if they have exited.
+        if self.diskstats:
+            delta = self.diskstats_end - self.diskstats_begin
+            self.total_rbytes, self.total_wbytes = delta[:, 0].sum(), delta[:, 1].sum()
+        elif not self.ignore_disk and self.disk_backend == "bpftrace":
+            self.bpftrace.wait_for(self.end_time)
+            pids = self.bpftrace.forked_from(self.tree_begin | process_tree())
+            self.total_rbytes, self.total_wbytes = self.bpftrace.bytes_between(
+                self.start_time, self.end_time, pids)
+            self.bpftrace.release(self.start_time)
         else:
-            # bpftrace produced no output, which means there was no IO activity in the
-            # disk. This only happens when the code run has a very short duration.
-            total_rbytes = 0
-            total_wbytes = 0
-
-        return total_rbytes, total_wbytes
+            self.total_rbytes, self.total_wbytes = 0, 0
 
     def get_total_joules_disk(self):
         """We calculate the disk's energy consumption while the meter was running. For this,
-        we require the csv file that was generated by running the bash script start_meters.sh.
-        In this case, we utilize the speed and energy consumption parameters given when this
-        object was initiated to estimate the disk's energy consumption. The formula used here
-        was derived from:
+        we utilize the bytes read and written and the speed and energy consumption parameters
+        given when this object was initiated to estimate the disk's energy consumption. The
+        formula used here was derived from:
         [1] Kansal, A., Zhao, F., Liu, J., Kothari, N., & Bhattacharya, A. A. (2010, June). 
         Virtual machine power metering and provisioning. In Proceedings of the 1st ACM 
         symposium on Cloud computing (pp. 39-50).
+        With the diskstats backend, the busy time of each disk is used as its active time.
 
-        :param filename: the path to the csv file generated by start_meters.sh (or where the
-            output of disk_io.bt was saved.)
         :returns: the total joules used by the disk between meter.begin() and meter.end().
         """
         if self.ignore_disk:
             return 0
+        if self.disk_backend == "diskstats":
+            return sum(self.get_joules_per_disk().values())
             
         tot_bytes = self.total_rbytes + self.total_wbytes
-
-        # disk_active_time (in seconds) = (bytes_read + bytes_written) / DISK_SPEED
-        disk_active_time = tot_bytes / self.disk_avg_speed
-
-        # disk_idle_time (in seconds) = total_meter_time - disk_active_time
-        disk_idle_time = self.duration - disk_active_time
-
-        # total_energy = disk_active_time * DISK_ACTIVE_POWER (+ disk_idle_time * DISK_IDLE_POWER)
-        te = disk_active_time * self.disk_active_power
-        if self.include_idle:
-            te += disk_idle_time * self.disk_idle_power
-        return te
+        return disk_joules(tot_bytes, self.duration, self.disk_avg_speed, self.disk_active_power,
+                           self.disk_idle_power, self.include_idle, self.total_rbytes,
+                           self.disk_read_speed, self.disk_write_speed)
+
+    def get_joules_per_disk(self):
+        """We calculate the energy consumption of each disk from the time it was busy, as
+        reported by /proc/diskstats. This is only available with the diskstats backend.
+        :returns: a dictionary with the joules used by each disk between meter.begin() and
+            meter.end(), e.g. {"nvme0n1": 1.2}.
+        """
+        if self.diskstats is None or self.diskstats_end is None:
+            return {}
+        busy = (self.diskstats_end - self.diskstats_begin)[:, 2]
+        return diskstats_joules(busy, self.diskstats.devices, self.duration,
+                                self.disk_active_power, self.disk_idle_power, self.disk_power,
+                                self.include_idle)
+
+    def get_joules_per_rapl_domain(self):
+        """We obtain the total joules consumed by each RAPL domain, i.e. each package and
+        its subdomains (core, uncore, dram...), from the RAPL counters.
+        :returns: a dictionary with the joules used by each domain between meter.begin() and
+            meter.end(), e.g. {"package-0": 10.2, "package-0/dram": 1.3}.
+        """
+        if self.rapl is None or self.rapl_end is None:
+            return {}
+        return dict(zip(self.rapl.labels(), self.rapl_end - self.rapl_begin))
 
     def get_total_joules_cpu(self):
-        """We obtain the total joules consumed by the CPU from pyRAPL.
-        :returns: the total joules used by the CPU between meter.begin() and meter.end().
+        """We obtain the total joules consumed by the CPU from the RAPL counters.
+        :returns: the total joules used by each package between meter.begin() and meter.end().
         """
-        # pyRAPL returns the microjoules, so we convert them to joules.
-        if self.meter and self.meter.result.pkg:
-            return np.array(self.meter.result.pkg) * 1e-6
+        indexes = self.rapl.indexes("package") if self.rapl else []
+        if indexes and self.rapl_end is not None:
+            return (self.rapl_end - self.rapl_begin)[indexes]
         else:
             print("RAPL did not record energy for pkg!")
             return np.array([0])
 
     def get_total_joules_dram(self):
-        """We obtain the total joules consumed by the DRAM from pyRAPL.
-        :returns: the total joules used by the DRAM between meter.begin() and meter.end().
+        """We obtain the total joules consumed by the DRAM from the RAPL counters.
+        :returns: the total joules used by the DRAM of each package between meter.begin() and
+            meter.end().
         """
-        # pyRAPL returns the microjoules, so we convert them to joules.
-        if self.meter and self.meter.result.dram:
-            return np.array(self.meter.result.dram) * 1e-6
+        indexes = self.rapl.indexes("dram") if self.rapl else []
+        if indexes and self.rapl_end is not None:
+            return (self.rapl_end - self.rapl_begin)[indexes]
         else:
             print("RAPL did not record energy for dram!")
             return np.array([0])
             
 
+    def get_attributed_joules_per_component(self):
+        """Get the CPU and DRAM energy attributed to this process and its descendants, next
+        to the total energy of the host. The CPU energy is scaled by the share of the busy CPU
+        time of the host used by the process tree between meter.begin() and meter.end(), and
+        the DRAM energy by its average share of the resident memory of all processes. This
+        requires attribute_to_process=True.
+        :returns: a dictionary with a dictionary for cpu and dram with the attributed and
+            total joules of each package.
+        """
+        if self.usage_begin is None or self.usage_end is None:
+            raise Exception("The meter must be created with attribute_to_process=True.")
+        delta = self.usage_end - self.usage_begin
+        cpu_share = usage_share(delta[0], delta[1])
+        dram_share = (usage_share(self.usage_begin[2], self.usage_begin[3]) +
+                      usage_share(self.usage_end[2], self.usage_end[3])) / 2
+        cpu, dram = self.get_total_joules_cpu(), self.get_total_joules_dram()
+        return {
+            "cpu": {"attributed": cpu * cpu_share, "total": cpu},
+            "dram": {"attributed": dram * dram_share, "total": dram},
+        }
+
+    def get_joules_per_gpu(self):
+        """We calculate the energy consumption of each GPU while the meter was running. When
+        the GPU has an energy counter, the energy used between two samples is the difference
+        of the counter, otherwise we integrate the power draw over the timestamps of the samples
+        with the trapezoidal rule. If include_idle is False, only the intervals in which this
+        process (or its children) was using the GPU are counted.
+        :returns: a dictionary with the joules used by each GPU between meter.begin() and
+            meter.end(), e.g. {"gpu0": 120.5, "gpu1": 0.0}.
+        """
+        timestamps, power_draw, activity, energy = self.thread_gpu.get_samples()
+        joules = {}
+        for i, device in enumerate(self.thread_gpu.devices):
+            if len(timestamps) < 2:
+                joules[device] = 0.0
+                continue
+            # Energy used between each pair of consecutive samples.
+            if np.isnan(energy[:, i]).any():
+                intervals = trapezoid(power_draw[:, i], timestamps)
+            else:
+                intervals = np.diff(energy[:, i])
+            if not self.include_idle:
+                # We only count the intervals at the end of which the GPU was active.
+                intervals = intervals[activity[1:, i] > 0]
+            joules[device] = float(np.sum(intervals))
+        return joules
+
     def get_total_joules_gpu(self):
-        """We calculate the GPU's energy consumption while the meter was running. For this,
-        we require the csv file that was generated by running the bash script start_meters.sh.
-        This is calculated as the mean power used between meter.begin() and meter.end() times
-        the total time in seconds.
-        :param filename: the path to the csv file generated by start_meters.sh (or the file
-            generated by gpu_stats.sh.)
-        :returns: the total joules used by the GPU between meter.begin() and meter.end().
+        """We calculate the energy consumption of all the GPUs while the meter was running,
+        see get_joules_per_gpu.
+        :returns: the total joules used by the GPUs between meter.begin() and meter.end().
         """
-        if len(self.thread_gpu.activity_history) == 0:
-            return 0
+        return sum(self.get_joules_per_gpu().values())
 
-        # total_energy = mean_GPU_power_draw * min(meter_duration_ns * 1e-6, GPU_active_time_s)
-        if self.include_idle:
-            # We use the mean power draw thoughout the whole time (including idle time.)
-            mean_p = np.mean(self.thread_gpu.power_draw_history)
-            te = mean_p * self.duration
-        else:
-            # First, check if there was any activity, otherwise return 0.
-            if sum(self.thread_gpu.activity_history) == 0:
-                return 0
-                
-            # We calculate the mean power draw during intervals of time at which
-            # python or python3 was active on the GPU.
-            pdh = self.thread_gpu.power_draw_history
-            ah = self.thread_gpu.activity_history
-            assert len(pdh) == len(ah), "Power draw and activity history have diff lengths!"
-
-            sbs = self.thread_gpu.SECONDS_BETWEEN_SAMPLES
-            mean_p = np.mean([pdh[i] for i in range(len(pdh)) if ah[i] > 0])
-            # We estimate the task was running for length of samples * the time between samples,
-            # or the duration of the meter if this was shorter. Our error in this estimation is
-            # bounded to (t - 2*SECONDS_BETWEEN_SAMPLES, t + SECONDS_BETWEEN_SAMPLES).
-            te = mean_p * min(self.duration, len(ah)*sbs)
-            
-        return te
+    def get_sampler_overhead(self):
+        """Get the resources used by the GPU sampling thread of this meter.
+        :returns: see ThreadGpuSamplingPyNvml.get_overhead.
+        """
+        return self.thread_gpu.get_overhead()
 
     def get_total_joules_per_component(self):
         """This returns the total energy consumption in joules between meter.begin() and
@@ -370,27 +642,16 @@ class EnergyMeter:
         }
         return res
 
-    def plot_total_joules_per_component(self, include_total=True):
+    def plot_total_joules_per_component(self, include_total=True, path=None):
         """This plots the total energy consumption in joules between meter.begin() and
         meter.end() and the total consumption by each component (CPU, DRAM, GPU and disk).
-        :param foldername: the path to the folder generated by start_meters.sh.
+        No display is required: the figure is saved to path and returned, so notebooks show
+        it inline.
+        :param include_total: if a bar with the total of all components is added.
+        :param path: the file where the figure is saved, e.g. energy.png.
+        :returns: the matplotlib Figure.
         """
-        data = self.get_total_joules_per_component()
-        if include_total:
-            data["total"] = (
-                np.sum(data.get("cpu"))
-                + np.sum(data.get("dram"))
-                + data.get("disk")
-                + data.get("gpu")
-            )
-        keys = data.keys()
-        values = [float(val) for val in data.values()]
-
-        fig, ax = plt.subplots()
-        bars = ax.bar(list(keys), values)
-        ax.bar_label(bars)
-        plt.xlabel("Components")
-        plt.ylabel("joules")
-        plt.title(self.name)
-
-        plt.show()
+        from .plotting import plot_totals
+
+        return plot_totals(self.get_total_joules_per_component(), path, self.label,
+                           include_total)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+This module streams the samples of an EnergySampler and the intervals of meters to
+append-only files as they arrive, and loads them back. Samples are queued by the sampling
+thread and written in blocks by a separate thread, so writing never delays sampling. Binary
+files are loaded with memory-mapping, so hours of samples of many hosts can be analyzed
+without reading them into memory.
+"""
+import csv
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Binary sample files start with this line, followed by a JSON header padded with spaces to
+# a multiple of HEADER_ALIGNMENT bytes and rows of little-endian float64.
+MAGIC = b"ENERGYMETER SAMPLES 1\n"
+HEADER_ALIGNMENT = 64
+DTYPE = np.dtype("<f8")
+
+
+def write_header(f, columns):
+    """Write the header of a binary sample file.
+    :param f: the file, opened in binary mode.
+    :param columns: the names of the columns stored after the timestamp.
+    """
+    header = MAGIC + json.dumps({"columns": list(columns)}).encode()
+    padding = -(len(header) + 1) % HEADER_ALIGNMENT
+    f.write(header + b" " * padding + b"\n")
+
+
+def read_header(path):
+    """Read the header of a binary sample file.
+    :param path: the file.
+    :returns: the names of the columns and the offset at which the rows begin.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception("{} is not a binary sample file.".format(path))
+        header = f.readline()
+    return json.loads(header)["columns"], len(MAGIC) + len(header)
+
+
+class SampleExporter(threading.Thread):
+    """Thread that writes the samples of an EnergySampler to an append-only file. Samples
+    are queued by the sampler and written every FLUSH_SECONDS in a single write, as binary
+    rows of float64 or CSV lines. If the file exists and has the same columns, samples are
+    appended to it.
+    """
+
+    FLUSH_SECONDS = 1.0
+
+    def __init__(self, path, sampler=None, format=None, flush_seconds=None):
+        """Open the file.
+        :param path: the file where samples are written.
+        :param sampler: the EnergySampler whose samples are written. Defaults to the
+            process-wide sampler.
+        :param format: "binary" or "csv". Defaults to csv if path ends with .csv, binary
+            otherwise.
+        :param flush_seconds: the period at which queued samples are written. Defaults to
+            FLUSH_SECONDS.
+        """
+        threading.Thread.__init__(self, name="Energy Export Thread", daemon=True)
+        if sampler is None:
+            from .sampler import get_sampler
+            sampler = get_sampler()
+        if format is None:
+            format = "csv" if path.endswith(".csv") else "binary"
+        if format not in ("binary", "csv"):
+            raise Exception("format must be either binary or csv.")
+        self.path = path
+        self.sampler = sampler
+        self.format = format
+        self.flush_seconds = flush_seconds or SampleExporter.FLUSH_SECONDS
+        self.columns = sampler.column_names()
+        self.queue = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.written = 0
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            columns = (read_header(path)[0] if format == "binary"
+                       else load_csv_columns(path)[1:])
+            if columns != self.columns:
+                raise Exception("{} has columns {}, not {}.".format(path, columns, self.columns))
+        if format == "binary":
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "a", newline="")
+        if format == "binary" and exists:
+            # Drop a row left incomplete by a crash, so that rows stay aligned.
+            offset = read_header(path)[1]
+            row_bytes = DTYPE.itemsize * (len(self.columns) + 1)
+            self.file.truncate(offset + (os.path.getsize(path) - offset) // row_bytes * row_bytes)
+        elif format == "binary":
+            write_header(self.file, self.columns)
+        elif not exists:
+            csv.writer(self.file).writerow(["timestamp"] + self.columns)
+        self.file.flush()
+
+    def start(self):
+        """Start writing the samples taken from now on.
+        """
+        self.sampler.add_listener(self.enqueue)
+        threading.Thread.start(self)
+
+    def enqueue(self, timestamp, row):
+        """Queue a sample, this is called by the sampling thread.
+        :param timestamp: the time at which the sample was taken.
+        :param row: the counters of the sample.
+        """
+        self.queue.put((timestamp, row))
+
+    def run(self):
+        """Write the queued samples every flush_seconds until close() is called.
+        """
+        while not self.stop_event.wait(self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        """Write the queued samples.
+        """
+        rows = []
+        while True:
+            try:
+                timestamp, row = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            rows.append([timestamp] + list(row))
+        if not rows:
+            return
+        if self.format == "binary":
+            self.file.write(np.asarray(rows, dtype=DTYPE).tobytes())
+        else:
+            csv.writer(self.file).writerows([repr(float(v)) for v in row] for row in rows)
+        self.file.flush()
+        self.written += len(rows)
+
+    def close(self):
+        """Stop listening to the sampler, write the queued samples and close the file.
+        """
+        self.sampler.remove_listener(self.enqueue)
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class IntervalWriter:
+    """Appends the label, start time and end time of meters to a CSV file, e.g. as the
+    callback of measure_energy.
+    """
+
+    COLUMNS = ["label", "start_time", "end_time"]
+
+    def __init__(self, path):
+        """Open the file.
+        :param path: the CSV file where intervals are written.
+        """
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        self.lock = threading.Lock()
+        if not exists:
+            self.writer.writerow(IntervalWriter.COLUMNS)
+            self.file.flush()
+
+    def __call__(self, meter):
+        """Write the interval of a meter that has ended.
+        :param meter: the meter.
+        """
+        with self.lock:
+            self.writer.writerow([meter.label, repr(meter.start_time), repr(meter.end_time)])
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_csv_columns(path):
+    """Read the header line of a CSV file.
+    :param path: the file.
+    :returns: the list of column names.
+    """
+    with open(path, newline="") as f:
+        return next(csv.reader(f))
+
+
+def load_samples(path, as_dataframe=False):
+    """Load the samples written by a SampleExporter. Binary files are memory-mapped, so only
+    the pages that are used are read.
+    :param path: the file.
+    :param as_dataframe: if True, return a pandas DataFrame with a column per counter indexed
+        by timestamp.
+    :returns: an array of timestamps, an array of counters (one row per sample) and the list
+        of column names, or a DataFrame if as_dataframe is True.
+    """
+    with open(path, "rb") as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        columns, offset = read_header(path)
+        n_rows = (os.path.getsize(path) - offset) // (DTYPE.itemsize * (len(columns) + 1))
+        if n_rows:
+            rows = np.memmap(path, dtype=DTYPE, mode="r", offset=offset,
+                             shape=(n_rows, len(columns) + 1))
+        else:
+            rows = np.empty((0, len(columns) + 1))
+    else:
+        columns = load_csv_columns(path)[1:]
+        rows = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        rows = rows.reshape(-1, len(columns) + 1)
+
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame(rows[:, 1:], columns=columns,
+                            index=pd.Index(rows[:, 0], name="timestamp"))
+    return rows[:, 0], rows[:, 1:], columns
+
+
+def load_intervals(path, as_dataframe=False):
+    """Load the intervals written by an IntervalWriter.
+    :param path: the CSV file.
+    :param as_dataframe: if True, return a pandas DataFrame.
+    :returns: a list of labels, an array of start times and an array of end times, or a
+        DataFrame if as_dataframe is True.
+    """
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))[1:]
+    labels = [row[0] for row in rows]
+    starts = np.array([float(row[1]) for row in rows])
+    ends = np.array([float(row[2]) for row in rows])
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame({"label": labels, "start_time": starts, "end_time": ends})
+    return labels, starts, ends
+
+
+def energy_per_interval(samples_path, intervals_path, weights=None):
+    """Split the energy of exported samples across exported intervals, see
+    attribution.apportion.
+    :param samples_path: the file written by a SampleExporter.
+    :param intervals_path: the file written by an IntervalWriter.
+    :param weights: the weight of each interval. Defaults to sharing the energy equally among
+        the intervals active at each moment.
+    :returns: the list of labels and an array with a row per interval and a column per
+        counter, whose names are given by load_samples.
+    """
+    from .attribution import apportion
+    timestamps, counters, _ = load_samples(samples_path)
+    labels, starts, ends = load_intervals(intervals_path)
+    return labels, apportion(timestamps, counters, starts, ends, weights)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+This module implements NvmlReader, which samples every NVIDIA GPU in the host in a single pass
+through direct NVML handles: power draw, utilization, total energy counter (on Volta and newer
+GPUs) and the utilization of the GPU by the processes being metered.
+"""
+import os
+import time
+
+import numpy as np
+
+from .procfs import process_tree
+
+
+def load_nvml():
+    """Import the NVML bindings the first time they are needed.
+    :returns: the pynvml module.
+    """
+    import pynvml
+    return pynvml
+
+
+class NvmlReader:
+    """Reads the state of all the GPUs in the host. Each call to read() returns, per device,
+    the power draw in Watts, the utilization in %, the utilization in % by the metered
+    processes and the energy counter in joules.
+
+    The energy counter (nvmlDeviceGetTotalEnergyConsumption) is more accurate than integrating
+    the power draw, but it is only available on Volta and newer GPUs, otherwise it is NaN. The
+    utilization by the metered processes is obtained with nvmlDeviceGetProcessUtilization; on
+    GPUs that do not support it, the utilization of the whole device is used instead.
+    """
+
+    # How often the descendants of the metered process are looked up.
+    PIDS_REFRESH_SECONDS = 1.0
+
+    def __init__(self, nvml=None, pid=None):
+        """Init NVML and get a handle for every device.
+        :param nvml: the NVML bindings. Defaults to pynvml, this can be changed to a fake
+            module, e.g. energymeter.testing.FakeNvml, to test without GPUs.
+        :param pid: the process whose utilization of the GPUs is attributed to the meter,
+            together with its descendants. Defaults to the current process.
+        """
+        self.nvml = nvml or load_nvml()
+        self.nvml.nvmlInit()
+        count = self.nvml.nvmlDeviceGetCount()
+        self.handles = [self.nvml.nvmlDeviceGetHandleByIndex(i) for i in range(count)]
+        self.devices = ["gpu{}".format(i) for i in range(count)]
+
+        self.energy_supported = [True] * count
+        self.process_utilization_supported = [True] * count
+        self.last_seen = [0] * count
+        self.pid = os.getpid() if pid is None else pid
+        self.pids = {self.pid}
+        self.pids_refreshed = -np.inf
+
+    def read_energy(self, i):
+        """Read the energy counter of a device.
+        :param i: the index of the device.
+        :returns: the joules consumed by the device since the driver was loaded, or NaN if the
+            device does not support energy counters.
+        """
+        if self.energy_supported[i]:
+            try:
+                # NVML reports the energy in millijoules.
+                return self.nvml.nvmlDeviceGetTotalEnergyConsumption(self.handles[i]) * 1e-3
+            except self.nvml.NVMLError:
+                self.energy_supported[i] = False
+        return np.nan
+
+    def read_process_utilization(self, i):
+        """Read the utilization of a device by the metered processes since the previous read.
+        :param i: the index of the device.
+        :returns: the sum of the SM utilization of the metered processes, or None if the device
+            does not support per-process utilization.
+        """
+        if not self.process_utilization_supported[i]:
+            return None
+        try:
+            samples = self.nvml.nvmlDeviceGetProcessUtilization(self.handles[i],
+                                                                self.last_seen[i])
+        except self.nvml.NVMLError as e:
+            if getattr(e, "value", None) == self.nvml.NVML_ERROR_NOT_SUPPORTED:
+                self.process_utilization_supported[i] = False
+                return None
+            # NVML_ERROR_NOT_FOUND: no process used the device since the previous read.
+            return 0.0
+        utilization = 0.0
+        for sample in samples:
+            self.last_seen[i] = max(self.last_seen[i], sample.timeStamp)
+            if sample.pid in self.pids:
+                utilization += sample.smUtil
+        return utilization
+
+    def read(self):
+        """Sample all the devices.
+        :returns: a 2D array with one row per device and the columns power draw (W),
+            utilization (%), utilization by the metered processes (%) and energy (J).
+        """
+        now = time.monotonic()
+        if now - self.pids_refreshed > NvmlReader.PIDS_REFRESH_SECONDS:
+            self.pids = process_tree(self.pid)
+            self.pids_refreshed = now
+
+        rows = np.empty((len(self.handles), 4))
+        for i, handle in enumerate(self.handles):
+            # NVML reports the power draw in milliwatts.
+            power = self.nvml.nvmlDeviceGetPowerUsage(handle) * 1e-3
+            utilization = self.nvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            process_utilization = self.read_process_utilization(i)
+            if process_utilization is None:
+                process_utilization = utilization
+            rows[i] = (power, utilization, process_utilization, self.read_energy(i))
+        return rows
+
+    def close(self):
+        """Release NVML.
+        """
+        self.nvml.nvmlShutdown()
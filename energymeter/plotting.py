@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+This module plots the energy measured by the meters without a display: figures are created
+with matplotlib's object-oriented API (not pyplot), so they can be saved to a file on
+headless servers or returned to be shown inline in notebooks. Power timelines are
+downsampled with the largest-triangle-three-buckets algorithm (LTTB), which keeps the peaks
+and the shape of series with millions of samples while drawing only a few thousand points.
+Longer series are first reduced to evenly spaced samples of the cumulative counters, so the
+power between them is the exact average power of each bucket.
+"""
+import numpy as np
+
+from .backends import energy_components
+
+# The components added up in the total bar of plot_totals, which do not overlap.
+TOTAL_COMPONENTS = ("cpu", "dram", "gpu", "disk")
+MAX_POINTS = 2000
+# Series are reduced to this many buckets per point drawn before LTTB.
+BUCKETS_PER_POINT = 10
+# Intervals are not labelled when there are more than this many.
+MAX_LABELLED_INTERVALS = 20
+
+
+def lttb(x, y, max_points):
+    """Select the points of a series that keep its visual shape with the
+    largest-triangle-three-buckets algorithm. The first and last points are kept, the rest
+    are split in max_points - 2 buckets and, from each bucket, the point that forms the
+    largest triangle with the point selected in the previous bucket and the average of the
+    next bucket is selected.
+    :param x: the sorted x of the points.
+    :param y: the y of the points.
+    :param max_points: the number of points to select, at least 3.
+    :returns: an array with the indices of the selected points.
+    """
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+    if max_points < 3:
+        raise Exception("At least 3 points are required to downsample a series.")
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    # The average of every bucket, computed at once. The next bucket of the last bucket is
+    # the last point.
+    sizes = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / sizes, x[-1])
+    avg_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / sizes, y[-1])
+    selected = np.empty(max_points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the area of the triangles (the constant factor does not change the argmax).
+        areas = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+                       - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def decimate_counters(timestamps, counters, max_samples):
+    """Keep evenly spaced samples of cumulative counters, including the first and the last.
+    As the counters are cumulative, the energy between the samples kept is not lost, only
+    averaged over longer intervals.
+    :param timestamps: the sorted timestamps of the samples.
+    :param counters: an array with a row of cumulative counters per sample.
+    :param max_samples: the maximum number of samples kept.
+    :returns: the timestamps and the counters of the samples kept.
+    """
+    if len(timestamps) <= max_samples:
+        return timestamps, counters
+    kept = np.unique(np.linspace(0, len(timestamps) - 1, max_samples).astype(int))
+    return timestamps[kept], counters[kept]
+
+
+def layout_from_columns(columns):
+    """Group the column names of exported samples (e.g. cpu:0, cpu:1, dram) by component.
+    :param columns: the list of column names, see EnergySampler.column_names.
+    :returns: a dictionary mapping each component to the indices of its columns.
+    """
+    layout = {}
+    for i, column in enumerate(columns):
+        name, _, index = column.rpartition(":")
+        layout.setdefault(name if name and index.isdigit() else column, []).append(i)
+    return layout
+
+
+def component_power(timestamps, counters, layout, components=None):
+    """Get the power of each component between consecutive samples of cumulative counters.
+    :param timestamps: the sorted timestamps of the samples.
+    :param counters: an array with a row of cumulative joules per sample.
+    :param layout: a dictionary mapping each component to the indices of its columns, which
+        are added up.
+    :param components: the components. Defaults to every component with joules.
+    :returns: an array with the time in the middle of each pair of samples and a dictionary
+        with an array per component with its watts.
+    """
+    if components is None:
+        components = energy_components(layout)
+    timestamps = np.asarray(timestamps, dtype=float)
+    elapsed = np.diff(timestamps)
+    valid = elapsed > 0
+    middle = ((timestamps[1:] + timestamps[:-1]) / 2)[valid]
+    elapsed = elapsed[valid]
+    power = {}
+    for name in components:
+        columns = layout[name]
+        # A single column is taken as a view, without copying it.
+        if len(columns) == 1:
+            joules = np.diff(counters[:, columns[0]])
+        else:
+            joules = np.diff(counters[:, columns].sum(axis=1))
+        power[name] = joules[valid] / elapsed
+    return middle, power
+
+
+def plot_power_timeline(timestamps, counters, layout, path=None, intervals=None,
+                        components=None, max_points=None, title=None):
+    """Plot the power of each component over time.
+    :param timestamps: the sorted timestamps of the samples.
+    :param counters: an array with a row of cumulative joules per sample.
+    :param layout: a dictionary mapping each component to the indices of its columns, or
+        the list of column names of exported samples.
+    :param path: the file where the figure is saved, e.g. power.png or power.svg.
+    :param intervals: an iterable of (label, start time, end time) that are overlaid, e.g.
+        the intervals of meters.
+    :param components: the components. Defaults to every component with joules.
+    :param max_points: the maximum number of points drawn per component. Defaults to
+        MAX_POINTS.
+    :param title: the title of the figure.
+    :returns: the matplotlib Figure.
+    """
+    from matplotlib.figure import Figure
+
+    if not isinstance(layout, dict):
+        layout = layout_from_columns(layout)
+    max_points = max_points or MAX_POINTS
+    origin = timestamps[0] if len(timestamps) else 0.0
+    timestamps, counters = decimate_counters(timestamps, counters,
+                                             BUCKETS_PER_POINT * max_points + 1)
+    middle, power = component_power(timestamps, counters, layout, components)
+
+    fig = Figure(figsize=(10, 4))
+    ax = fig.add_subplot()
+    for name, watts in power.items():
+        selected = lttb(middle, watts, max_points)
+        ax.plot(middle[selected] - origin, watts[selected], label=name, linewidth=1)
+
+    intervals = list(intervals or [])
+    for label, start_time, end_time in intervals:
+        ax.axvspan(start_time - origin, end_time - origin, alpha=0.15, color="grey")
+        if len(intervals) <= MAX_LABELLED_INTERVALS:
+            ax.annotate(str(label), (start_time - origin, 1), xycoords=("data", "axes fraction"),
+                        va="top", fontsize="small")
+
+    ax.set_xlabel("seconds")
+    ax.set_ylabel("watts")
+    if title:
+        ax.set_title(title)
+    if power:
+        ax.legend(loc="upper right")
+    fig.tight_layout()
+    if path:
+        fig.savefig(path)
+    return fig
+
+
+def plot_sampler(sampler, path=None, start_time=None, end_time=None, meters=(), **options):
+    """Plot the power of each component recorded by an EnergySampler.
+    :param sampler: the sampler.
+    :param path: the file where the figure is saved.
+    :param start_time: the beginning of the plot. Defaults to the first sample.
+    :param end_time: the end of the plot. Defaults to the last sample.
+    :param meters: the SharedEnergyMeters whose intervals are overlaid.
+    :param options: see plot_power_timeline.
+    :returns: the matplotlib Figure.
+    """
+    with sampler.condition:
+        timestamps, counters = sampler.buffer.get(start_time, end_time)
+    intervals = [(meter.label, meter.start_time, meter.end_time) for meter in meters]
+    return plot_power_timeline(timestamps, counters, sampler.layout, path, intervals,
+                               **options)
+
+
+def plot_samples_file(samples_path, path=None, intervals_path=None, **options):
+    """Plot the power of each component from files written by export.SampleExporter and
+    export.IntervalWriter.
+    :param samples_path: the file with the samples.
+    :param path: the file where the figure is saved.
+    :param intervals_path: the file with the intervals of meters that are overlaid.
+    :param options: see plot_power_timeline.
+    :returns: the matplotlib Figure.
+    """
+    from .export import load_intervals, load_samples
+
+    timestamps, counters, columns = load_samples(samples_path)
+    intervals = zip(*load_intervals(intervals_path)) if intervals_path else None
+    return plot_power_timeline(timestamps, counters, columns, path, intervals, **options)
+
+
+def plot_totals(data, path=None, title=None, include_total=True, components=None):
+    """Plot a bar per component with its total joules.
+    :param data: a dictionary with the joules of each component, see
+        get_total_joules_per_component. Components with several packages or devices are
+        added up.
+    :param path: the file where the figure is saved.
+    :param title: the title of the figure.
+    :param include_total: if a bar with the total of the components is added.
+    :param components: the components added up in the total bar. Defaults to those of
+        TOTAL_COMPONENTS, as other components (e.g. node, measured by a plugin) may already
+        include their energy.
+    :returns: the matplotlib Figure.
+    """
+    from matplotlib.figure import Figure
+
+    totals = {name: float(np.sum(joules)) for name, joules in data.items()}
+    if include_total:
+        components = TOTAL_COMPONENTS if components is None else components
+        totals["total"] = sum(totals[name] for name in components if name in totals)
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    bars = ax.bar(list(totals), list(totals.values()))
+    ax.bar_label(bars)
+    ax.set_xlabel("Components")
+    ax.set_ylabel("joules")
+    if title:
+        ax.set_title(title)
+    if path:
+        fig.savefig(path)
+    return fig
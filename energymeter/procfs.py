@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+This module implements helpers to read information about processes from /proc.
+"""
+import os
+
+import numpy as np
+
+
+def read_process_stat(pid, proc_root="/proc"):
+    """Read the parent, CPU time and resident memory of a process.
+    :param pid: the process.
+    :param proc_root: the path where procfs is mounted.
+    :returns: a tuple with the pid of its parent, the CPU time used by the process and its
+        reaped children (in clock ticks) and its resident set size (in pages), or None if
+        the process has finished.
+    """
+    try:
+        fd = os.open(os.path.join(proc_root, str(pid), "stat"), os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        stat = os.read(fd, 4096)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    # The command name is between parentheses and may contain spaces, so the fields are
+    # split after its closing parenthesis: state, ppid, ...
+    fields = stat[stat.rindex(b")") + 2:].split()
+    # utime + stime + cutime + cstime, so that the time of children is not lost when they
+    # exit.
+    ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    return int(fields[1]), ticks, int(fields[21])
+
+
+def read_process_stats(proc_root="/proc"):
+    """Read the parent, CPU time and resident memory of every process in the host, in a
+    single pass over proc_root.
+    :param proc_root: the path where procfs is mounted.
+    :returns: a dictionary mapping each pid to a tuple, see read_process_stat.
+    """
+    stats = {}
+    for entry in os.listdir(proc_root):
+        if not entry.isdigit():
+            continue
+        stat = read_process_stat(entry, proc_root)
+        # None if the process finished while we were listing them.
+        if stat is not None:
+            stats[int(entry)] = stat
+    return stats
+
+
+def read_children(pid, proc_root="/proc"):
+    """Read the children of a process, i.e. those of all its threads.
+    :param pid: the process.
+    :param proc_root: the path where procfs is mounted.
+    :returns: a list with the pids of the children.
+    """
+    task = os.path.join(proc_root, str(pid), "task")
+    try:
+        tids = os.listdir(task)
+    except OSError:
+        return []
+    children = []
+    for tid in tids:
+        try:
+            with open(os.path.join(task, tid, "children"), "rb") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            # The thread finished.
+            continue
+    return children
+
+
+def read_ppids(proc_root="/proc"):
+    """Read the parent of every process in the host.
+    :param proc_root: the path where procfs is mounted.
+    :returns: a dictionary mapping each pid to the pid of its parent.
+    """
+    return {pid: stat[0] for pid, stat in read_process_stats(proc_root).items()}
+
+
+def descendants(pid, ppids):
+    """Get a process and all its descendants.
+    :param pid: the root of the tree.
+    :param ppids: a dictionary mapping each pid to the pid of its parent.
+    :returns: a set with the pids of the process and its descendants.
+    """
+    children = {}
+    for child, parent in ppids.items():
+        children.setdefault(parent, []).append(child)
+
+    tree = {pid}
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            if child not in tree:
+                tree.add(child)
+                pending.append(child)
+    return tree
+
+
+def process_tree(pid=None, proc_root="/proc"):
+    """Get a process and all its descendants. Only the processes of the tree are read,
+    following the children files of their threads, unless the kernel does not have them
+    (CONFIG_PROC_CHILDREN), in which case every process is read to find its parent.
+    :param pid: the root of the tree. Defaults to the current process.
+    :param proc_root: the path where procfs is mounted.
+    :returns: a set with the pids of the process and its descendants.
+    """
+    pid = os.getpid() if pid is None else pid
+    if not os.path.exists(os.path.join(proc_root, str(pid), "task", str(pid), "children")):
+        return descendants(pid, read_ppids(proc_root))
+    tree = {pid}
+    pending = [pid]
+    while pending:
+        for child in read_children(pending.pop(), proc_root):
+            if child not in tree:
+                tree.add(child)
+                pending.append(child)
+    return tree
+
+
+def read_host_cpu_ticks(proc_root="/proc"):
+    """Read the time all the CPUs of the host have been busy.
+    :param proc_root: the path where procfs is mounted.
+    :returns: the busy time (user, nice, system, irq, softirq and steal) in clock ticks.
+    """
+    with open(os.path.join(proc_root, "stat"), "rb") as f:
+        fields = f.readline().split()
+    # cpu user nice system idle iowait irq softirq steal ...
+    return sum(int(fields[i]) for i in (1, 2, 3, 6, 7, 8))
+
+
+def read_host_memory(proc_root="/proc"):
+    """Read the memory in use in the host, the total memory minus the memory available for
+    new processes without swapping.
+    :param proc_root: the path where procfs is mounted.
+    :returns: the bytes in use.
+    """
+    fields = {}
+    with open(os.path.join(proc_root, "meminfo"), "rb") as f:
+        for line in f:
+            name, value = line.split(b":", 1)
+            fields[name] = value.split()[0]
+    return (int(fields[b"MemTotal"]) - int(fields[b"MemAvailable"])) * 1024
+
+
+class ProcessShareReader:
+    """Reads the CPU time and resident memory of a process tree and of the whole host, to
+    estimate the share of the CPU and DRAM energy used by the tree on shared hosts. Only the
+    processes of the tree are read, and the host's usage is read from /proc/stat and
+    /proc/meminfo.
+    """
+
+    def __init__(self, pid=None, proc_root="/proc"):
+        """Init the reader.
+        :param pid: the root of the process tree. Defaults to the current process.
+        :param proc_root: the path where procfs is mounted, this can be changed to a fake
+            tree, e.g. for testing.
+        """
+        self.pid = os.getpid() if pid is None else pid
+        self.proc_root = proc_root
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def read(self):
+        """Read the usage of the process tree and of the host.
+        :returns: an array with the CPU seconds used by the tree, the busy CPU seconds of the
+            host, the resident bytes of the tree and the bytes in use in the host.
+        """
+        tree_ticks = tree_pages = 0
+        for pid in process_tree(self.pid, self.proc_root):
+            stat = read_process_stat(pid, self.proc_root)
+            if stat is not None:
+                tree_ticks += stat[1]
+                tree_pages += stat[2]
+        host_ticks = read_host_cpu_ticks(self.proc_root)
+        return np.array([tree_ticks / self.clock_ticks, host_ticks / self.clock_ticks,
+                         tree_pages * self.page_size, read_host_memory(self.proc_root)])
+
+
+def usage_share(delta_tree, delta_host):
+    """Get the share of the host's usage of a process tree.
+    :param delta_tree: the increase of the usage of the tree.
+    :param delta_host: the increase of the usage of the host.
+    :returns: the share between 0 and 1, 0 if the host was not used.
+    """
+    if delta_host <= 0:
+        return 0.0
+    return min(max(delta_tree / delta_host, 0.0), 1.0)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+This module implements EnergyProfiler, a sampling profiler that attributes energy to Python
+functions. It periodically captures the stacks of the profiled threads with
+sys._current_frames and splits the energy recorded by an EnergySampler between consecutive
+captures across the stacks captured, so the energy of each component can be exported per
+call path as collapsed stacks (the input of flamegraph.pl, speedscope, etc.).
+"""
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .attribution import apportion
+from .buffers import SampleBuffer
+
+# Components whose energy is added up by default.
+ENERGY_COMPONENTS = ("cpu", "dram", "gpu")
+
+
+def frame_label(code):
+    """Get the label of a function in collapsed stacks.
+    :param code: the code object of the function.
+    :returns: a string with the qualified name of the function and where it is defined.
+    """
+    name = getattr(code, "co_qualname", code.co_name)
+    label = "{} ({}:{})".format(name, os.path.basename(code.co_filename), code.co_firstlineno)
+    # Semicolons separate frames and spaces separate the value in collapsed stacks.
+    return label.replace(";", ":").replace(" ", "_")
+
+
+class EnergyProfiler(threading.Thread):
+    """Thread that captures the stacks of the profiled threads every INTERVAL seconds. The
+    energy recorded by the sampler between two captures is split equally across the stacks
+    of that capture. The CPU time of the profiler is measured and, if it exceeds
+    MAX_OVERHEAD of a core, the interval is doubled, so its overhead is bounded. As energy
+    is interpolated between the samples of the sampler, its sampling period should not be
+    much longer than the interval of the profiler.
+    """
+
+    INTERVAL = 0.01
+    MAX_DEPTH = 128
+    MAX_OVERHEAD = 0.05
+    # How often the overhead of the profiler is checked.
+    OVERHEAD_CHECK_SECONDS = 1.0
+
+    def __init__(self, sampler=None, interval=None, threads=None, max_depth=None,
+                 max_overhead=None):
+        """Init the profiler.
+        :param sampler: the EnergySampler with the energy counters. Defaults to the
+            process-wide sampler.
+        :param interval: the seconds between captures. Defaults to INTERVAL.
+        :param threads: the idents of the threads to profile, "all" to profile every thread
+            but the profiler and the sampler. Defaults to the thread that calls start().
+        :param max_depth: the maximum number of frames captured per stack, the outermost
+            frames are dropped. Defaults to MAX_DEPTH.
+        :param max_overhead: the maximum fraction of a core used by the profiler. Defaults
+            to MAX_OVERHEAD.
+        """
+        threading.Thread.__init__(self, name="Energy Profiler Thread", daemon=True)
+        self.sampler = sampler
+        self.interval = interval or EnergyProfiler.INTERVAL
+        self.threads = threads
+        self.max_depth = max_depth or EnergyProfiler.MAX_DEPTH
+        self.max_overhead = max_overhead or EnergyProfiler.MAX_OVERHEAD
+        self.stop_event = threading.Event()
+        # Each distinct stack (a tuple of code objects, innermost last) gets an id.
+        self.stack_ids = {}
+        self.stacks = []
+        # Columns: stack id and ident of the thread.
+        self.samples = SampleBuffer(2)
+        self.cpu_time = 0.0
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        """Start profiling.
+        """
+        if self.sampler is None:
+            from .sampler import get_sampler
+            self.sampler = get_sampler()
+        if self.threads is None:
+            self.threads = {threading.get_ident()}
+        self.start_time = time.time()
+        threading.Thread.start(self)
+
+    def run(self):
+        """Capture the stacks until stop() is called.
+        """
+        cpu_begin = time.thread_time()
+        check_time = time.monotonic() + EnergyProfiler.OVERHEAD_CHECK_SECONDS
+        check_cpu, check_wall = cpu_begin, time.monotonic()
+        next_time = time.monotonic()
+        while True:
+            next_time += self.interval
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+            if self.stop_event.wait(delay):
+                break
+            self.sample()
+
+            now = time.monotonic()
+            if now >= check_time:
+                cpu = time.thread_time()
+                if (cpu - check_cpu) / (now - check_wall) > self.max_overhead:
+                    self.interval *= 2
+                check_time = now + EnergyProfiler.OVERHEAD_CHECK_SECONDS
+                check_cpu, check_wall = cpu, now
+        self.cpu_time = time.thread_time() - cpu_begin
+
+    def profiled_threads(self, frames):
+        """Get the threads to capture.
+        :param frames: the current frame of every thread.
+        :returns: an iterable with the idents of the threads.
+        """
+        if self.threads == "all":
+            excluded = {threading.get_ident(), self.sampler.ident}
+            return [ident for ident in frames if ident not in excluded]
+        return self.threads
+
+    def sample(self):
+        """Capture the stacks of the profiled threads.
+        """
+        timestamp = time.time()
+        frames = sys._current_frames()
+        for ident in self.profiled_threads(frames):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            stack_id = self.stack_ids.get(stack)
+            if stack_id is None:
+                stack_id = self.stack_ids[stack] = len(self.stacks)
+                self.stacks.append(stack)
+            self.samples.append(timestamp, [stack_id, ident])
+
+    def stop(self):
+        """Stop profiling and wait for the sampler to record the energy until now.
+        """
+        self.end_time = time.time()
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.sampler.wait_for(self.end_time)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def get_overhead(self):
+        """Get how many resources the profiler used.
+        :returns: a dictionary with the CPU seconds used by the profiler, the fraction of a
+            core that this represents, the number of stacks captured and the final interval.
+        """
+        wall_time = (self.end_time or time.time()) - (self.start_time or time.time())
+        return {
+            "cpu_seconds": self.cpu_time,
+            "cpu_fraction": self.cpu_time / wall_time if wall_time > 0 else 0.0,
+            "samples": len(self.samples),
+            "interval": self.interval,
+        }
+
+    def energy_per_stack(self):
+        """Split the energy recorded while profiling across the captured stacks. Each capture
+        covers the time until the next capture (or the end of profiling).
+        :returns: a dictionary with an array per component with the energy of each stack,
+            indexed by stack id.
+        """
+        timestamps, values = self.samples.get()
+        stack_ids = values[:, 0].astype(int)
+        captures = np.unique(timestamps)
+        ends = np.append(captures[1:], max(self.end_time, captures[-1]) if len(captures)
+                         else self.end_time)
+        ends = ends[np.searchsorted(captures, timestamps)]
+
+        covering = (timestamps.min(), ends.max()) if len(timestamps) else (None, None)
+        with self.sampler.condition:
+            sample_timestamps, counters = self.sampler.buffer.get(*covering)
+        shares = apportion(sample_timestamps, counters, timestamps, ends)
+        energy = {}
+        for name, columns in self.sampler.layout.items():
+            energy[name] = np.bincount(stack_ids, shares[:, columns].sum(axis=1),
+                                       minlength=len(self.stacks))
+        return energy
+
+    def component_energy(self, component=None):
+        """Get the energy of each stack for a component.
+        :param component: the component, e.g. cpu or gpu. Defaults to the sum of the
+            components in ENERGY_COMPONENTS recorded by the sampler.
+        :returns: an array with the joules of each stack.
+        """
+        energy = self.energy_per_stack()
+        if component is not None:
+            return energy[component]
+        total = np.zeros(len(self.stacks))
+        for name in ENERGY_COMPONENTS:
+            if name in energy:
+                total += energy[name]
+        return total
+
+    def collapsed(self, component=None, unit=1e-3):
+        """Get the energy of each call path as collapsed stacks.
+        :param component: the component, see component_energy.
+        :param unit: the joules represented by one unit of the values, which tools expect to
+            be integers. Defaults to millijoules.
+        :returns: a dictionary mapping each call path (frames separated by semicolons,
+            outermost first) to its energy in units.
+        """
+        result = {}
+        for stack, joules in zip(self.stacks, self.component_energy(component)):
+            value = int(round(joules / unit))
+            if value > 0:
+                path = ";".join(frame_label(code) for code in stack)
+                result[path] = result.get(path, 0) + value
+        return result
+
+    def write_collapsed(self, path, component=None, unit=1e-3):
+        """Write the energy of each call path as collapsed stacks, e.g. for
+        flamegraph.pl profile.folded > profile.svg.
+        :param path: the file.
+        :param component: the component, see component_energy.
+        :param unit: the joules represented by one unit of the values.
+        """
+        with open(path, "w") as f:
+            for stack, value in sorted(self.collapsed(component, unit).items()):
+                f.write("{} {}\n".format(stack, value))
+
+    def functions(self, component=None):
+        """Get the energy used by each function, including the functions it called.
+        :param component: the component, see component_energy.
+        :returns: a list of (function label, joules), from the most to the least energy.
+        """
+        totals = {}
+        for stack, joules in zip(self.stacks, self.component_energy(component)):
+            # Recursive functions are only counted once per stack.
+            for label in {frame_label(code) for code in stack}:
+                totals[label] = totals.get(label, 0.0) + joules
+        return sorted(totals.items(), key=lambda item: -item[1])
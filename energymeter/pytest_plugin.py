@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+This module implements a pytest plugin that gates energy regressions as latency regressions
+are gated. The energy per call of tests marked with @pytest.mark.energy (or of the functions
+passed to the energy fixture) is measured with runner.measure, which repeats runs and
+subtracts the idle power, and compared with a JSON baseline file: tests fail when the joules
+per call of a component exceed the baseline by more than the tolerance. The plugin is
+installed with the package (entry point pytest11) and does nothing unless tests use it.
+
+Meters are created by the energy_meter_factory fixture, which defaults to
+EnergyMeter(ignore_disk=True) and can be overridden in a conftest.py, e.g. with a
+SharedEnergyMeter on a sampler with fake sources on CI machines without RAPL or GPUs.
+"""
+import inspect
+import json
+import os
+
+import pytest
+
+BASELINE_VERSION = 1
+DEFAULT_TOLERANCE = 0.1
+
+
+def compare(result, baseline, tolerance, min_joules=0.0):
+    """Compare a measurement with its baseline. A component regresses when its joules per
+    call exceed the baseline by more than tolerance, and the difference is beyond the
+    confidence interval of the measurement and min_joules.
+    :param result: the measurement, see runner.measure.
+    :param baseline: the stored measurement.
+    :param tolerance: the maximum relative increase, e.g. 0.1 for 10%.
+    :param min_joules: the absolute increase that is always tolerated, for components that
+        use almost no energy.
+    :returns: a list with a message per component that regressed.
+    """
+    current = dict(result["joules_per_call"], total=result["total_joules_per_call"])
+    ci = dict(result["ci"], total=result["total_ci"])
+    stored = dict(baseline["joules_per_call"], total=baseline["total_joules_per_call"])
+    regressions = []
+    for name, joules in current.items():
+        if name not in stored:
+            continue
+        limit = stored[name] * (1 + tolerance) + min_joules
+        if joules - ci[name] > limit:
+            regressions.append("{}: {:.6g} J per call (+-{:.2g}) > {:.6g} J baseline + {:.0%}"
+                               .format(name, joules, ci[name], stored[name], tolerance))
+    return regressions
+
+
+def load_baseline(path):
+    """Load a baseline file.
+    :param path: the JSON file.
+    :returns: a dictionary mapping each test id to its stored measurement, empty if the
+        file does not exist.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != BASELINE_VERSION:
+        raise Exception("Unsupported energy baseline version in {}.".format(path))
+    return data["tests"]
+
+
+def save_baseline(path, results):
+    """Store measurements in a baseline file, keeping the tests that were not measured.
+    :param path: the JSON file.
+    :param results: a dictionary mapping each test id to its measurement.
+    """
+    tests = load_baseline(path)
+    tests.update(results)
+    with open(path, "w") as f:
+        json.dump({"version": BASELINE_VERSION, "tests": tests}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def stored_fields(result):
+    """Keep the fields of a measurement that are stored in the baseline, as JSON types.
+    :param result: the measurement, see runner.measure.
+    :returns: a dictionary.
+    """
+    fields = {}
+    for key in ("joules_per_call", "ci", "baseline_watts"):
+        fields[key] = {name: float(value) for name, value in result[key].items()}
+    for key in ("total_joules_per_call", "total_ci", "seconds_per_call"):
+        fields[key] = float(result[key])
+    for key in ("runs", "calls_per_run"):
+        fields[key] = int(result[key])
+    fields["converged"] = bool(result["converged"])
+    return fields
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("energy", "energy regressions (energymeter)")
+    group.addoption("--energy-baseline", default=None,
+                    help="JSON file with the energy baseline of the tests.")
+    group.addoption("--energy-save", action="store_true", default=False,
+                    help="store the measured energy in the baseline file instead of "
+                         "comparing it.")
+    group.addoption("--energy-tolerance", type=float, default=None,
+                    help="maximum relative increase of the joules per call (default 0.1).")
+    group.addoption("--energy-min-joules", type=float, default=None,
+                    help="absolute increase of the joules per call that is always tolerated.")
+    parser.addini("energy_baseline", "JSON file with the energy baseline of the tests.")
+    parser.addini("energy_tolerance", "maximum relative increase of the joules per call.")
+    parser.addini("energy_min_joules", "absolute increase that is always tolerated.")
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "energy(tolerance=None, min_joules=None, **options): measure the energy "
+        "per call of the test and compare it with the baseline. options are passed to "
+        "energymeter.runner.measure, e.g. min_runs or target_ci.")
+    config.pluginmanager.register(EnergyPlugin(config), "energymeter-plugin")
+
+
+def option(config, name, ini, default):
+    value = config.getoption(name)
+    if value is None:
+        value = config.getini(ini) or None
+    return default if value is None else value
+
+
+class EnergyPlugin:
+    """Keeps the baseline and the measurements of a test session.
+    """
+
+    def __init__(self, config):
+        self.path = option(config, "--energy-baseline", "energy_baseline", None)
+        self.save = config.getoption("--energy-save")
+        if self.save and not self.path:
+            raise pytest.UsageError("--energy-save requires --energy-baseline.")
+        self.tolerance = float(option(config, "--energy-tolerance", "energy_tolerance",
+                                      DEFAULT_TOLERANCE))
+        self.min_joules = float(option(config, "--energy-min-joules", "energy_min_joules", 0.0))
+        self.baseline = load_baseline(self.path)
+        self.results = {}
+        self.regressions = {}
+
+    def run(self, key, meter, fn, args, kwargs, marker):
+        """Measure a function and compare it with its baseline.
+        :param key: the id of the measurement in the baseline.
+        :param meter: the meter.
+        :param fn: the function.
+        :param args: the positional arguments of fn.
+        :param kwargs: the keyword arguments of fn.
+        :param marker: the energy marker of the test, or None.
+        :returns: the measurement.
+        """
+        from .runner import measure
+
+        options = dict(marker.kwargs) if marker else {}
+        tolerance = options.pop("tolerance", None)
+        tolerance = self.tolerance if tolerance is None else tolerance
+        min_joules = options.pop("min_joules", None)
+        min_joules = self.min_joules if min_joules is None else min_joules
+
+        result = measure(meter, fn, args, kwargs, **options)
+        self.results[key] = stored_fields(result)
+        if not self.save and key in self.baseline:
+            regressions = compare(result, self.baseline[key], tolerance, min_joules)
+            if regressions:
+                self.regressions[key] = regressions
+                pytest.fail("Energy regression in {}:\n  {}".format(
+                    key, "\n  ".join(regressions)), pytrace=False)
+        return result
+
+    def pytest_collection_modifyitems(self, items):
+        # Marked tests get the meter factory with their fixtures, see pytest_pyfunc_call.
+        for item in items:
+            if (item.get_closest_marker("energy") is not None and
+                    "energy_meter_factory" not in item.fixturenames):
+                item.fixturenames.append("energy_meter_factory")
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_pyfunc_call(self, pyfuncitem):
+        marker = pyfuncitem.get_closest_marker("energy")
+        # Tests that use the fixture choose what is measured.
+        if marker is None or "energy" in pyfuncitem.fixturenames:
+            return None
+        if inspect.iscoroutinefunction(pyfuncitem.obj):
+            raise pytest.UsageError("The energy marker does not support coroutine functions.")
+        # funcargs also has the fixtures that the test does not take, e.g. the factory.
+        testargs = {arg: pyfuncitem.funcargs[arg]
+                    for arg in inspect.signature(pyfuncitem.obj).parameters
+                    if arg in pyfuncitem.funcargs}
+        factory = pyfuncitem.funcargs["energy_meter_factory"]
+        self.run(pyfuncitem.nodeid, factory(), pyfuncitem.obj, (), testargs, marker)
+        return True
+
+    def pytest_sessionfinish(self, session):
+        if self.save and self.results:
+            save_baseline(self.path, self.results)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.results:
+            return
+        terminalreporter.section("energy")
+        for key, result in self.results.items():
+            line = "{}: {:.6g} J per call (+-{:.2g})".format(
+                key, result["total_joules_per_call"], result["total_ci"])
+            stored = self.baseline.get(key)
+            if stored and stored["total_joules_per_call"] > 0:
+                line += ", {:+.1%} vs baseline".format(
+                    result["total_joules_per_call"] / stored["total_joules_per_call"] - 1)
+            if key in self.regressions:
+                line += " REGRESSION"
+            terminalreporter.write_line(line)
+        if self.save:
+            terminalreporter.write_line("Energy baseline saved to {}.".format(self.path))
+
+
+class EnergyFixture:
+    """Measures functions inside a test, see the energy fixture.
+    """
+
+    def __init__(self, plugin, request):
+        self.plugin = plugin
+        self.request = request
+        self.calls = 0
+
+    def __call__(self, fn, *args, **kwargs):
+        """Measure the energy per call of a function and compare it with the baseline.
+        :param fn: the function.
+        :param args: the positional arguments of fn.
+        :param kwargs: the keyword arguments of fn.
+        :returns: the measurement, see runner.measure.
+        """
+        self.calls += 1
+        key = self.request.node.nodeid
+        if self.calls > 1:
+            key = "{}#{}".format(key, self.calls)
+        meter = self.request.getfixturevalue("energy_meter_factory")()
+        marker = self.request.node.get_closest_marker("energy")
+        return self.plugin.run(key, meter, fn, args, kwargs, marker)
+
+
+@pytest.fixture
+def energy_meter_factory():
+    """Fixture with the function that creates the meter of each measurement. Override it in
+    a conftest.py to use other meters or fake sources.
+    """
+    from .energy_meter import EnergyMeter
+
+    return lambda: EnergyMeter(ignore_disk=True)
+
+
+@pytest.fixture
+def energy(request):
+    """Fixture to measure the energy per call of functions, e.g.
+    result = energy(model, batch). Options of the energy marker apply to every measurement.
+    """
+    return EnergyFixture(request.config.pluginmanager.get_plugin("energymeter-plugin"), request)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+This module implements RaplReader, which reads the RAPL energy counters of the CPU packages
+and their subdomains (core, uncore, DRAM, ...) directly from the powercap interface in
+/sys/class/powercap. The counter files are kept open and re-read with os.pread, so they can
+be sampled at high rates, and wraparounds of the counters are accounted for.
+"""
+import os
+import re
+import threading
+
+import numpy as np
+
+
+class RaplDomain:
+    """A RAPL domain, i.e. a directory of the powercap interface with an energy counter.
+    """
+
+    def __init__(self, path, socket):
+        """Open the energy counter of the domain and read its static information.
+        :param path: the path to the directory of the domain.
+        :param socket: the id of the package to which the domain belongs.
+        """
+        self.path = path
+        self.socket = socket
+        with open(os.path.join(path, "name")) as f:
+            self.name = f.read().strip()
+        with open(os.path.join(path, "max_energy_range_uj")) as f:
+            self.max_energy_range_uj = int(f.read())
+        # Package domains are named package-N, subdomains are named core, uncore, dram...
+        self.kind = "package" if self.name.startswith("package") else self.name
+        self.fd = os.open(os.path.join(path, "energy_uj"), os.O_RDONLY)
+
+    def read_uj(self):
+        """Read the raw value of the counter.
+        :returns: the microjoules in the counter, which wraps at max_energy_range_uj.
+        """
+        return int(os.pread(self.fd, 32, 0))
+
+    def close(self):
+        """Close the counter file.
+        """
+        os.close(self.fd)
+
+
+class RaplReader:
+    """Reads the energy counters of every RAPL domain in the powercap interface. The raw
+    counters wrap at max_energy_range_uj (which can take only a few minutes under load), so
+    the reader keeps the last raw value of each counter and adds max_energy_range_uj every time
+    a counter goes backwards. This makes the counters returned by read() monotonic as long as
+    they are read at least once per wraparound period, which hold() guarantees by reading them
+    in a background thread while meters run.
+
+    On Intel, the domains are found in directories named intel-rapl:N (package N) and
+    intel-rapl:N:M (subdomain M of package N). Recent Linux kernels expose the RAPL counters of
+    AMD processors with the same names.
+    """
+
+    DEFAULT_ROOT = "/sys/class/powercap"
+    DOMAIN_PATTERN = re.compile(r"^(intel-rapl|amd-rapl):(\d+)(?::(\d+))?$")
+    # An upper bound of the power of a domain, to derive how often the counters must be
+    # read so that no wraparound is missed.
+    MAX_WATTS = 1000.0
+    MIN_POLL_SECONDS = 0.01
+    MAX_POLL_SECONDS = 60.0
+
+    def __init__(self, root=None):
+        """Find and open all the RAPL domains.
+        :param root: the directory containing the powercap domains. Defaults to DEFAULT_ROOT,
+            this can be changed to read a fake tree of domains, e.g. for testing.
+        """
+        self.root = root or RaplReader.DEFAULT_ROOT
+        entries = []
+        for entry in os.listdir(self.root):
+            match = RaplReader.DOMAIN_PATTERN.match(entry)
+            if match:
+                package, subdomain = int(match.group(2)), match.group(3)
+                entries.append(((package, -1 if subdomain is None else int(subdomain)), entry))
+        if not entries:
+            raise Exception("No RAPL domains were found in {}.".format(self.root))
+
+        self.domains = []
+        try:
+            for (package, _), entry in sorted(entries):
+                self.domains.append(RaplDomain(os.path.join(self.root, entry), package))
+        except:
+            self.close()
+            raise
+
+        self.max_energy_range_uj = np.array([d.max_energy_range_uj for d in self.domains],
+                                            dtype=np.float64)
+        self.last_uj = np.array([d.read_uj() for d in self.domains], dtype=np.float64)
+        self.offset_uj = np.zeros(len(self.domains))
+        self.wraparounds = 0
+        self.lock = threading.Lock()
+
+        # Background reads while meters hold the reader, see hold().
+        self.poll_lock = threading.Lock()
+        self.holders = 0
+        self.poll_stop = None
+
+    def indexes(self, kind):
+        """Get the position of the domains of a kind in the arrays returned by read().
+        :param kind: the kind of domain, e.g. "package", "core", "uncore" or "dram".
+        :returns: a list with the indexes of the domains, sorted by package.
+        """
+        return [i for i, d in enumerate(self.domains) if d.kind == kind]
+
+    def labels(self):
+        """Get a label for each domain, e.g. package-0 or package-0/dram.
+        :returns: a list with the label of each domain.
+        """
+        return [d.name if d.kind == "package" else "package-{}/{}".format(d.socket, d.name)
+                for d in self.domains]
+
+    def read_uj(self):
+        """Read the counters, correcting their wraparounds.
+        :returns: an array with the cumulative microjoules of each domain.
+        """
+        with self.lock:
+            raw = np.array([d.read_uj() for d in self.domains], dtype=np.float64)
+            wrapped = raw < self.last_uj
+            if wrapped.any():
+                self.offset_uj[wrapped] += self.max_energy_range_uj[wrapped]
+                self.wraparounds += int(wrapped.sum())
+            self.last_uj = raw
+            return raw + self.offset_uj
+
+    def read(self):
+        """Read the counters, correcting their wraparounds.
+        :returns: an array with the cumulative joules of each domain.
+        """
+        return self.read_uj() * 1e-6
+
+    def poll_seconds(self):
+        """Get how often the counters must be read so that no wraparound is missed, half the
+        time the fastest wrapping counter takes to wrap at MAX_WATTS.
+        :returns: the period in seconds.
+        """
+        seconds = self.max_energy_range_uj.min() * 1e-6 / RaplReader.MAX_WATTS / 2
+        return min(max(seconds, RaplReader.MIN_POLL_SECONDS), RaplReader.MAX_POLL_SECONDS)
+
+    def hold(self):
+        """Read the counters every poll_seconds() in a background thread until every holder
+        calls release(), so that meters that only read the counters when they begin and end
+        do not miss wraparounds in long runs.
+        """
+        with self.poll_lock:
+            self.holders += 1
+            if self.poll_stop is None:
+                self.poll_stop = threading.Event()
+                threading.Thread(target=self.poll, args=(self.poll_stop,),
+                                 name="RAPL Polling Thread", daemon=True).start()
+
+    def release(self):
+        """Stop the background reads started by hold() when there are no holders left.
+        """
+        with self.poll_lock:
+            self.holders -= 1
+            if self.holders == 0 and self.poll_stop is not None:
+                self.poll_stop.set()
+                self.poll_stop = None
+
+    def poll(self, stop):
+        """Read the counters until stop is set.
+        :param stop: the Event that stops the thread.
+        """
+        while not stop.wait(self.poll_seconds()):
+            self.read_uj()
+
+    def close(self):
+        """Close the counter files of all the domains.
+        """
+        for domain in self.domains:
+            domain.close()
+        self.domains = []
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_rapl_reader(root=None):
+    """Get the RaplReader of root shared by the whole process, opening it the first time it
+    is requested. Failures are not cached, so the counters are opened again by the next
+    call, e.g. once their permissions are fixed.
+    :param root: the directory where the RAPL domains are found, see RaplReader.
+    :returns: the RaplReader or None if the RAPL counters are not accessible.
+    """
+    root = root or RaplReader.DEFAULT_ROOT
+    with _readers_lock:
+        if root not in _readers:
+            try:
+                _readers[root] = RaplReader(root)
+            except Exception as e:
+                print("The RAPL counters in {} could not be opened: {}".format(root, e))
+                return None
+        return _readers[root]
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+This module implements TieredBuffer, a drop-in replacement of SampleBuffer for cumulative
+counters whose memory does not grow with the duration of the run. The most recent samples
+are kept as they are, and older ones are rolled into coarser tiers (1 second, then 1 minute
+by default) that keep, per bucket, the counters at its end and the minimum and maximum rate
+at which each counter grew. As the counters are cumulative, the energy between any two
+instants is still obtained by interpolating them, at the best resolution kept for each
+instant.
+"""
+import numpy as np
+
+from .buffers import window
+
+
+class Level:
+    """The points of a level of a TieredBuffer: timestamps, cumulative counters and the
+    minimum and maximum rate of each counter since the previous point. Arrays start small
+    and are doubled as points are appended, up to twice the capacity. Then, when they are
+    full, the oldest half is dropped into new arrays, so views returned before remain valid
+    and appending is amortized O(1).
+    """
+
+    INITIAL_SIZE = 1024
+
+    def __init__(self, n_columns, capacity, resolution=None):
+        """Allocate the initial arrays.
+        :param n_columns: the number of counters.
+        :param capacity: the number of points that are always kept.
+        :param resolution: the width in seconds of the buckets of the level, None for raw
+            samples.
+        """
+        self.capacity = capacity
+        self.resolution = resolution
+        size = min(Level.INITIAL_SIZE, 2 * capacity)
+        self.timestamps = np.empty(size)
+        self.counters = np.empty((size, n_columns))
+        if resolution is not None:
+            self.minimum = np.empty((size, n_columns))
+            self.maximum = np.empty((size, n_columns))
+        self.n_points = 0
+
+    def __len__(self):
+        return self.n_points
+
+    def arrays(self):
+        """Get the arrays stored per point.
+        :returns: a list with the arrays of timestamps, counters and, in aggregate levels,
+            minimum and maximum rates.
+        """
+        if self.resolution is None:
+            return [self.timestamps, self.counters]
+        return [self.timestamps, self.counters, self.minimum, self.maximum]
+
+    def extend(self, *columns):
+        """Append points, dropping the oldest ones if the level is full.
+        :param columns: the arrays of timestamps, counters and, in aggregate levels, minimum
+            and maximum rates of the points.
+        :returns: the arrays of the dropped points, or None if no point was dropped.
+        """
+        n = len(columns[0])
+        size = len(self.timestamps)
+        if self.n_points + n > size and size < 2 * self.capacity:
+            size = min(max(2 * size, self.n_points + n), 2 * self.capacity)
+            self.replace(size, 0, self.n_points)
+        dropped = None
+        if self.n_points + n > size:
+            # Keep the newest capacity points, or fewer if there is no room for the new ones.
+            keep = min(self.n_points, self.capacity, max(0, size - n))
+            cut = self.n_points - keep
+            old = self.get()
+            dropped = [a[:cut] for a in old]
+            if n > size:
+                extra = n - size
+                dropped = [np.concatenate([d, c[:extra]]) for d, c in zip(dropped, columns)]
+                columns = [c[extra:] for c in columns]
+                n = size
+            self.replace(size, cut, keep)
+        for a, c in zip(self.arrays(), columns):
+            a[self.n_points:self.n_points + n] = c
+        self.n_points += n
+        return dropped
+
+    def replace(self, size, first, n):
+        """Move points into new arrays, leaving the old ones untouched for the views in use.
+        :param size: the number of points allocated in the new arrays.
+        :param first: the index of the first point moved.
+        :param n: the number of points moved.
+        """
+        new = [np.empty((size,) + a.shape[1:]) for a in self.arrays()]
+        for a, b in zip(new, self.arrays()):
+            a[:n] = b[first:first + n]
+        self.timestamps, self.counters = new[0], new[1]
+        if self.resolution is not None:
+            self.minimum, self.maximum = new[2], new[3]
+        self.n_points = n
+
+    def get(self):
+        """Get the points of the level.
+        :returns: views of the arrays of the stored points.
+        """
+        return [a[:self.n_points] for a in self.arrays()]
+
+
+def aggregate(timestamps, counters, minimum, maximum, resolution):
+    """Roll points into buckets of resolution seconds, keeping the last point of each bucket
+    and the minimum and maximum rates of the points in the bucket.
+    :param timestamps: the timestamps of the points.
+    :param counters: the cumulative counters of the points.
+    :param minimum: the minimum rate of each counter since the previous point.
+    :param maximum: the maximum rate of each counter since the previous point.
+    :param resolution: the width of the buckets in seconds.
+    :returns: the timestamps, counters, minimum and maximum rates of the buckets.
+    """
+    buckets = np.floor(timestamps / resolution)
+    last = np.append(np.flatnonzero(np.diff(buckets)), len(timestamps) - 1)
+    first = np.concatenate([[0], last[:-1] + 1])
+    # Rates are NaN before the first point ever stored, fmin and fmax ignore them.
+    return (timestamps[last], counters[last], np.fmin.reduceat(minimum, first),
+            np.fmax.reduceat(maximum, first))
+
+
+class TieredBuffer:
+    """Bounded-memory storage for timestamped cumulative counters, with the same interface as
+    SampleBuffer. At most twice RAW_CAPACITY raw samples are kept, older samples are rolled
+    into the first tier and points dropped by a tier are rolled into the next one. Points
+    dropped by the last tier are discarded.
+    """
+
+    # 10 minutes of samples at the default sampling period of EnergySampler.
+    RAW_CAPACITY = 6000
+    # (resolution in seconds, capacity): 1 hour at 1 second and 1 week at 1 minute.
+    TIERS = ((1.0, 3600), (60.0, 10080))
+
+    def __init__(self, n_columns, capacity=None, tiers=None):
+        """Allocate the levels.
+        :param n_columns: the number of counters stored with each timestamp.
+        :param capacity: the number of raw samples that are always kept. Defaults to
+            RAW_CAPACITY.
+        :param tiers: a list of (resolution in seconds, capacity) from finest to coarsest.
+            Defaults to TIERS.
+        """
+        self.raw = Level(n_columns, capacity or TieredBuffer.RAW_CAPACITY)
+        self.tiers = [Level(n_columns, c, r)
+                      for r, c in (TieredBuffer.TIERS if tiers is None else tiers)]
+        # The last raw sample rolled into the tiers, to get the rate of the next one.
+        self.last_rolled = None
+
+    def __len__(self):
+        return len(self.raw)
+
+    def append(self, timestamp, row):
+        """Append a sample, rolling the oldest raw samples into the tiers if needed. This is
+        not thread-safe, callers that share the buffer between threads must hold a lock.
+        :param timestamp: the time at which the sample was taken.
+        :param row: the value of each counter.
+        """
+        dropped = self.raw.extend(np.array([timestamp]), np.asarray(row, dtype=float)[None])
+        if dropped is not None and len(dropped[0]):
+            self.roll(*dropped)
+
+    def roll(self, timestamps, counters):
+        """Roll raw samples into the tiers.
+        :param timestamps: the timestamps of the samples.
+        :param counters: the counters of the samples.
+        """
+        if self.last_rolled is None:
+            previous_t, previous = np.nan, np.full(counters.shape[1], np.nan)
+        else:
+            previous_t, previous = self.last_rolled
+        self.last_rolled = (timestamps[-1], counters[-1].copy())
+        rates = (np.diff(counters, axis=0, prepend=previous[None]) /
+                 np.diff(timestamps, prepend=previous_t)[:, None])
+        points = (timestamps, counters, rates, rates)
+        for tier in self.tiers:
+            points = tier.extend(*aggregate(*points, tier.resolution))
+            if points is None or len(points[0]) == 0:
+                break
+
+    def levels(self):
+        """Get the levels that have points, from finest to coarsest.
+        :returns: a list of Levels.
+        """
+        return [level for level in [self.raw] + self.tiers if len(level)]
+
+    def get(self, start_time=None, end_time=None):
+        """Get the points kept, at the best resolution available for each instant. Only the
+        points of the levels that cover the window are copied.
+        :param start_time: the beginning of the window, the latest point at or before it is
+            the first returned. Defaults to the oldest point.
+        :param end_time: the end of the window, the earliest point at or after it is the
+            last returned. Defaults to the latest point.
+        :returns: an array of timestamps and an array of counters (one row per point).
+        """
+        levels = self.levels()[::-1]
+        if not levels:
+            return self.raw.get()
+        # Each level contributes the points that cover the window within it, the extra
+        # neighbours of the levels that do not overlap it are dropped after concatenating.
+        timestamps, counters = [], []
+        for level in levels:
+            t, c = level.get()[:2]
+            covering = window(t, start_time, end_time)
+            timestamps.append(t[covering])
+            counters.append(c[covering])
+        timestamps, counters = np.concatenate(timestamps), np.concatenate(counters)
+        covering = window(timestamps, start_time, end_time)
+        return timestamps[covering], counters[covering]
+
+    def get_tier(self, i):
+        """Get the aggregates of a tier.
+        :param i: the index of the tier in tiers.
+        :returns: a dictionary with the end timestamp of each bucket, and the joules (increase
+            of the counters), mean, minimum and maximum rates of each counter since the
+            previous bucket.
+        """
+        timestamps, counters, minimum, maximum = self.tiers[i].get()
+        joules = np.diff(counters, axis=0)
+        return {
+            "timestamps": timestamps[1:],
+            "joules": joules,
+            "mean": joules / np.diff(timestamps)[:, None],
+            "min": minimum[1:],
+            "max": maximum[1:],
+        }
+
+    def last_timestamp(self):
+        """Get the time of the latest sample.
+        :returns: the timestamp of the latest sample or -inf if there are no samples yet.
+        """
+        if len(self.raw) == 0:
+            return -np.inf
+        return self.raw.timestamps[len(self.raw) - 1]
+
+    def counters_at(self, timestamp):
+        """Get the counters at timestamp, interpolating linearly between the two closest
+        points of the finest level that covers it.
+        :param timestamp: the time at which the counters are required.
+        :returns: an array with the value of each counter.
+        """
+        levels = self.levels()
+        newer = None
+        for level in levels:
+            timestamps, counters = level.get()[:2]
+            if timestamps[0] <= timestamp:
+                i = np.searchsorted(timestamps, timestamp, side="right")
+                if i < len(timestamps):
+                    t1, c1 = timestamps[i], counters[i]
+                elif newer is not None:
+                    # Between the last point of this level and the first of the finer one.
+                    t1, c1 = newer
+                else:
+                    return counters[-1].copy()
+                w = (timestamp - timestamps[i - 1]) / (t1 - timestamps[i - 1])
+                return counters[i - 1] + w * (c1 - counters[i - 1])
+            newer = (timestamps[0], counters[0])
+        # Before every point kept.
+        return levels[-1].get()[1][0].copy()
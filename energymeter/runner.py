@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+This module implements a statistical runner that measures the energy per call of a function.
+Each run calls the function enough times to last well beyond the sampling period of the
+meter, the idle power of the host is measured once and subtracted, and runs are repeated
+until the confidence interval of the joules per call is narrow enough.
+"""
+import math
+import statistics
+import time
+
+import numpy as np
+
+# The idle power is measured again after this many seconds.
+BASELINE_MAX_AGE = 600.0
+
+
+def t_quantile(confidence, dof):
+    """Get the two-sided quantile of Student's t distribution. It has a closed form for 1
+    and 2 degrees of freedom, otherwise the Cornish-Fisher expansion around the normal
+    quantile is used (within 1% from 3 degrees of freedom for confidence levels up to 99%).
+    :param confidence: the confidence level, e.g. 0.95.
+    :param dof: the degrees of freedom.
+    :returns: the quantile.
+    """
+    p = (1 + confidence) / 2
+    if dof == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = statistics.NormalDist().inv_cdf(p)
+    v = float(dof)
+    return (z + (z ** 3 + z) / (4 * v) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * v ** 2) +
+            (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * v ** 3) +
+            (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) /
+            (92160 * v ** 4))
+
+
+def component_joules(meter):
+    """Get the joules of each component of a meter that has ended, summing packages and
+    devices. The components are those reported by the meter, e.g. cpu, dram, gpu and disk,
+    and any other component recorded by the sampler of a SharedEnergyMeter.
+    :param meter: the meter.
+    :returns: a dictionary with the joules of each component.
+    """
+    joules = meter.get_total_joules_per_component()
+    return {name: float(np.sum(value)) for name, value in joules.items()}
+
+
+def measure_baseline(meter, seconds):
+    """Measure the idle power of the host with a meter.
+    :param meter: the meter, which is restarted.
+    :param seconds: how long to measure.
+    :returns: a dictionary with the watts of each component.
+    """
+    meter.begin()
+    time.sleep(seconds)
+    meter.end()
+    return {name: joules / meter.duration for name, joules in component_joules(meter).items()}
+
+
+def get_baseline(meter, seconds, refresh=False):
+    """Get the idle power of the host, which is cached in the meter for BASELINE_MAX_AGE
+    seconds, so that several functions can be compared with the same baseline.
+    :param meter: the meter, which is restarted if the baseline is measured.
+    :param seconds: how long to measure.
+    :param refresh: if True, the baseline is always measured.
+    :returns: a dictionary with the watts of each component.
+    """
+    cached = getattr(meter, "baseline", None)
+    if refresh or cached is None or time.time() - cached[0] > BASELINE_MAX_AGE:
+        meter.baseline = (time.time(), measure_baseline(meter, seconds))
+    return meter.baseline[1]
+
+
+def calibrate_calls(calls, elapsed, min_run_seconds):
+    """Get the number of calls per run so that runs last at least min_run_seconds.
+    :param calls: the calls of a run.
+    :param elapsed: the seconds the run took.
+    :param min_run_seconds: the minimum duration of each run.
+    :returns: the number of calls, at least calls.
+    """
+    return max(calls, math.ceil(min_run_seconds / max(elapsed / calls, 1e-9)))
+
+
+def measure(meter, fn, args=(), kwargs=None, warmup=1, min_runs=5, max_runs=100,
+            target_ci=0.05, confidence=0.95, min_run_seconds=1.0, baseline_seconds=2.0,
+            subtract_baseline=True, max_seconds=300.0):
+    """Measure the energy per call of a function, repeating runs until the confidence
+    interval of the joules per call is within target_ci of the mean.
+    :param meter: the meter used for every run, e.g. an EnergyMeter or SharedEnergyMeter.
+    :param fn: the function.
+    :param args: the positional arguments of fn.
+    :param kwargs: the keyword arguments of fn.
+    :param warmup: the number of runs that are not measured, to fill caches, compile...
+        They also calibrate the calls per run. With 0, fn is only called while the meter
+        runs: the first run calls it once to calibrate the calls of the following runs, and
+        is left out of the statistics like a warmup run.
+    :param min_runs: the minimum number of measured runs.
+    :param max_runs: the maximum number of measured runs.
+    :param target_ci: the maximum half-width of the confidence interval of the total joules
+        per call, relative to its mean.
+    :param confidence: the confidence level of the intervals.
+    :param min_run_seconds: the minimum duration of each run. Short functions are called
+        several times per run, so that runs span many samples of the meter.
+    :param baseline_seconds: how long the idle power of the host is measured.
+    :param subtract_baseline: if the energy of the idle power must be subtracted.
+    :param max_seconds: the maximum time spent in measured runs.
+    :returns: a dictionary with the mean and the half-width of the confidence interval of the
+        joules per call of each component and in total, the idle watts subtracted, the number
+        of runs, the calls per run, the seconds per call and if the target was reached.
+    """
+    kwargs = kwargs or {}
+    if min_runs < 2:
+        raise Exception("At least 2 runs are required to estimate a confidence interval.")
+
+    # The baseline is measured first, so that the tail of the warmup runs is not included.
+    baseline = get_baseline(meter, baseline_seconds) if subtract_baseline else {}
+
+    # Warmup runs also calibrate the number of calls per run.
+    calls = 1
+    for _ in range(warmup):
+        t = time.perf_counter()
+        for _ in range(calls):
+            fn(*args, **kwargs)
+        elapsed = time.perf_counter() - t
+        calls = calibrate_calls(calls, elapsed, min_run_seconds)
+
+    per_call, durations = [], []
+    deadline = time.time() + max_seconds
+    converged = False
+    calibrating = warmup == 0
+    while True:
+        meter.begin()
+        for _ in range(calls):
+            fn(*args, **kwargs)
+        meter.end()
+        if calibrating:
+            # A single call is too short to be measured, it only calibrates the calls per run.
+            calls = calibrate_calls(calls, meter.duration, min_run_seconds)
+            calibrating = False
+            continue
+        joules = component_joules(meter)
+        if not per_call:
+            components = list(joules)
+            watts = np.array([baseline.get(name, 0.0) for name in components])
+        per_call.append((np.array([joules[name] for name in components])
+                         - watts * meter.duration) / calls)
+        durations.append(meter.duration / calls)
+
+        n = len(per_call)
+        if n >= min_runs:
+            totals = np.sum(per_call, axis=1)
+            half_width = t_quantile(confidence, n - 1) * np.std(totals, ddof=1) / math.sqrt(n)
+            converged = half_width <= target_ci * abs(np.mean(totals))
+            if converged or n >= max_runs or time.time() > deadline:
+                break
+
+    per_call = np.array(per_call)
+    half_widths = t_quantile(confidence, n - 1) * per_call.std(axis=0, ddof=1) / math.sqrt(n)
+    totals = per_call.sum(axis=1)
+    return {
+        "joules_per_call": dict(zip(components, per_call.mean(axis=0))),
+        "ci": dict(zip(components, half_widths)),
+        "total_joules_per_call": float(totals.mean()),
+        "total_ci": float(t_quantile(confidence, n - 1) * totals.std(ddof=1) / math.sqrt(n)),
+        "baseline_watts": dict(zip(components, watts)),
+        "runs": n,
+        "calls_per_run": calls,
+        "seconds_per_call": float(np.mean(durations)),
+        "converged": bool(converged),
+    }
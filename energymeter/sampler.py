@@ -0,0 +1,664 @@
+#!/usr/bin/env python
+"""
+This module implements EnergySampler, a process-wide background thread that keeps
+timestamped cumulative energy counters for CPU, DRAM, GPU and disk, and SharedEnergyMeter,
+a cheap meter that only records its start and end timestamps and obtains its energy from
+the history of the shared sampler.
+"""
+import threading
+import time
+
+import numpy as np
+
+from .attribution import apportion, attributed_between
+from .backends import (IntegratingSource, TimerWheel, backend_names, create_sources,
+                       energy_components, register_backend)
+from .buffers import SampleBuffer
+from .context import MeterContext
+from .diskstats import DiskStatsReader, diskstats_joules
+from .energy_meter import check_disk_parameters, disk_joules, load_disk_parameters
+from .nvml import NvmlReader
+from .procfs import ProcessShareReader
+from .rapl import RaplReader
+from .retention import TieredBuffer
+
+
+class RaplSource:
+    """Reads the cumulative RAPL counters of every package and its subdomains with a
+    RaplReader. As the sampler reads them continuously, their wraparounds are never missed.
+    Package counters are stored in the cpu columns and the rest of domains in columns named
+    after them (dram, core, uncore...).
+    """
+
+    def __init__(self, root=None):
+        """Open the RAPL counters.
+        :param root: the directory where the RAPL domains are found, see RaplReader.
+        """
+        self.reader = RaplReader(root)
+        self.columns = ["cpu" if d.kind == "package" else d.kind for d in self.reader.domains]
+
+    def read(self, timestamp):
+        """Read the counters.
+        :param timestamp: the time at which the counters are read.
+        :returns: an array with the cumulative joules of each column.
+        """
+        return self.reader.read()
+
+
+class NvmlSource:
+    """Reads the cumulative energy of every GPU in the host with an NvmlReader. On GPUs with
+    energy counters these are used directly, otherwise the power draw is integrated with the
+    trapezoidal rule. Energy used while this process (or its children) was using each GPU is
+    also accumulated separately, so that meters can exclude idle time. Columns gpu and
+    gpu_active have one entry per device.
+    """
+
+    def __init__(self, nvml=None):
+        """Init NVML and get a handle for every device.
+        :param nvml: the NVML bindings, see NvmlReader.
+        """
+        self.reader = NvmlReader(nvml)
+        n = len(self.reader.devices)
+        self.columns = ["gpu"] * n + ["gpu_active"] * n
+        self.last_timestamp = None
+        self.last_rows = None
+        self.joules = np.zeros(n)
+        self.active_joules = np.zeros(n)
+
+    def read(self, timestamp):
+        """Sample the GPUs and accumulate their energy since the previous sample.
+        :param timestamp: the time at which the GPUs are sampled.
+        :returns: an array with the cumulative joules and the cumulative active joules of each
+            device.
+        """
+        rows = self.reader.read()
+        if self.last_timestamp is not None:
+            joules = rows[:, 3] - self.last_rows[:, 3]
+            integrated = ((rows[:, 0] + self.last_rows[:, 0]) / 2
+                          * (timestamp - self.last_timestamp))
+            joules = np.where(np.isnan(joules), integrated, joules)
+            self.joules += joules
+            self.active_joules += np.where(rows[:, 2] > 0, joules, 0)
+        self.last_timestamp = timestamp
+        self.last_rows = rows
+        return np.concatenate([self.joules, self.active_joules])
+
+
+class ProcIoSource:
+    """Reads the bytes passed to read and write syscalls by this process from /proc/self/io.
+    These are the same syscalls that EnergyMeter traces with bpftrace, but restricted to
+    this process and readable without sudo.
+    """
+
+    def __init__(self, path="/proc/self/io"):
+        """Check that the io accounting file can be read.
+        :param path: the path to the io accounting file of the process.
+        """
+        self.path = path
+        self.columns = ["rbytes", "wbytes"]
+        self.read(None)
+
+    def read(self, timestamp):
+        """Read the counters.
+        :param timestamp: the time at which the counters are read.
+        :returns: a list with the cumulative bytes read and written.
+        """
+        with open(self.path) as f:
+            counters = dict(line.split(":") for line in f.read().splitlines())
+        return [float(counters["rchar"]), float(counters["wchar"])]
+
+
+class DiskStatsSource:
+    """Reads the busy time of every whole disk from /proc/diskstats with a DiskStatsReader.
+    The busy seconds of each disk are stored in a column named disk_busy:<device>.
+    """
+
+    def __init__(self, path=None):
+        """Open the disk statistics.
+        :param path: the statistics file or directory, see DiskStatsReader.
+        """
+        self.reader = DiskStatsReader(path)
+        self.columns = ["disk_busy:" + d for d in self.reader.devices]
+
+    def read(self, timestamp):
+        """Read the counters.
+        :param timestamp: the time at which the counters are read.
+        :returns: an array with the cumulative busy seconds of each disk.
+        """
+        return self.reader.read()[:, 2]
+
+
+class ProcessShareSource:
+    """Reads the CPU time and resident memory of this process and its descendants and of
+    the whole host with a ProcessShareReader, so that the CPU and DRAM energy of shared
+    hosts can be attributed to the process tree. The resident memory is integrated over time,
+    so that all columns are cumulative.
+    """
+
+    def __init__(self, pid=None, proc_root="/proc"):
+        """Init the reader.
+        :param pid: the root of the process tree. Defaults to the current process.
+        :param proc_root: the path where procfs is mounted.
+        """
+        self.reader = ProcessShareReader(pid, proc_root)
+        self.columns = ["proc_cpu", "host_cpu", "proc_rss", "host_rss"]
+        self.last = None
+        self.rss_seconds = np.zeros(2)
+
+    def read(self, timestamp):
+        usage = self.reader.read()
+        if self.last is not None:
+            last_timestamp, rss = self.last
+            self.rss_seconds += rss * (timestamp - last_timestamp)
+        self.last = (timestamp, usage[2:])
+        return [usage[0], usage[1], self.rss_seconds[0], self.rss_seconds[1]]
+
+
+register_backend("rapl", RaplSource, "RAPL", default=True)
+register_backend("nvml", NvmlSource, "NVML", default=True)
+register_backend("io", ProcIoSource, "IO", default=True)
+register_backend("diskstats", DiskStatsSource, "Disk statistics", default=True)
+register_backend("process_share", ProcessShareSource, "Process statistics")
+
+
+def default_sources(process_share=False, backends=None):
+    """Create the sources available in this host, skipping those that cannot be set up.
+    :param process_share: if the usage of this process tree must be sampled to attribute
+        the CPU and DRAM energy of shared hosts, see ProcessShareSource.
+    :param backends: the names of the registered backends to create, see
+        backends.register_backend. Defaults to the default backends.
+    :returns: a list of sources.
+    """
+    names = list(backends) if backends is not None else backend_names(default_only=True)
+    if process_share and "process_share" not in names:
+        names.append("process_share")
+    return create_sources(names)
+
+
+class EnergySampler(threading.Thread):
+    """Thread that reads the cumulative counters of all its sources every
+    SECONDS_BETWEEN_SAMPLES seconds and stores them with their timestamp. As the counters are
+    cumulative, the energy used between any two instants is obtained with a binary search
+    over the timestamps and the difference of the (linearly interpolated) counters, so any
+    number of overlapping or nested meters can share the same samples.
+
+    Sources with their own seconds_between_samples are polled at that rate by the same
+    thread, with a TimerWheel. Samples taken between two readings of a source are held back
+    until its next reading, and its counters are interpolated between the two readings, so
+    every sample has a value for every column and slow sources are not turned into steps.
+    Samples are thus stored once every source has been read at or after their timestamp.
+    """
+
+    SECONDS_BETWEEN_SAMPLES = 0.1
+
+    def __init__(self, sources=None, seconds_between_samples=None, buffer_cls=None):
+        """Init the buffers where samples are stored.
+        :param sources: the list of sources to sample, see the protocol in the backends
+            module. Each source has a list of component names in its attribute columns and a
+            method read(timestamp) that returns the value of each column. Defaults to the
+            sources available in this host.
+        :param seconds_between_samples: the sampling period. Defaults to
+            SECONDS_BETWEEN_SAMPLES.
+        :param buffer_cls: the class of the buffer where samples are stored, created with the
+            number of columns. Defaults to SampleBuffer, which keeps every sample. TieredBuffer
+            keeps the memory bounded for runs of any length.
+        """
+        threading.Thread.__init__(self, name="Energy Sampling Thread", daemon=True)
+        sources = default_sources() if sources is None else sources
+        self.sources = [source if getattr(source, "cumulative", True)
+                        else IntegratingSource(source) for source in sources]
+        self.seconds_between_samples = (seconds_between_samples or
+                                        EnergySampler.SECONDS_BETWEEN_SAMPLES)
+        self.periods = [getattr(source, "seconds_between_samples", None) or
+                        self.seconds_between_samples for source in self.sources]
+        self.seconds_per_tick = min(self.periods, default=self.seconds_between_samples)
+
+        # Map each component to the columns in which its counters are stored.
+        columns = [name for source in self.sources for name in source.columns]
+        self.layout = {}
+        for i, name in enumerate(columns):
+            self.layout.setdefault(name, []).append(i)
+
+        self.buffer = (buffer_cls or SampleBuffer)(len(columns))
+        # Columns of each source in the rows, and its last reading (timestamp and values).
+        self.source_columns = []
+        for source in self.sources:
+            first = sum(column.stop - column.start for column in self.source_columns)
+            self.source_columns.append(slice(first, first + len(source.columns)))
+        self.readings = [None] * len(self.sources)
+        # Samples waiting for the next reading of some sources: timestamp, row and the
+        # indices of the sources that are missing.
+        self.pending = []
+        self.condition = threading.Condition()
+        self.sample_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # Replaced rather than modified, so that append() can iterate without a lock.
+        self.listeners = []
+
+    def start(self):
+        """Open the sources, take a first sample, so that meters can begin right away, and
+        start sampling.
+        """
+        for source in self.sources:
+            if hasattr(source, "open"):
+                source.open()
+        self.sample()
+        threading.Thread.start(self)
+
+    def run(self):
+        """Sample the sources until shutdown() is called.
+        """
+        wheel = TimerWheel(self.seconds_per_tick)
+        for i, period in enumerate(self.periods):
+            wheel.schedule(i, period)
+
+        next_time = time.monotonic()
+        while True:
+            # Samples are taken on a fixed schedule, so the time spent reading the sources
+            # does not make the sampling period drift.
+            next_time += self.seconds_per_tick
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+            if self.stop_event.wait(delay):
+                break
+            due = wheel.advance()
+            if due:
+                self.sample(due)
+
+    def shutdown(self):
+        """Stop sampling, wait for the thread to finish and close the sources.
+        """
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        for source in self.sources:
+            if hasattr(source, "close"):
+                source.close()
+
+    def sample(self, due=None):
+        """Read the sources and append their counters to the buffers.
+        :param due: the indices of the sources to read, the counters of the rest are
+            interpolated once they are read again. Defaults to all the sources.
+        """
+        # Samples may also be taken from other threads by wait_for(), so sources are read
+        # by one thread at a time and samples are appended in order.
+        with self.sample_lock:
+            timestamp = time.time()
+            row = np.empty(self.source_columns[-1].stop if self.sources else 0)
+            missing = set()
+            for i, source in enumerate(self.sources):
+                if due is None or i in due or self.readings[i] is None:
+                    values = np.asarray(source.read(timestamp), dtype=float)
+                    if self.readings[i] is not None:
+                        self.interpolate_pending(i, self.readings[i], (timestamp, values))
+                    self.readings[i] = (timestamp, values)
+                    row[self.source_columns[i]] = values
+                else:
+                    missing.add(i)
+            self.pending.append((timestamp, row, missing))
+
+            # Samples are complete in order, as sources are read at increasing times.
+            complete = 0
+            while complete < len(self.pending) and not self.pending[complete][2]:
+                complete += 1
+            for timestamp, row, _ in self.pending[:complete]:
+                self.append(timestamp, row)
+            del self.pending[:complete]
+
+    def interpolate_pending(self, i, previous, reading):
+        """Fill the columns of a source in the pending samples taken between two of its
+        readings.
+        :param i: the index of the source.
+        :param previous: the timestamp and values of the previous reading.
+        :param reading: the timestamp and values of the new reading.
+        """
+        (t0, v0), (t1, v1) = previous, reading
+        for timestamp, row, missing in self.pending:
+            if i in missing:
+                w = (timestamp - t0) / (t1 - t0) if t1 > t0 else 1.0
+                row[self.source_columns[i]] = v0 + w * (v1 - v0)
+                missing.discard(i)
+
+    def append(self, timestamp, row):
+        """Append a sample to the buffers.
+        :param timestamp: the time at which the sample was taken.
+        :param row: the cumulative value of each column.
+        """
+        with self.condition:
+            self.buffer.append(timestamp, row)
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener(timestamp, row)
+
+    def add_listener(self, listener):
+        """Call a function with every new sample. Listeners are called in the sampling
+        thread, so they must return quickly, e.g. by queueing the sample.
+        :param listener: a function called with the timestamp and the counters of the sample.
+        """
+        # The list is replaced rather than modified, so append iterates it without the lock.
+        with self.condition:
+            self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener):
+        """Stop calling a function added with add_listener.
+        :param listener: the function. Bound methods are compared by equality, as each
+            access to a method creates a new bound method object.
+        """
+        with self.condition:
+            self.listeners = [l for l in self.listeners if l != listener]
+
+    def column_names(self):
+        """Get a name for each column, the component name followed by the index of the
+        column within the component when it has several columns (e.g. cpu:0, cpu:1).
+        :returns: a list of strings.
+        """
+        names = [None] * sum(len(columns) for columns in self.layout.values())
+        for name, columns in self.layout.items():
+            for i, column in enumerate(columns):
+                names[column] = name if len(columns) == 1 else "{}:{}".format(name, i)
+        return names
+
+    def wait_for(self, timestamp):
+        """Wait until there is a sample taken at or after timestamp, i.e. until every source
+        has been read at or after timestamp. If the sampler is not running, a sample of all
+        the sources is taken right away.
+        :param timestamp: the time that must be covered by the samples.
+        """
+        with self.condition:
+            while self.is_alive() and self.last_timestamp() < timestamp:
+                self.condition.wait(self.seconds_between_samples)
+        if self.last_timestamp() < timestamp:
+            self.sample()
+
+    def last_timestamp(self):
+        """Get the time of the latest sample.
+        :returns: the timestamp of the latest sample or -inf if there are no samples yet.
+        """
+        return self.buffer.last_timestamp()
+
+    def counters_at(self, timestamp):
+        """Get the cumulative counters at timestamp, interpolating linearly between the two
+        closest samples.
+        :param timestamp: the time at which the counters are required.
+        :returns: an array with the value of each column.
+        """
+        with self.condition:
+            return self.buffer.counters_at(timestamp)
+
+    def energy_between(self, start_time, end_time):
+        """Get the increase of every counter between start_time and end_time.
+        :param start_time: the beginning of the interval.
+        :param end_time: the end of the interval.
+        :returns: a dictionary with an array per component with the increase of each of its
+            columns.
+        """
+        delta = self.counters_at(end_time) - self.counters_at(start_time)
+        return {name: delta[columns] for name, columns in self.layout.items()}
+
+    def attributed_between(self, start_time, end_time):
+        """Get the CPU and DRAM energy used by the process tree sampled by a
+        ProcessShareSource between two instants. The energy of each package between two
+        samples is scaled by the share of the host's busy CPU time (for CPU) or resident
+        memory (for DRAM) of the tree.
+        :param start_time: the beginning of the interval.
+        :param end_time: the end of the interval.
+        :returns: a dictionary with an array for cpu and dram with the energy of each column.
+        """
+        if "proc_cpu" not in self.layout:
+            raise Exception("The sampler has no ProcessShareSource, create it with "
+                            "default_sources(process_share=True).")
+        with self.condition:
+            timestamps, counters = self.buffer.get(start_time, end_time)
+        attributed = {}
+        for name, tree, host in (("cpu", "proc_cpu", "host_cpu"), ("dram", "proc_rss", "host_rss")):
+            if name in self.layout:
+                attributed[name] = attributed_between(
+                    timestamps, counters, start_time, end_time, self.layout[name],
+                    self.layout[tree][0], self.layout[host][0])
+        return attributed
+
+    def energy_per_interval(self, starts, ends, weights=None):
+        """Split the increase of every counter across overlapping intervals, e.g. the
+        requests batched together by an inference server, see attribution.apportion.
+        :param starts: the start time of each interval.
+        :param ends: the end time of each interval.
+        :param weights: the weight of each interval, e.g. the tokens it processed. Defaults to
+            sharing the energy equally among the intervals active at each moment.
+        :returns: a dictionary with an array per component with a row per interval and the
+            share of the increase of each of its columns.
+        """
+        starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+        covering = (starts.min(), ends.max()) if len(starts) else (None, None)
+        with self.condition:
+            timestamps, counters = self.buffer.get(*covering)
+        shares = apportion(timestamps, counters, starts, ends, weights)
+        return {name: shares[:, columns] for name, columns in self.layout.items()}
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """Get the process-wide sampler, starting it if it is not running. As it runs for the
+    whole lifetime of the process, its samples are kept in a TieredBuffer.
+    :returns: the EnergySampler shared by all SharedEnergyMeters.
+    """
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = EnergySampler(buffer_cls=TieredBuffer)
+            _sampler.start()
+        return _sampler
+
+
+class SharedEnergyMeter(MeterContext):
+    """A meter that only records the times at which it begins and ends. Its energy is
+    obtained from the counters stored by the process-wide EnergySampler, so begin() and end()
+    take microseconds and any number of meters can run concurrently, overlapped or nested.
+    Components are estimated as in EnergyMeter, except for disk, for which the bytes read
+    and written by this process are used, or the busy time of each disk with
+    disk_backend="diskstats".
+    """
+
+    def __init__(self, disk_avg_speed=None, disk_active_power=None, disk_idle_power=None,
+                 label=None, include_idle=False, ignore_disk=False, sampler=None,
+                 disk_backend="io", disk_power=None, disk_read_speed=None,
+                 disk_write_speed=None, disk_device=None):
+        """Init the meter, see EnergyMeter for the description of the parameters.
+        :param sampler: the EnergySampler used by the meter. Defaults to the process-wide
+            sampler, which is started the first time a meter begins.
+        :param disk_backend: "io" (default) to estimate the disk's active time from the bytes
+            read and written by this process, or "diskstats" to use the busy time of each disk.
+        """
+        if label:
+            self.label = label
+        else:
+            self.label = "Meter"
+
+        self.include_idle = include_idle
+
+        # Setup disk parameters.
+        self.ignore_disk = ignore_disk
+        if disk_backend not in ("io", "diskstats"):
+            raise Exception("disk_backend must be either io or diskstats.")
+        if ignore_disk == False:
+            if disk_backend != "diskstats":
+                (disk_read_speed, disk_write_speed, disk_active_power,
+                 disk_idle_power) = load_disk_parameters(disk_device, disk_avg_speed,
+                                                         disk_read_speed, disk_write_speed,
+                                                         disk_active_power, disk_idle_power)
+            check_disk_parameters(disk_backend, disk_avg_speed, disk_active_power,
+                                  disk_idle_power, disk_power, disk_read_speed,
+                                  disk_write_speed)
+        self.disk_backend = disk_backend
+        self.disk_avg_speed = disk_avg_speed
+        self.disk_read_speed = disk_read_speed
+        self.disk_write_speed = disk_write_speed
+        self.disk_active_power = disk_active_power
+        self.disk_idle_power = disk_idle_power
+        self.disk_power = disk_power
+
+        self.sampler = sampler
+        self.energy = None
+
+    def begin(self):
+        """Begin measuring the energy consumption.
+        """
+        if self.sampler is None:
+            self.sampler = get_sampler()
+        self.energy = None
+        self.start_time = time.time()
+
+    def end(self):
+        """Finish the measurement. Results are computed when they are first requested.
+        """
+        self.end_time = time.time()
+        self.duration = self.end_time - self.start_time
+
+    def get_energy(self):
+        """Get the increase of the sampler's counters between begin() and end(), waiting for
+        the sampler to cover end() if necessary.
+        :returns: a dictionary with an array per component.
+        """
+        if self.energy is None:
+            self.sampler.wait_for(self.end_time)
+            self.energy = self.sampler.energy_between(self.start_time, self.end_time)
+        return self.energy
+
+    def get_total_joules_disk(self):
+        """Estimate the disk's energy consumption from the bytes read and written by this
+        process, or from the busy time of each disk, see EnergyMeter.get_total_joules_disk.
+        :returns: the total joules used by the disk between meter.begin() and meter.end().
+        """
+        if self.ignore_disk:
+            return 0
+        if self.disk_backend == "diskstats":
+            return sum(self.get_joules_per_disk().values())
+
+        energy = self.get_energy()
+        if "rbytes" not in energy:
+            return 0
+
+        read_bytes = float(np.sum(energy["rbytes"]))
+        tot_bytes = read_bytes + float(np.sum(energy["wbytes"]))
+        return disk_joules(tot_bytes, self.duration, self.disk_avg_speed, self.disk_active_power,
+                           self.disk_idle_power, self.include_idle, read_bytes,
+                           self.disk_read_speed, self.disk_write_speed)
+
+    def get_joules_per_disk(self):
+        """Estimate the energy consumption of each disk from the time it was busy. This is
+        only available with the diskstats backend.
+        :returns: a dictionary with the joules used by each disk between meter.begin() and
+            meter.end().
+        """
+        if self.ignore_disk or self.disk_backend != "diskstats":
+            return {}
+        energy = self.get_energy()
+        devices = [name[len("disk_busy:"):] for name in energy if name.startswith("disk_busy:")]
+        busy = [float(energy["disk_busy:" + d][0]) for d in devices]
+        return diskstats_joules(busy, devices, self.duration, self.disk_active_power,
+                                self.disk_idle_power, self.disk_power, self.include_idle)
+
+    def get_total_joules_cpu(self):
+        """Get the joules consumed by the CPU.
+        :returns: the total joules used by each CPU package between meter.begin() and meter.end().
+        """
+        energy = self.get_energy()
+        if "cpu" in energy:
+            return energy["cpu"]
+        else:
+            print("RAPL did not record energy for pkg!")
+            return np.array([0])
+
+    def get_total_joules_dram(self):
+        """Get the joules consumed by the DRAM.
+        :returns: the total joules used by each DRAM domain between meter.begin() and meter.end().
+        """
+        energy = self.get_energy()
+        if "dram" in energy:
+            return energy["dram"]
+        else:
+            print("RAPL did not record energy for dram!")
+            return np.array([0])
+
+    def get_attributed_joules_per_component(self):
+        """Get the CPU and DRAM energy attributed to this process and its descendants, next
+        to the total energy of the host. This requires a sampler with a ProcessShareSource,
+        see EnergySampler.attributed_between.
+        :returns: a dictionary with a dictionary for cpu and dram with the attributed and
+            total joules of each package.
+        """
+        self.sampler.wait_for(self.end_time)
+        attributed = self.sampler.attributed_between(self.start_time, self.end_time)
+        return {
+            "cpu": {"attributed": attributed.get("cpu", np.array([0])),
+                    "total": self.get_total_joules_cpu()},
+            "dram": {"attributed": attributed.get("dram", np.array([0])),
+                     "total": self.get_total_joules_dram()},
+        }
+
+    def get_total_joules_gpu(self):
+        """Get the joules consumed by the GPUs. If include_idle is False, only the energy
+        integrated while the GPUs were in use is counted.
+        :returns: the total joules used by the GPUs between meter.begin() and meter.end().
+        """
+        energy = self.get_energy()
+        if self.include_idle:
+            return float(np.sum(energy.get("gpu", 0)))
+        return float(np.sum(energy.get("gpu_active", 0)))
+
+    def get_joules_per_gpu(self):
+        """Get the joules consumed by each GPU, see get_total_joules_gpu.
+        :returns: a dictionary with the joules used by each GPU between meter.begin() and
+            meter.end(), e.g. {"gpu0": 120.5, "gpu1": 0.0}.
+        """
+        energy = self.get_energy().get("gpu" if self.include_idle else "gpu_active", [])
+        return {"gpu{}".format(i): float(joules) for i, joules in enumerate(energy)}
+
+    def get_total_joules_per_component(self):
+        """This returns the total energy consumption in joules between meter.begin() and
+        meter.end() segregated by component (CPU, DRAM, GPU and disk), followed by the
+        energy of any other component recorded by the sampler, e.g. node for the sources of
+        plugins.
+        :returns: a dictionary with the total joules used by each component.
+        """
+        totals = {
+            "cpu": self.get_total_joules_cpu(),
+            "dram": self.get_total_joules_dram(),
+            "gpu": self.get_total_joules_gpu(),
+            "disk": self.get_total_joules_disk(),
+        }
+        energy = self.get_energy()
+        for name in energy_components(self.sampler.layout):
+            if name not in totals:
+                totals[name] = energy[name]
+        return totals
+
+    def plot_total_joules_per_component(self, include_total=True, path=None):
+        """Plot the total joules of each component, see
+        EnergyMeter.plot_total_joules_per_component.
+        :param include_total: if a bar with the total of all components is added.
+        :param path: the file where the figure is saved.
+        :returns: the matplotlib Figure.
+        """
+        from .plotting import plot_totals
+
+        return plot_totals(self.get_total_joules_per_component(), path, self.label,
+                           include_total)
+
+    def plot_power_timeline(self, path=None, margin=0.0, **options):
+        """Plot the power of each component recorded by the sampler while the meter was
+        running, with the interval of the meter overlaid.
+        :param path: the file where the figure is saved, e.g. power.png.
+        :param margin: the seconds plotted before begin() and after end().
+        :param options: see plotting.plot_power_timeline.
+        :returns: the matplotlib Figure.
+        """
+        from .plotting import plot_sampler
+
+        self.sampler.wait_for(self.end_time + margin)
+        return plot_sampler(self.sampler, path, self.start_time - margin,
+                            self.end_time + margin, [self], title=self.label, **options)
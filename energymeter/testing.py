@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+This module implements stand-ins for the hardware interfaces used by EnergyMeter, so that
+meters can be tested and benchmarked on machines without the hardware.
+"""
+import os
+import sys
+import time
+
+
+class FakeGpu:
+    """The state of a fake GPU.
+    """
+
+    def __init__(self, power=100.0, utilization=50, processes=None, energy_supported=True,
+                 process_utilization_supported=True):
+        """Init the fake GPU.
+        :param power: the constant power draw of the GPU in Watts.
+        :param utilization: the utilization of the GPU in %.
+        :param processes: a dictionary with the SM utilization in % of each pid using the GPU.
+        :param energy_supported: if the GPU has a total energy counter.
+        :param process_utilization_supported: if the GPU reports per-process utilization.
+        """
+        self.power = power
+        self.utilization = utilization
+        self.processes = processes or {}
+        self.energy_supported = energy_supported
+        self.process_utilization_supported = process_utilization_supported
+        self.start_time = time.time()
+
+
+class FakeNvmlError(Exception):
+    def __init__(self, value):
+        Exception.__init__(self, value)
+        self.value = value
+
+
+class FakeUtilization:
+    def __init__(self, gpu, memory=0):
+        self.gpu = gpu
+        self.memory = memory
+
+
+class FakeProcessSample:
+    def __init__(self, pid, timeStamp, smUtil):
+        self.pid = pid
+        self.timeStamp = timeStamp
+        self.smUtil = smUtil
+        self.memUtil = 0
+        self.encUtil = 0
+        self.decUtil = 0
+
+
+class FakeNvml:
+    """Implements the subset of the pynvml API used by NvmlReader over a list of FakeGpus.
+    Energy counters grow with the power of each GPU since it was created.
+    """
+
+    NVMLError = FakeNvmlError
+    NVML_ERROR_NOT_SUPPORTED = 3
+    NVML_ERROR_NOT_FOUND = 6
+
+    def __init__(self, gpus=None):
+        """Init the fake NVML.
+        :param gpus: the list of FakeGpus. Defaults to a GPU used by the current process.
+        """
+        self.gpus = gpus if gpus is not None else [FakeGpu(processes={os.getpid(): 50})]
+        self.initialized = 0
+        self.calls = 0
+
+    def nvmlInit(self):
+        self.initialized += 1
+
+    def nvmlShutdown(self):
+        self.initialized -= 1
+
+    def nvmlDeviceGetCount(self):
+        return len(self.gpus)
+
+    def nvmlDeviceGetHandleByIndex(self, i):
+        return self.gpus[i]
+
+    def nvmlDeviceGetPowerUsage(self, gpu):
+        self.calls += 1
+        return int(gpu.power * 1e3)
+
+    def nvmlDeviceGetUtilizationRates(self, gpu):
+        self.calls += 1
+        return FakeUtilization(gpu.utilization)
+
+    def nvmlDeviceGetTotalEnergyConsumption(self, gpu):
+        self.calls += 1
+        if not gpu.energy_supported:
+            raise FakeNvmlError(FakeNvml.NVML_ERROR_NOT_SUPPORTED)
+        return int(gpu.power * (time.time() - gpu.start_time) * 1e3)
+
+    def nvmlDeviceGetProcessUtilization(self, gpu, timeStamp):
+        self.calls += 1
+        if not gpu.process_utilization_supported:
+            raise FakeNvmlError(FakeNvml.NVML_ERROR_NOT_SUPPORTED)
+        if not gpu.processes:
+            raise FakeNvmlError(FakeNvml.NVML_ERROR_NOT_FOUND)
+        now = int(time.time() * 1e6)
+        return [FakeProcessSample(pid, now, util) for pid, util in gpu.processes.items()]
+
+
+def write_fake_files(root, files):
+    """Write the files of a fake filesystem tree, e.g. of /proc or /sys, creating the
+    directories that do not exist.
+    :param root: the directory where the tree is written.
+    :param files: a dictionary mapping the path of each file, relative to root, to its
+        content. Directories mapped to None are created empty.
+    :returns: root.
+    """
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        if content is None:
+            os.makedirs(path, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+    return root
+
+
+def write_fake_powercap(root, packages=1, energy_uj=0, max_energy_range_uj=262143328850,
+                        domains=None):
+    """Write a fake powercap tree in the format of /sys/class/powercap, see RaplReader.
+    :param root: the directory where the tree is written.
+    :param packages: the number of sockets.
+    :param energy_uj: the initial value of every energy counter.
+    :param max_energy_range_uj: the value at which the counters wrap around.
+    :param domains: a dictionary mapping the directory of each domain, e.g. intel-rapl:0:1,
+        to its name or to a tuple (name, initial energy_uj). Defaults to a package and a dram
+        domain per socket.
+    :returns: root.
+    """
+    if domains is None:
+        domains = {}
+        for socket in range(packages):
+            domains["intel-rapl:{}".format(socket)] = "package-{}".format(socket)
+            domains["intel-rapl:{}:0".format(socket)] = "dram"
+    # The control type directory has no energy counter.
+    files = {"intel-rapl": None}
+    for entry, name in domains.items():
+        name, energy = name if isinstance(name, tuple) else (name, energy_uj)
+        for filename, value in (("name", name), ("energy_uj", energy),
+                                ("max_energy_range_uj", max_energy_range_uj)):
+            files[os.path.join(entry, filename)] = "{}\n".format(value)
+    return write_fake_files(root, files)
+
+
+def set_fake_energy(root, entry, energy_uj):
+    """Change the value of an energy counter of a fake powercap tree. The file is overwritten
+    in place with a fixed width, so that readers never see it empty or truncated.
+    :param root: the directory of the tree, see write_fake_powercap.
+    :param entry: the directory of the domain, e.g. intel-rapl:0.
+    :param energy_uj: the new value of the counter.
+    """
+    fd = os.open(os.path.join(root, entry, "energy_uj"), os.O_WRONLY)
+    try:
+        os.write(fd, "{:<20}\n".format(energy_uj).encode())
+    finally:
+        os.close(fd)
+
+
+def write_fake_diskstats(path, devices=("sda", "nvme0n1")):
+    """Write a fake statistics file in the format of /proc/diskstats, see DiskStatsReader.
+    :param path: the file where the statistics are written.
+    :param devices: the names of the whole disks in the file.
+    :returns: path.
+    """
+    write_fake_files(os.path.dirname(os.path.abspath(path)), {os.path.basename(path): "".join(
+        "   8 {:>7} {} 100 0 800 20 30 0 240 40 0 60 60 0 0 0 0\n".format(minor * 16, device)
+        for minor, device in enumerate(devices))})
+    return path
+
+
+def fake_bpftrace_command(interval_ms=100, pid=None, threads=1, rbytes=4096, wbytes=4096):
+    """Get a command that prints the output of BpftraceSession.SCRIPT as bpftrace would,
+    so a BpftraceSession can be run without sudo or bpftrace.
+    :param interval_ms: the interval at which the maps are printed.
+    :param pid: the process that reads and writes. Defaults to the current process.
+    :param threads: the number of threads of the process that read and write.
+    :param rbytes: the bytes read by each thread in each interval.
+    :param wbytes: the bytes written by each thread in each interval.
+    :returns: the command as a list of arguments.
+    """
+    pid = os.getpid() if pid is None else pid
+    script = (
+        "import json, sys, time\n"
+        "pid, threads, interval, rbytes, wbytes = map(int, sys.argv[1:])\n"
+        "keys = ['{},{}'.format(pid, pid + i) for i in range(threads)]\n"
+        "print(json.dumps({'type': 'attached_probes', 'data': {'probes': 3}}), flush=True)\n"
+        "while True:\n"
+        "    time.sleep(interval / 1000)\n"
+        "    print(json.dumps({'type': 'map', 'data': {'@forks': {}}}), flush=True)\n"
+        "    for name, value in (('@rbytes', rbytes), ('@wbytes', wbytes)):\n"
+        "        data = {name: {k: value for k in keys}}\n"
+        "        print(json.dumps({'type': 'map', 'data': data}), flush=True)\n"
+    )
+    return [sys.executable, "-c", script, str(pid), str(threads), str(interval_ms),
+            str(rbytes), str(wbytes)]
+
+
+def write_fake_proc(root, processes, busy_ticks, idle_ticks=0, used_pages=None):
+    """Write a fake procfs with the stat and children files of some processes and the stat
+    and meminfo files of the host, see ProcessShareReader.
+    :param root: the directory where the files are written.
+    :param processes: a dictionary mapping each pid to a tuple with the pid of its parent,
+        its CPU time in clock ticks and its resident set size in pages.
+    :param busy_ticks: the busy CPU time of the host in clock ticks.
+    :param idle_ticks: the idle CPU time of the host in clock ticks.
+    :param used_pages: the memory in use in the host, in pages. Defaults to the resident set
+        size of all the processes.
+    :returns: root.
+    """
+    children = {}
+    for pid, (ppid, _, _) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+    files = {}
+    for pid, (ppid, ticks, rss) in processes.items():
+        # The command name may contain spaces and parentheses.
+        files["{}/stat".format(pid)] = (
+            "{} (fake (worker) {}) S {} {} {} 0 -1 4194304 10 0 0 0 {} 0 0 0 20 0 1 0 "
+            "100 1000000 {} 18446744073709551615\n".format(pid, pid, ppid, pid, pid, ticks, rss))
+        files["{}/task/{}/children".format(pid, pid)] = "".join(
+            "{} ".format(child) for child in children.get(pid, []))
+    files["stat"] = "cpu  {} 0 0 {} 0 0 0 0 0 0\n".format(busy_ticks, idle_ticks)
+    if used_pages is None:
+        used_pages = sum(rss for _, _, rss in processes.values())
+    total_kb = 16 * 1024 * 1024
+    files["meminfo"] = ("MemTotal:       {} kB\nMemFree:        0 kB\n"
+                        "MemAvailable:   {} kB\n".format(
+                            total_kb, total_kb - used_pages * os.sysconf("SC_PAGE_SIZE") // 1024))
+    return write_fake_files(root, files)
+
+
+class FakeLoadSource:
+    """A sampler source with cumulative counters that grow at a constant idle power, plus the
+    joules added with consume(), e.g. by the functions under test. This makes energy
+    measurements deterministic on machines without RAPL or GPUs.
+    """
+
+    def __init__(self, columns=("cpu",), idle_watts=(10.0,)):
+        """Init the counters at zero.
+        :param columns: the component name of each counter.
+        :param idle_watts: the power of each counter when nothing is consumed.
+        """
+        self.columns = list(columns)
+        self.idle_watts = [float(w) for w in idle_watts]
+        self.consumed = [0.0] * len(self.columns)
+        self.origin = time.time()
+
+    def consume(self, *joules):
+        """Add energy to the counters.
+        :param joules: the joules added to each counter.
+        """
+        self.consumed = [c + j for c, j in zip(self.consumed, joules)]
+
+    def read(self, timestamp):
+        """Read the counters.
+        :param timestamp: the time at which the counters are read.
+        :returns: a list with the cumulative joules of each counter.
+        """
+        elapsed = timestamp - self.origin
+        return [w * elapsed + c for w, c in zip(self.idle_watts, self.consumed)]
+
+
+class LinearSource:
+    """A sampler source whose counters grow at a constant rate per column, so the energy of
+    any interval is known exactly.
+    """
+
+    def __init__(self, columns, rates):
+        """Init the counters at zero.
+        :param columns: the component name of each counter.
+        :param rates: the increase per second of each counter.
+        """
+        self.columns = columns
+        self.rates = rates
+        self.origin = time.time()
+
+    def read(self, timestamp):
+        """Read the counters.
+        :param timestamp: the time at which the counters are read.
+        :returns: a list with the value of each counter.
+        """
+        return [r * (timestamp - self.origin) for r in self.rates]
+
+
+def make_sampler(columns=("cpu", "cpu", "dram", "gpu", "gpu_active", "rbytes", "wbytes"),
+                 rates=(10, 20, 3, 100, 50, 1e6, 2e6), seconds_between_samples=0.01):
+    """Create an EnergySampler (not started) with a single LinearSource.
+    :param columns: the component name of each counter, by default two CPU packages, DRAM,
+        a GPU and the disk counters.
+    :param rates: the increase per second of each counter.
+    :param seconds_between_samples: the sampling period.
+    :returns: the EnergySampler.
+    """
+    from .sampler import EnergySampler
+
+    source = LinearSource(list(columns), list(rates))
+    return EnergySampler(sources=[source], seconds_between_samples=seconds_between_samples)
+
+
+def write_fake_sysfs_block(root, path, device="nvme0n1", model="Fake SSD", serial="S123",
+                           partition=True):
+    """Write a fake sysfs tree in which a path is stored in a block device, see
+    calibration.device_for_path and calibration.device_identity.
+    :param root: the directory where the tree is written.
+    :param path: a file or directory, whose device numbers are mapped to the fake device.
+    :param device: the name of the whole device.
+    :param model: the model of the device.
+    :param serial: the serial number of the device.
+    :param partition: if the path is in a partition of the device.
+    :returns: root.
+    """
+    disk = os.path.join("devices", "pci0000:00", "block", device)
+    block = os.path.join(disk, device + "p1") if partition else disk
+    files = {block: None, "block": None, os.path.join("dev", "block"): None,
+             os.path.join(disk, "device", "model"): "{}\n".format(model),
+             os.path.join(disk, "device", "serial"): "{}\n".format(serial)}
+    if partition:
+        files[os.path.join(block, "partition")] = "1\n"
+    write_fake_files(root, files)
+    os.symlink(os.path.join(root, disk), os.path.join(root, "block", device))
+    dev = os.stat(path).st_dev
+    numbers = "{}:{}".format(os.major(dev), os.minor(dev))
+    os.symlink(os.path.join(root, block), os.path.join(root, "dev", "block", numbers))
+    return root
@@ -10,9 +10,12 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/maufadel/EnergyMeter",  # Optional: GitHub link
     packages=find_packages(),            # Automatically find packages in the project
+    entry_points={
+        "pytest11": ["energymeter = energymeter.pytest_plugin"],
+        "console_scripts": ["energymeter-calibrate-disk = energymeter.calibration:main"],
+    },
     install_requires=[
-        "pynvml",                         # Dependencies from PyPI
-        "pyRAPL",
+        "nvidia-ml-py",                   # Dependencies from PyPI
         "numpy",
         "pandas",
         "matplotlib"
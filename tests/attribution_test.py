@@ -0,0 +1,57 @@
+from energymeter.attribution import apportion
+from energymeter.sampler import EnergySampler
+from energymeter.testing import LinearSource
+import numpy as np
+import pytest
+
+
+def constant_power(watts, duration=100.0):
+    timestamps = np.arange(0.0, duration + 1)
+    return timestamps, np.column_stack([w * timestamps for w in watts])
+
+
+def test_overlapping_intervals_share_energy():
+    timestamps, counters = constant_power([10, 1])
+    # [0, 10) is only used by the first request, [10, 20) by both, [20, 30) by the second.
+    joules = apportion(timestamps, counters, [0, 10], [20, 30])
+    np.testing.assert_allclose(joules, [[150, 15], [150, 15]])
+    # Energy used while no request is active is not attributed.
+    joules = apportion(timestamps, counters, [0, 50], [10, 60])
+    np.testing.assert_allclose(joules[:, 0], [100, 100])
+
+
+def test_weights_split_batched_requests():
+    timestamps, counters = constant_power([10])
+    joules = apportion(timestamps, counters, [0, 0, 0, 5], [10, 10, 10, 5], [1, 3, 0, 7])
+    np.testing.assert_allclose(joules[:, 0], [25, 75, 0, 0])
+
+
+def test_energy_is_conserved_for_many_requests():
+    rng = np.random.default_rng(0)
+    timestamps, counters = constant_power([10, 2], duration=60.0)
+    starts = rng.uniform(0, 59, 50000)
+    ends = starts + rng.uniform(0, 1, 50000)
+    ends[0], starts[1] = 60, 0
+    weights = rng.integers(1, 500, 50000)
+
+    joules = apportion(timestamps, counters, starts, ends, weights)
+    np.testing.assert_allclose(joules.sum(axis=0), [600, 120])
+    assert np.all(joules >= 0)
+
+
+def test_invalid_intervals_raise():
+    timestamps, counters = constant_power([10])
+    with pytest.raises(Exception):
+        apportion(timestamps, counters, [5], [1])
+    with pytest.raises(Exception):
+        apportion(timestamps, counters, [0, 1], [2, 3], [1])
+
+
+def test_sampler_splits_its_components():
+    source = LinearSource(["cpu", "cpu", "gpu"], [1, 2, 10])
+    sampler = EnergySampler(sources=[source], seconds_between_samples=0.01)
+    for t in range(11):
+        sampler.append(float(t), [t, 2 * t, 10 * t])
+    energy = sampler.energy_per_interval([0, 0], [10, 10], [1, 4])
+    np.testing.assert_allclose(energy["cpu"], [[2, 4], [8, 16]])
+    np.testing.assert_allclose(energy["gpu"], [[20], [80]])
@@ -0,0 +1,113 @@
+from energymeter.backends import (PowerFileSource, TimerWheel, create_backend, create_sources,
+                                  register_backend, unregister_backend)
+from energymeter.sampler import EnergySampler, SharedEnergyMeter, default_sources
+from energymeter.testing import LinearSource, make_sampler
+import time
+import numpy as np
+import pytest
+
+
+def test_timer_wheel_polls_each_task_at_its_rate():
+    wheel = TimerWheel(0.01, slots=8)
+    wheel.schedule("fast", 0.01)
+    wheel.schedule("medium", 0.03)
+    wheel.schedule("slow", 0.2)
+    due = [wheel.advance() for _ in range(60)]
+    for task, period in (("fast", 1), ("medium", 3), ("slow", 20)):
+        ticks = [i + 1 for i, tasks in enumerate(due) if task in tasks]
+        assert ticks == list(range(period, 61, period))
+
+
+def test_registered_backends_are_created_by_name(tmp_path):
+    path = tmp_path / "power"
+    path.write_text("250000000\n")
+    register_backend("ipmi", lambda: PowerFileSource(str(path), scale=1e-6,
+                                                     seconds_between_samples=0.05))
+    try:
+        source = create_backend("ipmi")
+        assert source.columns == ["node"] and source.read(None) == [250.0]
+        # Backends that cannot be set up are skipped.
+        sources = create_sources(["ipmi", "missing"])
+        assert len(sources) == 1
+        assert isinstance(default_sources(backends=["ipmi"])[0], PowerFileSource)
+    finally:
+        unregister_backend("ipmi")
+    with pytest.raises(Exception):
+        create_backend("ipmi")
+
+
+def test_sources_are_polled_at_their_own_rate(tmp_path):
+    path = tmp_path / "power"
+    path.write_text("100\n")
+
+    class CountingSource(LinearSource):
+        seconds_between_samples = 0.05
+        readings = []
+
+        def read(self, timestamp):
+            values = LinearSource.read(self, timestamp)
+            CountingSource.readings.append(values[0])
+            return values
+
+    fast = LinearSource(["cpu"], [10])
+    slow = CountingSource(["gpu"], [100])
+    power = PowerFileSource(str(path), seconds_between_samples=0.02)
+    sampler = EnergySampler(sources=[fast, slow, power], seconds_between_samples=0.01)
+    sampler.start()
+    time.sleep(0.5)
+    sampler.shutdown()
+
+    timestamps, counters = sampler.buffer.get()
+    assert len(timestamps) > 30
+    # The slow source was read about every 5 samples, and interpolated in between.
+    assert len(CountingSource.readings) < len(timestamps) / 3
+    np.testing.assert_allclose(counters[:, 1], 100 * (timestamps - slow.origin))
+    assert np.all(np.diff(counters, axis=0) >= 0)
+    energy = sampler.energy_between(timestamps[10], timestamps[-1])
+    duration = timestamps[-1] - timestamps[10]
+    assert energy["cpu"][0] == pytest.approx(10 * duration, rel=0.01)
+    assert energy["gpu"][0] == pytest.approx(100 * duration, rel=0.01)
+    # The power read from the file is integrated.
+    assert energy["node"][0] == pytest.approx(100 * duration, rel=0.01)
+
+
+def test_meters_shorter_than_the_period_of_a_source(tmp_path):
+    path = tmp_path / "power"
+    path.write_text("100\n")
+    power = PowerFileSource(str(path), seconds_between_samples=1.0)
+    sampler = EnergySampler(sources=[LinearSource(["cpu"], [10]), power],
+                            seconds_between_samples=0.05)
+    sampler.start()
+    try:
+        time.sleep(0.3)
+        meter = SharedEnergyMeter(ignore_disk=True, sampler=sampler)
+        meter.begin()
+        time.sleep(0.2)
+        meter.end()
+        joules = meter.get_total_joules_per_component()
+        # The meter waited for the next reading of the slow source.
+        assert sampler.readings[1][0] >= meter.end_time
+        np.testing.assert_allclose(joules["node"], [100 * meter.duration], rtol=0.01)
+        np.testing.assert_allclose(joules["cpu"], [10 * meter.duration], rtol=0.01)
+    finally:
+        sampler.shutdown()
+
+
+def test_components_of_plugins_are_reported():
+    sampler = make_sampler(["cpu", "node"], [10, 50])
+    sampler.start()
+    try:
+        meter = SharedEnergyMeter(ignore_disk=True, sampler=sampler)
+        meter.begin()
+        time.sleep(0.05)
+        meter.end()
+        joules = meter.get_total_joules_per_component()
+        assert list(joules) == ["cpu", "dram", "gpu", "disk", "node"]
+        np.testing.assert_allclose(joules["node"], [50 * meter.duration])
+
+        result = meter.measure(time.sleep, 0.01, min_runs=2, max_runs=2, min_run_seconds=0.02,
+                               baseline_seconds=0.05)
+        assert result["baseline_watts"]["node"] == pytest.approx(50)
+        assert result["joules_per_call"]["node"] == pytest.approx(0, abs=0.1)
+    finally:
+        sampler.shutdown()
@@ -0,0 +1,124 @@
+from energymeter.bpftrace import BpftraceSession, parse_bpftrace_line
+from energymeter.procfs import process_tree
+import os
+import sys
+import time
+import pytest
+
+# Output of BpftraceSession.SCRIPT recorded with bpftrace 0.20 -f json.
+RECORDED_OUTPUT = [
+    '{"type": "attached_probes", "data": {"probes": 3}}',
+    '{"type": "map", "data": {"@rbytes": {"1200,1200": 4096, "1200,1201": 1024, "77,77": 10}}}',
+    '{"type": "map", "data": {"@wbytes": {"1200,1200": 512}}}',
+    '{"type": "map", "data": {"@rbytes": {}}}',
+    '{"type": "map", "data": {"@wbytes": {"77,77": 2048}}}',
+]
+
+
+def test_parse_recorded_output():
+    assert parse_bpftrace_line(RECORDED_OUTPUT[0]) == ("attached_probes", 3)
+    assert parse_bpftrace_line(RECORDED_OUTPUT[1]) == (
+        "@rbytes", {(1200, 1200): 4096, (1200, 1201): 1024, (77, 77): 10})
+    assert parse_bpftrace_line(RECORDED_OUTPUT[3].encode()) == ("@rbytes", {})
+    assert parse_bpftrace_line("Attaching 3 probes...") is None
+    assert parse_bpftrace_line('{"type": "printf", "data": "hi"}') is None
+
+
+def test_bytes_are_attributed_by_pid_and_window():
+    session = BpftraceSession(interval_ms=100, command=["true"])
+    for line, timestamp in zip(RECORDED_OUTPUT, [0.0, 10.1, 10.1, 10.2, 10.2]):
+        session.feed(line, timestamp)
+    assert session.last_timestamp == 10.2
+
+    assert session.bytes_between(10.0, 10.2) == pytest.approx((5130, 2560))
+    assert session.bytes_between(10.0, 10.2, pids={1200}) == pytest.approx((5120, 512))
+    # Half of the first interval overlaps the window.
+    assert session.bytes_between(10.05, 10.1, pids={1200}) == pytest.approx((2560, 256))
+    assert session.bytes_between(11.0, 12.0) == (0, 0)
+
+
+def test_session_streams_output():
+    script = ("import sys, time\n"
+              "for line in sys.argv[1:]:\n"
+              "    print(line, flush=True)\n"
+              "    time.sleep(0.05)\n"
+              "time.sleep(10)\n")
+    session = BpftraceSession(interval_ms=50,
+                              command=[sys.executable, "-c", script] + RECORDED_OUTPUT)
+    start = time.time()
+    session.start()
+    assert session.attached.is_set()
+    session.wait_for(start)
+    assert session.last_timestamp >= start
+    # Let the rest of the output be received.
+    time.sleep(0.5)
+    session.stop()
+    assert not session.is_running()
+    rbytes, wbytes = session.bytes_between(start - 1, time.time(), pids={77})
+    assert (rbytes, wbytes) == pytest.approx((10, 2048))
+
+
+def test_process_tree_contains_children():
+    import subprocess
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+    try:
+        tree = process_tree()
+        assert os.getpid() in tree
+        assert child.pid in tree
+        assert 1 not in tree
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_meter_with_fake_bpftrace_and_powercap(tmp_path):
+    from energymeter.energy_meter import EnergyMeter
+    from energymeter.testing import FakeNvml, fake_bpftrace_command, write_fake_powercap
+
+    session = BpftraceSession(interval_ms=20,
+                              command=fake_bpftrace_command(interval_ms=20, rbytes=1000,
+                                                            wbytes=10))
+    session.start()
+    meter = EnergyMeter(disk_avg_speed=1e6, disk_active_power=6, disk_idle_power=1,
+                        rapl_root=write_fake_powercap(str(tmp_path), packages=2),
+                        nvml=FakeNvml([]), bpftrace_session=session)
+    meter.begin()
+    time.sleep(0.2)
+    meter.end()
+    session.stop()
+    assert meter.rapl.labels() == ["package-0", "package-0/dram", "package-1",
+                                   "package-1/dram"]
+    # ~10 intervals of the fake output.
+    assert 5000 <= meter.total_rbytes <= 15000
+    assert meter.total_rbytes == pytest.approx(100 * meter.total_wbytes, rel=0.05)
+
+
+def test_rows_are_dropped_unless_a_meter_needs_them():
+    session = BpftraceSession(interval_ms=100, command=["true"])
+    session.hold(50.0)
+    for i in range(1, 2000):
+        session.feed('{"type": "map", "data": {"@wbytes": {"1,1": 1, "1,2": 1}}}', i * 0.1)
+    # The threads of a process are added up, one row per interval.
+    timestamps, values = session.samples.get()
+    assert values[-1].tolist() == [1, 0, 2]
+    assert timestamps[0] > 50.0 - session.interval
+    assert session.bytes_between(50.0, 150.0) == pytest.approx((0, 2000))
+
+    session.release(50.0)
+    for i in range(2000, 2200):
+        session.feed('{"type": "map", "data": {"@wbytes": {"1,1": 1}}}', i * 0.1)
+    # Only RETENTION_SECONDS (plus the time since the last trim) are kept.
+    assert len(session.samples) <= (BpftraceSession.RETENTION_SECONDS
+                                    + BpftraceSession.TRIM_SECONDS) / session.interval
+
+
+def test_bytes_of_exited_children_are_counted():
+    session = BpftraceSession(interval_ms=100, command=["true"])
+    lines = ['{"type": "map", "data": {"@forks": {"1200,1300": 1}}}',
+             '{"type": "map", "data": {"@forks": {"1300,1301": 1, "77,78": 1}}}',
+             '{"type": "map", "data": {"@wbytes": {"1301,1301": 100, "78,78": 10}}}']
+    for line in lines:
+        session.feed(line, 10.1)
+    assert session.forked_from({1200}) == {1200, 1300, 1301}
+    pids = session.forked_from({1200})
+    assert session.bytes_between(10.0, 10.1, pids) == pytest.approx((0, 100))
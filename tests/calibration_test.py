@@ -0,0 +1,107 @@
+from energymeter.calibration import (calibrate, device_for_path, device_identity,
+                                     find_disk_profile, load_profiles, main, measure_throughput,
+                                     save_profile)
+from energymeter.energy_meter import disk_joules
+from energymeter.sampler import SharedEnergyMeter
+from energymeter.testing import write_fake_sysfs_block
+import os
+import pytest
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    data = tmp_path / "data"
+    data.mkdir()
+    sys_root = write_fake_sysfs_block(str(tmp_path / "sys"), str(data))
+    monkeypatch.setenv("ENERGYMETER_DISK_PROFILES", str(tmp_path / "profiles.json"))
+    return str(data), sys_root
+
+
+def test_device_of_a_path(disk):
+    data, sys_root = disk
+    assert device_for_path(data, sys_root) == "nvme0n1"
+    assert device_identity("nvme0n1", sys_root) == ("Fake SSD", "S123")
+    assert device_for_path(data, os.path.join(sys_root, "missing")) is None
+
+
+def test_throughput_is_measured_on_a_temporary_file(disk):
+    data, _ = disk
+    speeds = measure_throughput(data, size=4 * MB, seconds=1, block_size=MB, direct=False)
+    assert set(speeds) == {"read_speed", "write_speed", "random_read_speed",
+                           "random_write_speed"}
+    assert all(speed > 0 for speed in speeds.values())
+    # The temporary file is removed.
+    assert os.listdir(data) == []
+
+
+def test_direct_io():
+    try:
+        speeds = measure_throughput(".", size=4 * MB, seconds=1, block_size=MB)
+    except Exception as e:
+        pytest.skip(str(e))
+    assert speeds["read_speed"] > 0
+
+
+def test_profiles_are_cached_and_loaded_by_meters(disk, monkeypatch):
+    data, sys_root = disk
+    profile = calibrate(data, active_power=6, idle_power=1.5, sys_root=sys_root,
+                        size=4 * MB, seconds=1, direct=False)
+    assert (profile["device"], profile["model"], profile["serial"]) == ("nvme0n1", "Fake SSD",
+                                                                       "S123")
+    profile.update(read_speed=400e6, write_speed=100e6)
+    save_profile(profile)
+    assert list(load_profiles()) == ["Fake SSD:S123"]
+    assert find_disk_profile(data, sys_root=sys_root)["read_speed"] == 400e6
+    assert find_disk_profile("sda", sys_root=sys_root) is None
+
+    monkeypatch.setattr("energymeter.calibration.find_disk_profile",
+                        lambda device=None: profile if device == data else None)
+    meter = SharedEnergyMeter(disk_device=data)
+    assert (meter.disk_read_speed, meter.disk_write_speed) == (400e6, 100e6)
+    assert (meter.disk_active_power, meter.disk_idle_power) == (6, 1.5)
+    # Given parameters take precedence over the profile.
+    meter = SharedEnergyMeter(disk_device=data, disk_idle_power=1)
+    assert meter.disk_idle_power == 1
+    # Without a profile, the parameters are still required.
+    with pytest.raises(Exception, match="energymeter.calibration"):
+        SharedEnergyMeter(disk_device="sda")
+
+
+def test_profiles_are_found_once_per_device(disk, monkeypatch):
+    data, _ = disk
+    calls = []
+
+    def find(device=None):
+        calls.append(device)
+        return {"read_speed": 400e6, "write_speed": 100e6, "active_power": 6,
+                "idle_power": 1.5}
+
+    monkeypatch.setattr("energymeter.calibration.find_disk_profile", find)
+    for _ in range(3):
+        meter = SharedEnergyMeter(disk_device=data)
+        assert meter.disk_read_speed == 400e6
+    assert calls == [data]
+    # A new profile is found again.
+    save_profile({"model": "Fake SSD", "serial": "S123"})
+    SharedEnergyMeter(disk_device=data)
+    assert calls == [data, data]
+
+
+def test_reads_and_writes_use_their_own_speed():
+    # 400 MB read at 400 MB/s and 100 MB written at 100 MB/s keep the disk active 2 s.
+    joules = disk_joules(500e6, 10, None, 6, 1, read_bytes=400e6, read_speed=400e6,
+                         write_speed=100e6)
+    assert joules == pytest.approx(12)
+    assert disk_joules(500e6, 10, 250e6, 6, 1) == pytest.approx(12)
+
+
+def test_command(disk, capsys):
+    data, sys_root = disk
+    main(["--directory", data, "--size", str(4 * MB), "--seconds", "1", "--no-direct",
+          "--sys-root", sys_root, "--active-power", "6"])
+    assert "nvme0n1 (Fake SSD S123):" in capsys.readouterr().out
+    assert load_profiles()["Fake SSD:S123"]["active_power"] == 6
+    with pytest.raises(Exception, match="block device"):
+        main(["--directory", data, "--no-direct", "--sys-root", os.path.join(sys_root, "x")])
@@ -0,0 +1,61 @@
+from energymeter.context import get_current_meter, measure_energy
+from energymeter.energy_meter import EnergyMeter
+from energymeter.sampler import SharedEnergyMeter
+from energymeter.testing import FakeNvml, make_sampler
+import asyncio
+import time
+import numpy as np
+
+
+def test_meter_is_restartable_with_statement():
+    meter = EnergyMeter(ignore_disk=True, gpu_seconds_between_samples=0.01, nvml=FakeNvml())
+    for _ in range(2):
+        with meter as m:
+            assert m is meter and get_current_meter() is meter
+            time.sleep(0.05)
+        assert get_current_meter() is None
+        assert meter.get_total_joules_gpu() > 0
+
+
+def test_decorator_on_functions_and_coroutines():
+    sampler = make_sampler(["cpu"], [10])
+    sampler.start()
+    seen = []
+
+    @measure_energy(ignore_disk=True, sampler=sampler, callback=seen.append)
+    def work():
+        time.sleep(0.05)
+        return get_current_meter()
+
+    @measure_energy(ignore_disk=True, sampler=sampler)
+    async def async_work():
+        await asyncio.sleep(0.05)
+        return 1
+
+    meter = work()
+    assert seen == [meter] and meter.label.endswith("work")
+    assert asyncio.run(async_work()) == 1
+    assert async_work.last_meter.get_total_joules_cpu()[0] > 0
+    sampler.shutdown()
+
+
+def test_interleaved_tasks_get_their_own_window():
+    sampler = make_sampler(["cpu"], [10])
+    sampler.start()
+
+    async def task(delay):
+        async with SharedEnergyMeter(ignore_disk=True, sampler=sampler) as meter:
+            await asyncio.sleep(delay)
+            # Other tasks entered their meters meanwhile.
+            assert get_current_meter() is meter
+        return meter
+
+    async def main():
+        return await asyncio.gather(task(0.05), task(0.15))
+
+    short, long = asyncio.run(main())
+    assert get_current_meter() is None
+    np.testing.assert_allclose(short.get_total_joules_cpu(), 10 * short.duration, rtol=1e-6)
+    np.testing.assert_allclose(long.get_total_joules_cpu(), 10 * long.duration, rtol=1e-6)
+    assert long.duration > 2 * short.duration
+    sampler.shutdown()
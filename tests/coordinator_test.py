@@ -0,0 +1,71 @@
+from energymeter.coordinator import Coordinator, CoordinatedMeter
+from energymeter.sampler import EnergySampler, SharedEnergyMeter
+from energymeter.testing import LinearSource
+import multiprocessing
+import os
+import time
+import numpy as np
+
+
+def work(name, rank, seconds, results):
+    with CoordinatedMeter(name=name, rank=rank) as meter:
+        time.sleep(seconds)
+    energy = meter.get_energy()
+    results.put((rank, (energy["cpu"], sorted(energy))))
+
+
+def test_workers_share_the_node_energy():
+    name = "energymeter-test-{}".format(os.getpid())
+    # The coordinator's own bytes and CPU time are not split between the workers.
+    source = LinearSource(["cpu", "gpu", "gpu_active", "rbytes", "wbytes", "proc_cpu"],
+                          [10, 100, 50, 1e6, 1e6, 1])
+    sampler = EnergySampler(sources=[source], seconds_between_samples=0.01)
+    sampler.start()
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    with Coordinator(name, sampler=sampler) as coordinator:
+        workers = [context.Process(target=work, args=(name, rank, 0.3, results))
+                   for rank in range(3)]
+        for worker in workers:
+            worker.start()
+        shares = dict(results.get(timeout=10) for _ in workers)
+        for worker in workers:
+            worker.join()
+        report = coordinator.report()
+    sampler.shutdown()
+
+    assert sorted(report["workers"]) == ["rank0", "rank1", "rank2"]
+    for worker in report["workers"].values():
+        assert sorted(worker) == ["cpu", "gpu"]
+    assert sorted(report["node"]) == sorted(report["unattributed"]) == ["cpu", "gpu"]
+    for _, keys in shares.values():
+        assert keys == ["cpu", "gpu"]
+    node = report["node"]["cpu"][0]
+    workers = [report["workers"]["rank{}".format(i)]["cpu"][0] for i in range(3)]
+    # The energy is counted once: workers and the rest add up to the node.
+    assert np.isclose(sum(workers) + report["unattributed"]["cpu"][0], node)
+    assert report["unattributed"]["cpu"][0] >= -1e-9
+    # The workers overlapped most of the time, so each gets about a third.
+    assert sum(workers) > 0.8 * node
+    for rank, joules in enumerate(workers):
+        assert 0.2 * node < joules < 0.5 * node
+        assert np.isclose(shares[rank][0][0], joules, rtol=0.05)
+
+
+def test_sampler_keeps_running_after_close():
+    name = "energymeter-test-close-{}".format(os.getpid())
+    sampler = EnergySampler(sources=[LinearSource(["cpu"], [10])],
+                            seconds_between_samples=0.01)
+    sampler.start()
+    try:
+        Coordinator(name, sampler=sampler).close()
+        assert sampler.listeners == []
+        meter = SharedEnergyMeter(ignore_disk=True, sampler=sampler)
+        meter.begin()
+        time.sleep(0.05)
+        meter.end()
+        assert sampler.is_alive()
+        np.testing.assert_allclose(meter.get_total_joules_per_component()["cpu"],
+                                   [10 * meter.duration])
+    finally:
+        sampler.shutdown()
@@ -0,0 +1,65 @@
+from energymeter.diskstats import DiskStatsReader, diskstats_joules
+from energymeter.energy_meter import EnergyMeter
+from energymeter.testing import write_fake_files
+import time
+import numpy as np
+import pytest
+
+DISKSTATS = """\
+   7       0 loop0 10 0 80 1 0 0 0 0 0 4 1 0 0 0 0
+   8       0 sda {sda_reads} 0 {sda_sectors_read} 20 30 0 {sda_sectors_written} 40 0 {sda_ticks} 60 0 0 0 0
+   8       1 sda1 5 0 40 1 3 0 24 1 0 2 2 0 0 0 0
+ 259       0 nvme0n1 7 0 {nvme_sectors_read} 1 0 0 0 0 0 {nvme_ticks} 1 0 0 0 0
+"""
+
+
+def write_diskstats(path, sda_sectors_read=0, sda_sectors_written=0, sda_ticks=0,
+                    nvme_sectors_read=0, nvme_ticks=0):
+    with open(path, "w") as f:
+        f.write(DISKSTATS.format(sda_reads=1, sda_sectors_read=sda_sectors_read,
+                                 sda_sectors_written=sda_sectors_written, sda_ticks=sda_ticks,
+                                 nvme_sectors_read=nvme_sectors_read, nvme_ticks=nvme_ticks))
+
+
+def test_whole_disks_are_read(tmp_path):
+    path = str(tmp_path / "diskstats")
+    write_diskstats(path, sda_sectors_read=8, sda_sectors_written=16, sda_ticks=250,
+                    nvme_sectors_read=2, nvme_ticks=1000)
+    reader = DiskStatsReader(path)
+    assert reader.devices == ["sda", "nvme0n1"]
+    np.testing.assert_allclose(reader.read(), [[4096, 8192, 0.25], [1024, 0, 1.0]])
+    reader.close()
+
+
+def test_sys_block_directory(tmp_path):
+    write_fake_files(str(tmp_path), {
+        "sda/stat": "     100        0     2048       50      10        0      512       20"
+                    "        0      300      70        0        0        0        0\n"})
+    reader = DiskStatsReader(str(tmp_path))
+    np.testing.assert_allclose(reader.read(), [[2048 * 512, 512 * 512, 0.3]])
+    with pytest.raises(Exception):
+        DiskStatsReader(str(tmp_path), devices=["sdb"])
+
+
+def test_joules_use_per_device_power():
+    joules = diskstats_joules([0.5, 2.0], ["sda", "nvme0n1"], 1.0, 6, 1, {"sda": (4, 2)},
+                              include_idle=True)
+    # nvme0n1 was busy for longer than the duration, which is capped.
+    assert joules == pytest.approx({"sda": 0.5 * 4 + 0.5 * 2, "nvme0n1": 6.0})
+
+
+def test_meter_uses_busy_time(tmp_path):
+    path = str(tmp_path / "diskstats")
+    write_diskstats(path)
+    meter = EnergyMeter(disk_active_power=6, disk_idle_power=1.42, disk_backend="diskstats",
+                        diskstats_path=path)
+    meter.begin()
+    write_diskstats(path, sda_sectors_read=8, sda_ticks=10, nvme_ticks=5)
+    # Busy times are capped at the duration of the meter.
+    time.sleep(0.05)
+    meter.end()
+    assert meter.total_rbytes == 4096
+    assert meter.get_joules_per_disk() == pytest.approx({"sda": 0.06, "nvme0n1": 0.03})
+    assert meter.get_total_joules_disk() == pytest.approx(0.09)
+    with pytest.raises(Exception):
+        EnergyMeter(disk_backend="diskstats")
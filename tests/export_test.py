@@ -0,0 +1,86 @@
+from energymeter.context import measure_energy
+from energymeter.export import (IntervalWriter, SampleExporter, energy_per_interval,
+                                load_intervals, load_samples)
+from energymeter.sampler import EnergySampler
+from energymeter.testing import LinearSource, make_sampler
+import time
+import numpy as np
+import pytest
+
+# Two CPU packages and a GPU.
+COLUMNS, RATES = ["cpu", "cpu", "gpu"], [10, 20, 100]
+
+
+@pytest.mark.parametrize("filename", ["samples.bin", "samples.csv"])
+def test_samples_are_streamed_and_appended(tmp_path, filename):
+    path = str(tmp_path / filename)
+    sampler = make_sampler(COLUMNS, RATES)
+    with SampleExporter(path, sampler=sampler, flush_seconds=0.01):
+        for t in range(100):
+            sampler.append(float(t), [t, 2 * t, 10 * t])
+    sampler.append(100.0, [0, 0, 0])
+    # A new exporter appends to the same file.
+    with SampleExporter(path, sampler=sampler):
+        sampler.append(101.0, [101, 202, 1010])
+
+    timestamps, counters, columns = load_samples(path)
+    assert columns == ["cpu:0", "cpu:1", "gpu"]
+    np.testing.assert_allclose(timestamps, list(range(100)) + [101])
+    np.testing.assert_allclose(counters[-1], [101, 202, 1010])
+    df = load_samples(path, as_dataframe=True)
+    assert list(df.columns) == columns and df.index[-1] == 101
+
+
+def test_binary_files_are_memory_mapped(tmp_path):
+    path = str(tmp_path / "samples.bin")
+    sampler = make_sampler(COLUMNS, RATES)
+    with SampleExporter(path, sampler=sampler):
+        sampler.append(0.0, [0, 0, 0])
+    timestamps, _, _ = load_samples(path)
+    assert isinstance(timestamps.base, np.memmap)
+    # A row left incomplete by a crash is ignored and then overwritten.
+    with open(path, "ab") as f:
+        f.write(b"\0" * 12)
+    assert len(load_samples(path)[0]) == 1
+    with SampleExporter(path, sampler=sampler):
+        sampler.append(1.0, [1, 1, 1])
+    np.testing.assert_allclose(load_samples(path)[0], [0, 1])
+
+
+def test_close_removes_the_listener(tmp_path):
+    sampler = make_sampler(COLUMNS, RATES)
+    with SampleExporter(str(tmp_path / "samples.bin"), sampler=sampler):
+        assert len(sampler.listeners) == 1
+    assert sampler.listeners == []
+
+
+def test_columns_must_match(tmp_path):
+    path = str(tmp_path / "samples.bin")
+    SampleExporter(path, sampler=make_sampler(COLUMNS, RATES)).close()
+    other = EnergySampler(sources=[LinearSource(["cpu"], [1])])
+    with pytest.raises(Exception):
+        SampleExporter(path, sampler=other)
+
+
+def test_intervals_are_written_by_meters(tmp_path):
+    samples_path, intervals_path = str(tmp_path / "samples.bin"), str(tmp_path / "meters.csv")
+    sampler = make_sampler(COLUMNS, RATES)
+    sampler.start()
+    writer = IntervalWriter(intervals_path)
+
+    @measure_energy(ignore_disk=True, sampler=sampler, callback=writer, label="a, b")
+    def work():
+        time.sleep(0.03)
+
+    with SampleExporter(samples_path, sampler=sampler):
+        sampler.wait_for(time.time())
+        for _ in range(3):
+            work()
+        sampler.wait_for(sampler.last_timestamp() + 0.01)
+    sampler.shutdown()
+    writer.close()
+
+    labels, starts, ends = load_intervals(intervals_path)
+    assert labels == ["a, b"] * 3 and np.all(ends >= starts)
+    labels, joules = energy_per_interval(samples_path, intervals_path)
+    np.testing.assert_allclose(joules[:, 0], 10 * (ends - starts), rtol=1e-6)
@@ -0,0 +1,65 @@
+from energymeter.energy_meter import EnergyMeter, ThreadGpuSamplingPyNvml
+from energymeter.nvml import NvmlReader
+from energymeter.testing import FakeGpu, FakeNvml
+import os
+import time
+import numpy as np
+
+
+def test_sampler_keeps_its_rate():
+    nvml = FakeNvml()
+    thread = ThreadGpuSamplingPyNvml("GPU Sampling Thread", seconds_between_samples=0.02,
+                                     nvml=nvml)
+    thread.start()
+    time.sleep(0.2)
+    thread.stop()
+
+    timestamps, power_draw, activity, energy = thread.get_samples()
+    # ~10 scheduled samples plus the last one, instead of spinning on NVML.
+    assert 8 <= len(timestamps) <= 14
+    assert np.all(np.diff(timestamps) > 0)
+    assert np.all(power_draw == 100.0)
+    assert nvml.initialized == 0
+    overhead = thread.get_overhead()
+    assert overhead["samples"] == len(timestamps)
+    assert 0 <= overhead["cpu_fraction"] < 0.5
+
+
+def test_all_devices_are_read_in_one_pass():
+    nvml = FakeNvml([FakeGpu(power=100, processes={os.getpid(): 30}),
+                     FakeGpu(power=50, utilization=80, processes={1: 80}),
+                     FakeGpu(power=20, utilization=10, energy_supported=False,
+                             process_utilization_supported=False)])
+    reader = NvmlReader(nvml)
+    rows = reader.read()
+    assert reader.devices == ["gpu0", "gpu1", "gpu2"]
+    np.testing.assert_allclose(rows[:, :3], [[100, 50, 30], [50, 80, 0], [20, 10, 10]])
+    assert np.isnan(rows[2, 3]) and not np.isnan(rows[:2, 3]).any()
+    # Unsupported queries are not retried.
+    calls = nvml.calls
+    reader.read()
+    assert nvml.calls - calls == 3 * 4 - 2
+
+
+def test_gpu_joules_are_reported_per_device():
+    nvml = FakeNvml([FakeGpu(power=100, processes={os.getpid(): 30}),
+                     FakeGpu(power=50, processes={1: 80}),
+                     FakeGpu(power=20, energy_supported=False,
+                             process_utilization_supported=False)])
+    meter = EnergyMeter(ignore_disk=True, gpu_seconds_between_samples=0.01, nvml=nvml)
+    meter.begin()
+    time.sleep(0.1)
+    meter.end()
+
+    timestamps, _, _, _ = meter.thread_gpu.get_samples()
+    covered = timestamps[-1] - timestamps[0]
+    joules = meter.get_joules_per_gpu()
+    # gpu1 is only used by another process.
+    assert joules["gpu1"] == 0
+    assert np.isclose(joules["gpu0"], 100 * covered, rtol=0.05)
+    # gpu2 has no energy counter nor per-process utilization.
+    assert np.isclose(joules["gpu2"], 20 * covered)
+    assert np.isclose(meter.get_total_joules_gpu(), sum(joules.values()))
+
+    meter.include_idle = True
+    assert np.isclose(meter.get_joules_per_gpu()["gpu1"], 50 * covered, rtol=0.05)
@@ -0,0 +1,107 @@
+from energymeter.export import IntervalWriter, SampleExporter
+from energymeter.plotting import (component_power, decimate_counters, lttb, plot_power_timeline,
+                                  plot_samples_file, plot_totals)
+from energymeter.sampler import SharedEnergyMeter
+from energymeter.testing import make_sampler
+import subprocess
+import sys
+import time
+import numpy as np
+import pytest
+
+
+def test_lttb_keeps_the_shape_of_the_series():
+    x = np.arange(100000, dtype=float)
+    y = np.sin(x / 5000)
+    y[54321] = 10
+    selected = lttb(x, y, 500)
+    assert len(selected) == 500
+    assert selected[0] == 0 and selected[-1] == len(x) - 1
+    assert np.all(np.diff(selected) > 0)
+    # The spike is kept.
+    assert 54321 in selected
+    # Short series are not downsampled.
+    np.testing.assert_array_equal(lttb(x[:10], y[:10], 500), np.arange(10))
+    with pytest.raises(Exception):
+        lttb(x, y, 2)
+
+
+def test_millions_of_samples_are_plotted(tmp_path):
+    n = 2000000
+    timestamps = np.arange(n) * 0.01
+    counters = np.column_stack([np.cumsum(np.full(n, 0.5)), np.cumsum(np.full(n, 1.0)),
+                                np.cumsum(np.random.rand(n))])
+    fig = plot_power_timeline(timestamps, counters, ["cpu:0", "cpu:1", "gpu"],
+                              path=tmp_path / "power.png",
+                              intervals=[("request", 100.0, 200.0)])
+    assert (tmp_path / "power.png").stat().st_size > 0
+    lines = fig.axes[0].get_lines()
+    assert [line.get_label() for line in lines] == ["cpu", "gpu"]
+    assert len(lines[0].get_xdata()) == 2000
+    # Both packages are added up.
+    np.testing.assert_allclose(lines[0].get_ydata(), 150)
+    # The random power is averaged over buckets of 100 samples.
+    assert np.all(np.abs(lines[1].get_ydata() - 50) < 20)
+
+
+def test_decimated_counters_keep_the_energy():
+    timestamps = np.arange(1001) * 0.1
+    counters = np.cumsum(np.random.rand(1001, 2), axis=0)
+    kept_timestamps, kept = decimate_counters(timestamps, counters, 11)
+    np.testing.assert_allclose(kept_timestamps, np.arange(11) * 10)
+    np.testing.assert_array_equal(kept[[0, -1]], counters[[0, -1]])
+    middle, power = component_power(kept_timestamps, kept, {"cpu": [0, 1]})
+    assert np.sum(power["cpu"] * 10) == pytest.approx(counters[-1].sum() - counters[0].sum())
+    assert decimate_counters(timestamps, counters, 2000)[0] is timestamps
+
+
+def test_meter_timeline_and_totals(tmp_path):
+    sampler = make_sampler()
+    sampler.start()
+    exporter = SampleExporter(str(tmp_path / "samples.bin"), sampler=sampler)
+    exporter.start()
+    writer = IntervalWriter(str(tmp_path / "meters.csv"))
+    try:
+        meter = SharedEnergyMeter(label="inference", ignore_disk=True, sampler=sampler)
+        with meter:
+            time.sleep(0.2)
+        writer(meter)
+        fig = meter.plot_power_timeline(tmp_path / "meter.png")
+        power = {line.get_label(): line.get_ydata() for line in fig.axes[0].get_lines()}
+        assert set(power) == {"cpu", "dram", "gpu"}
+        np.testing.assert_allclose(power["cpu"], 30, rtol=1e-6)
+        np.testing.assert_allclose(power["gpu"], 100, rtol=1e-6)
+        assert fig.axes[0].get_title() == "inference"
+
+        fig = meter.plot_total_joules_per_component(path=tmp_path / "totals.png")
+        heights = [bar.get_height() for bar in fig.axes[0].patches]
+        assert heights[-1] == pytest.approx(sum(heights[:-1]))
+        assert (tmp_path / "totals.png").exists()
+    finally:
+        exporter.close()
+        writer.close()
+        sampler.shutdown()
+
+    fig = plot_samples_file(str(tmp_path / "samples.bin"), tmp_path / "file.png",
+                            intervals_path=str(tmp_path / "meters.csv"))
+    assert "gpu" in [line.get_label() for line in fig.axes[0].get_lines()]
+    assert fig.axes[0].texts[0].get_text() == "inference"
+
+
+def test_total_does_not_count_components_twice():
+    # The node is measured by a plugin and already includes the CPU and the GPU.
+    fig = plot_totals({"cpu": [1, 2], "gpu": 3, "node": 10})
+    assert [bar.get_height() for bar in fig.axes[0].patches] == [3, 3, 10, 6]
+    fig = plot_totals({"cpu": [1, 2], "gpu": 3, "node": 10}, components=["node"])
+    assert fig.axes[0].patches[-1].get_height() == 10
+
+
+def test_plotting_does_not_need_a_display(tmp_path):
+    code = ("import sys\n"
+            "from energymeter.plotting import plot_totals\n"
+            "plot_totals({'cpu': [1, 2], 'gpu': 3}, path=sys.argv[1])\n"
+            "print('matplotlib.pyplot' in sys.modules)")
+    output = subprocess.check_output([sys.executable, "-c", code, str(tmp_path / "t.png")],
+                                     env={"PATH": "", "MPLBACKEND": ""})
+    assert output.decode().strip() == "False"
+    assert (tmp_path / "t.png").exists()
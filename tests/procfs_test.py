@@ -0,0 +1,79 @@
+from energymeter.energy_meter import EnergyMeter
+from energymeter.procfs import ProcessShareReader, process_tree, read_process_stats
+from energymeter.sampler import EnergySampler, ProcessShareSource
+from energymeter.testing import (FakeNvml, LinearSource, set_fake_energy, write_fake_powercap,
+                                 write_fake_proc)
+import os
+import numpy as np
+import pytest
+
+# pid: (ppid, CPU ticks, resident pages). The tree of the current process has 3 processes.
+PID = os.getpid()
+PROCESSES = {1: (0, 500, 100), PID: (1, 100, 50), PID + 1: (PID, 50, 20),
+             PID + 2: (PID, 0, 10), PID + 3: (1, 300, 200)}
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def with_ticks(child_ticks, other_ticks):
+    processes = dict(PROCESSES)
+    processes[PID + 1] = (PID, child_ticks, 20)
+    processes[PID + 3] = (1, other_ticks, 200)
+    return processes
+
+
+def test_stats_of_all_processes_are_read_in_one_pass(tmp_path):
+    root = write_fake_proc(str(tmp_path), PROCESSES, busy_ticks=1000)
+    assert read_process_stats(root)[PID + 1] == (PID, 50, 20)
+    assert process_tree(PID, root) == {PID, PID + 1, PID + 2}
+
+    usage = ProcessShareReader(proc_root=root).read()
+    np.testing.assert_allclose(usage, [150 / CLOCK_TICKS, 1000 / CLOCK_TICKS, 80 * PAGE_SIZE,
+                                       380 * PAGE_SIZE])
+
+
+def test_only_the_tree_is_read(tmp_path):
+    root = write_fake_proc(str(tmp_path), PROCESSES, busy_ticks=1000, used_pages=1000)
+    # Processes outside the tree are not read.
+    os.remove(os.path.join(root, str(PID + 3), "stat"))
+    assert process_tree(PID, root) == {PID, PID + 1, PID + 2}
+    usage = ProcessShareReader(proc_root=root).read()
+    np.testing.assert_allclose(usage[2:], [80 * PAGE_SIZE, 1000 * PAGE_SIZE])
+    # Without children files, the parent of every process is read.
+    os.remove(os.path.join(root, str(PID), "task", str(PID), "children"))
+    assert process_tree(PID, root) == {PID, PID + 1, PID + 2}
+
+
+def test_meter_attributes_cpu_and_dram(tmp_path):
+    proc = write_fake_proc(str(tmp_path / "proc"), PROCESSES, busy_ticks=1000)
+    powercap = write_fake_powercap(str(tmp_path / "powercap"))
+    meter = EnergyMeter(ignore_disk=True, rapl_root=powercap, nvml=FakeNvml([]),
+                        attribute_to_process=True, proc_root=proc)
+    meter.begin()
+    # The tree used 100 of the 400 ticks the host was busy.
+    write_fake_proc(proc, with_ticks(150, 600), busy_ticks=1400)
+    set_fake_energy(powercap, "intel-rapl:0", 40000000)
+    set_fake_energy(powercap, "intel-rapl:0:0", 3800000)
+    meter.end()
+
+    joules = meter.get_attributed_joules_per_component()
+    np.testing.assert_allclose(joules["cpu"]["total"], [40])
+    np.testing.assert_allclose(joules["cpu"]["attributed"], [10])
+    # The tree has 80 of the 380 resident pages.
+    np.testing.assert_allclose(joules["dram"]["attributed"], [3.8 * 80 / 380])
+    with pytest.raises(Exception):
+        EnergyMeter(ignore_disk=True).get_attributed_joules_per_component()
+
+
+def test_sampler_attributes_each_interval(tmp_path):
+    proc = write_fake_proc(str(tmp_path), PROCESSES, busy_ticks=1000)
+    source = ProcessShareSource(proc_root=proc)
+    sampler = EnergySampler(sources=[source, LinearSource(["cpu"], [100])])
+    # 100 J per second: first the tree uses half of the busy time, then all of it.
+    for t, child_ticks, busy in [(0, 50, 1000), (1, 50 + CLOCK_TICKS // 2, 1000 + CLOCK_TICKS),
+                                 (2, 50 + 3 * CLOCK_TICKS // 2, 1000 + 2 * CLOCK_TICKS)]:
+        write_fake_proc(proc, with_ticks(child_ticks, 300), busy_ticks=busy)
+        sampler.append(float(t), source.read(float(t)) + [100 * t])
+    np.testing.assert_allclose(sampler.attributed_between(0, 2)["cpu"], [50 + 100])
+    # Half of the first interval.
+    np.testing.assert_allclose(sampler.attributed_between(0.5, 1)["cpu"], [25])
@@ -0,0 +1,86 @@
+from energymeter.profiler import EnergyProfiler
+from energymeter.testing import make_sampler
+import threading
+import time
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def heavy():
+    spin(0.3)
+
+
+def light():
+    spin(0.1)
+
+
+def workload():
+    heavy()
+    light()
+
+
+def test_energy_is_attributed_to_functions(tmp_path):
+    sampler = make_sampler()
+    sampler.start()
+    try:
+        with EnergyProfiler(sampler=sampler, interval=0.005) as profiler:
+            workload()
+
+        # The sampler reports cpu, dram and gpu at 10 + 20 + 3 + 100 W.
+        duration = profiler.end_time - profiler.start_time
+        functions = dict(profiler.functions())
+        labels = {label.split("_(")[0]: joules for label, joules in functions.items()}
+        assert abs(labels["workload"] - 133 * duration) < 133 * 0.1
+        assert abs(labels["heavy"] / labels["light"] - 3) < 0.6
+        cpu = dict(profiler.functions("cpu"))
+        assert abs(sum(j for l, j in cpu.items() if l.startswith("workload")) -
+                   30 * duration) < 3
+
+        path = tmp_path / "profile.folded"
+        profiler.write_collapsed(path, component="cpu")
+        lines = path.read_text().splitlines()
+        assert any(";workload_(" in line and ";heavy_(" in line for line in lines)
+        stack, value = lines[0].rsplit(" ", 1)
+        assert int(value) > 0
+        assert "profiler_test.py:" in stack
+    finally:
+        sampler.shutdown()
+
+
+def test_all_threads_share_energy():
+    sampler = make_sampler()
+    sampler.start()
+    try:
+        worker = threading.Thread(target=spin, args=(0.3,))
+        with EnergyProfiler(sampler=sampler, threads="all", interval=0.005) as profiler:
+            worker.start()
+            spin(0.3)
+            worker.join()
+        functions = dict(profiler.functions("gpu"))
+        spin_joules = [j for l, j in functions.items() if l.startswith("spin")]
+        # Both threads are in spin, which is counted once per stack.
+        assert len(spin_joules) == 1
+        run = [j for l, j in functions.items() if l.split("_(")[0] in ("run", "Thread.run")]
+        assert run and 0.3 < run[0] / spin_joules[0] < 0.7
+    finally:
+        sampler.shutdown()
+
+
+def test_overhead_is_bounded():
+    sampler = make_sampler()
+    sampler.start()
+    try:
+        EnergyProfiler.OVERHEAD_CHECK_SECONDS = 0.1
+        with EnergyProfiler(sampler=sampler, interval=0.001, max_overhead=1e-6) as profiler:
+            spin(0.5)
+        overhead = profiler.get_overhead()
+        assert overhead["interval"] > 0.001
+        assert overhead["samples"] > 0
+        assert overhead["cpu_seconds"] > 0
+    finally:
+        EnergyProfiler.OVERHEAD_CHECK_SECONDS = 1.0
+        sampler.shutdown()
@@ -0,0 +1,134 @@
+from energymeter.pytest_plugin import compare, load_baseline
+import json
+import os
+import pytest
+
+pytest_plugins = ["pytester"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFTEST = """
+import pytest
+from energymeter.sampler import EnergySampler, SharedEnergyMeter
+from energymeter.testing import FakeLoadSource
+
+source = FakeLoadSource(["cpu", "gpu"], [10, 50])
+
+
+@pytest.fixture(scope="session")
+def sampler():
+    sampler = EnergySampler(sources=[source], seconds_between_samples=0.005)
+    sampler.start()
+    yield sampler
+    sampler.shutdown()
+
+
+# Takes a sample when it begins and ends, so the joules of the calls are never split
+# between runs, whatever the load of the host.
+class SampledMeter(SharedEnergyMeter):
+
+    def begin(self):
+        SharedEnergyMeter.begin(self)
+        self.sampler.sample()
+
+    def end(self):
+        self.sampler.sample()
+        SharedEnergyMeter.end(self)
+
+
+@pytest.fixture
+def energy_meter_factory(sampler):
+    return lambda: SampledMeter(ignore_disk=True, sampler=sampler)
+"""
+
+TESTS = """
+import os
+import time
+import pytest
+from conftest import source
+
+OPTIONS = dict(min_runs=3, target_ci=0.2, min_run_seconds=0.05, baseline_seconds=0.1)
+
+
+def work():
+    time.sleep(0.002)
+    source.consume(float(os.environ["CPU_JOULES"]), 0.01)
+
+
+@pytest.mark.energy(**OPTIONS)
+def test_marked(tmp_path):
+    assert tmp_path.exists()
+    work()
+
+
+@pytest.mark.energy(**OPTIONS)
+def test_fixture(energy):
+    result = energy(work)
+    assert result["runs"] >= 3
+"""
+
+
+def result(cpu, gpu, ci=0.0):
+    return {"joules_per_call": {"cpu": cpu, "gpu": gpu}, "ci": {"cpu": ci, "gpu": ci},
+            "total_joules_per_call": cpu + gpu, "total_ci": ci}
+
+
+def test_compare():
+    baseline = result(1.0, 2.0)
+    assert compare(result(1.05, 2.0), baseline, 0.1) == []
+    regressions = compare(result(1.5, 2.0), baseline, 0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("cpu: 1.5 J per call")
+    assert regressions[1].startswith("total:")
+    # Differences within the confidence interval or min_joules are tolerated.
+    assert compare(result(1.5, 2.0, ci=0.5), baseline, 0.1) == []
+    assert compare(result(1.5, 2.0), baseline, 0.1, min_joules=0.5) == []
+    # Components that are not in the baseline are not compared.
+    assert compare(result(1.0, 2.0), {"joules_per_call": {"cpu": 1.0},
+                                      "total_joules_per_call": 3.0}, 0.1) == []
+
+
+def test_baselines_are_saved_and_compared(pytester, monkeypatch):
+    pytester.makeconftest(CONFTEST)
+    pytester.makepyfile(test_work=TESTS)
+    path = str(pytester.path / "energy.json")
+
+    # Runs are in subprocesses, as numpy cannot be imported again in the same process.
+    monkeypatch.setenv("PYTHONPATH", ROOT)
+    monkeypatch.setenv("CPU_JOULES", "0.5")
+    run = pytester.runpytest_subprocess("-p", "energymeter.pytest_plugin",
+                                       "--energy-baseline", path, "--energy-save")
+    run.assert_outcomes(passed=2)
+    run.stdout.fnmatch_lines(["*energy*", "test_work.py::test_marked: * J per call*",
+                              "Energy baseline saved to *"])
+    tests = load_baseline(path)
+    assert set(tests) == {"test_work.py::test_marked", "test_work.py::test_fixture"}
+    for stored in tests.values():
+        # The idle power of the fake source is subtracted.
+        assert stored["joules_per_call"]["cpu"] == pytest.approx(0.5, rel=0.1)
+        assert stored["baseline_watts"]["cpu"] == pytest.approx(10, rel=0.1)
+    assert json.load(open(path))["version"] == 1
+
+    run = pytester.runpytest_subprocess("-p", "energymeter.pytest_plugin",
+                                       "--energy-baseline", path)
+    run.assert_outcomes(passed=2)
+
+    monkeypatch.setenv("CPU_JOULES", "1.0")
+    run = pytester.runpytest_subprocess("-p", "energymeter.pytest_plugin",
+                                       "--energy-baseline", path)
+    run.assert_outcomes(failed=2)
+    run.stdout.fnmatch_lines(["*Energy regression in test_work.py::test_marked:*",
+                              "*cpu: * J per call * J baseline + 10%*"])
+
+    # A larger tolerance accepts the increase.
+    run = pytester.runpytest_subprocess("-p", "energymeter.pytest_plugin",
+                                       "--energy-baseline", path, "--energy-tolerance", "2")
+    run.assert_outcomes(passed=2)
+
+
+def test_tests_without_marker_are_not_measured(pytester, monkeypatch):
+    monkeypatch.setenv("PYTHONPATH", ROOT)
+    pytester.makepyfile("def test_plain():\n    pass\n")
+    run = pytester.runpytest_subprocess("-p", "energymeter.pytest_plugin")
+    run.assert_outcomes(passed=1)
+    assert "energy" not in [line.strip("= ") for line in run.stdout.lines]
@@ -0,0 +1,84 @@
+from energymeter.energy_meter import EnergyMeter
+from energymeter.rapl import RaplReader, get_rapl_reader
+from energymeter.testing import FakeNvml, set_fake_energy, write_fake_powercap
+import time
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def powercap(tmp_path):
+    # The control type directory has no energy counter and must be ignored.
+    return write_fake_powercap(str(tmp_path), max_energy_range_uj=1000000, domains={
+        "intel-rapl:0": ("package-0", 100),
+        "intel-rapl:0:0": ("core", 50),
+        "intel-rapl:0:1": ("dram", 10),
+        "intel-rapl:1": ("package-1", 200),
+        "intel-rapl:1:0": ("dram", 20),
+    })
+
+
+def test_domains_are_discovered(powercap):
+    reader = RaplReader(powercap)
+    assert reader.labels() == ["package-0", "package-0/core", "package-0/dram",
+                               "package-1", "package-1/dram"]
+    assert reader.indexes("package") == [0, 3]
+    assert reader.indexes("dram") == [2, 4]
+    np.testing.assert_allclose(reader.read_uj(), [100, 50, 10, 200, 20])
+    reader.close()
+
+
+def test_wraparound_is_corrected(powercap):
+    reader = RaplReader(powercap)
+    set_fake_energy(powercap, "intel-rapl:0", 999000)
+    assert reader.read_uj()[0] == 999000
+    # The counter wrapped at max_energy_range_uj.
+    set_fake_energy(powercap, "intel-rapl:0", 500)
+    assert reader.read_uj()[0] == 1000500
+    set_fake_energy(powercap, "intel-rapl:0", 400000)
+    assert reader.read_uj()[0] == 1400000
+    assert reader.wraparounds == 1
+    reader.close()
+
+
+def test_missing_powercap_raises(tmp_path):
+    with pytest.raises(Exception):
+        RaplReader(str(tmp_path))
+
+
+def test_meter_reads_cpu_and_dram(powercap):
+    meter = EnergyMeter(ignore_disk=True, rapl_root=powercap, nvml=FakeNvml([]))
+    meter.begin()
+    set_fake_energy(powercap, "intel-rapl:0", 2000100)
+    set_fake_energy(powercap, "intel-rapl:0:1", 1000010)
+    set_fake_energy(powercap, "intel-rapl:1", 3000200)
+    meter.end()
+    np.testing.assert_allclose(meter.get_total_joules_cpu(), [2.0, 3.0])
+    np.testing.assert_allclose(meter.get_total_joules_dram(), [1.0, 0.0])
+    assert meter.get_joules_per_rapl_domain()["package-0/dram"] == pytest.approx(1.0)
+
+
+def test_long_meters_do_not_miss_wraparounds(powercap):
+    meter = EnergyMeter(ignore_disk=True, rapl_root=powercap, nvml=FakeNvml([]))
+    meter.begin()
+    reader = meter.rapl
+    assert reader.holders == 1 and reader.poll_seconds() == RaplReader.MIN_POLL_SECONDS
+    # The counter of package-1 wraps three times while the meter runs, it is never read by
+    # the meter itself in between.
+    for energy_uj in (600000, 100200, 600000, 100200, 600000, 100200):
+        set_fake_energy(powercap, "intel-rapl:1", energy_uj)
+        time.sleep(0.05)
+    meter.end()
+    assert reader.holders == 0
+    # From 200 uJ to 100200 uJ plus three wraparounds of 1 J.
+    np.testing.assert_allclose(meter.get_total_joules_cpu()[1], 3.1)
+
+
+def test_failures_to_open_are_not_cached(tmp_path, capsys):
+    root = str(tmp_path / "powercap")
+    assert get_rapl_reader(root) is None
+    assert "could not be opened" in capsys.readouterr().out
+    write_fake_powercap(root)
+    reader = get_rapl_reader(root)
+    assert reader is not None and reader.labels() == ["package-0", "package-0/dram"]
+    assert get_rapl_reader(root) is reader
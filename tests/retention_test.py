@@ -0,0 +1,94 @@
+from energymeter.buffers import SampleBuffer
+from energymeter.retention import TieredBuffer
+from energymeter.sampler import EnergySampler
+from energymeter.testing import LinearSource
+import numpy as np
+
+
+def fill(buffer, seconds, period=0.1):
+    # A counter growing at 10 J/s with a burst at 50 J/s between 100 s and 110 s.
+    for t in np.arange(0, seconds, period):
+        buffer.append(t, [10 * t + 40 * np.clip(t - 100, 0, 10), t])
+
+
+def test_memory_is_bounded():
+    buffer = TieredBuffer(2, capacity=100, tiers=[(1.0, 100), (60.0, 10)])
+    fill(buffer, 10000)
+    # Two hours and 46 minutes of samples are kept in at most twice the capacity of each level.
+    assert len(buffer.raw) <= 200
+    assert len(buffer.tiers[0]) <= 200 and len(buffer.tiers[1]) <= 20
+    sizes = [level.timestamps.nbytes for level in [buffer.raw] + buffer.tiers]
+    fill(buffer, 20000)
+    assert sizes == [level.timestamps.nbytes for level in [buffer.raw] + buffer.tiers]
+
+
+def test_memory_grows_as_samples_are_kept():
+    buffer = TieredBuffer(30)
+    levels = [buffer.raw] + buffer.tiers
+    # The arrays of an empty buffer take less than 2 MB, whatever the default capacities.
+    assert sum(a.nbytes for level in levels for a in level.arrays()) < 2 ** 21
+    for t in range(3000):
+        buffer.append(t * 0.1, np.full(30, t))
+    assert len(buffer.raw.timestamps) == 4096
+    np.testing.assert_allclose(buffer.counters_at(150.05), np.full(30, 1500.5))
+
+
+def test_energy_is_answered_at_the_best_resolution():
+    tiered = TieredBuffer(2, capacity=500, tiers=[(1.0, 300), (60.0, 100)])
+    full = SampleBuffer(2)
+    fill(tiered, 2000)
+    fill(full, 2000)
+
+    def energy(buffer, start, end):
+        return buffer.counters_at(end) - buffer.counters_at(start)
+
+    # Raw samples, 1 s buckets and 1 min buckets are exact at their boundaries.
+    for start, end in [(1950, 1990), (1500.35, 1900.05), (60, 600), (30, 1995)]:
+        np.testing.assert_allclose(energy(tiered, start, end), energy(full, start, end),
+                                   atol=10 * 60)
+    np.testing.assert_allclose(energy(tiered, 1500, 1900), [4000, 400], rtol=1e-9)
+    # The oldest point kept is the end of the first minute, earlier times are clamped to it.
+    np.testing.assert_allclose(energy(tiered, 0, 1999.9), energy(full, 59.9, 1999.9))
+    timestamps, counters = tiered.get()
+    assert np.all(np.diff(timestamps) > 0)
+
+
+def test_windows_only_cover_the_points_needed():
+    tiered = TieredBuffer(2, capacity=500, tiers=[(1.0, 300), (60.0, 100)])
+    full = SampleBuffer(2)
+    fill(tiered, 2000)
+    fill(full, 2000)
+    all_timestamps, _ = tiered.get()
+    for buffer in (tiered, full):
+        for start, end in [(1950, 1990), (1500.35, 1900.05), (60, 600), (-10, 30),
+                           (1999.95, 3000)]:
+            timestamps, counters = buffer.get(start, end)
+            assert timestamps[0] <= max(start, buffer.get()[0][0])
+            assert timestamps[-1] >= min(end, buffer.last_timestamp())
+            assert np.all(np.diff(timestamps) > 0)
+            # Interpolating in the window gives the same counters as every point.
+            np.testing.assert_allclose(np.interp(end, timestamps, counters[:, 0]),
+                                       buffer.counters_at(end)[0])
+    # Raw samples every 100 ms, without the older levels.
+    assert len(tiered.get(1950, 1990)[0]) == 401
+    # Both halves of the timeline share the two points around the split.
+    before, after = tiered.get(end_time=1950.05)[0], tiered.get(1950.05)[0]
+    assert len(before) + len(after) == len(all_timestamps) + 2
+
+
+def test_tiers_keep_aggregates():
+    buffer = TieredBuffer(2, capacity=100, tiers=[(1.0, 1000)])
+    fill(buffer, 200)
+    tier = buffer.get_tier(0)
+    burst = (tier["timestamps"] > 101) & (tier["timestamps"] <= 110)
+    np.testing.assert_allclose(tier["mean"][burst, 0], 50)
+    np.testing.assert_allclose(tier["max"][:, 0].max(), 50)
+    np.testing.assert_allclose(tier["min"][:, 0].min(), 10)
+    np.testing.assert_allclose(tier["mean"][:, 1], 1)
+
+
+def test_sampler_with_bounded_buffer():
+    sampler = EnergySampler(sources=[LinearSource(["cpu"], [10])], buffer_cls=TieredBuffer)
+    for t in range(100):
+        sampler.append(float(t), [10 * t])
+    np.testing.assert_allclose(sampler.energy_between(10.5, 20.5)["cpu"], [100])
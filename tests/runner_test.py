@@ -0,0 +1,82 @@
+from energymeter.runner import measure, t_quantile
+from energymeter.sampler import EnergySampler, SharedEnergyMeter
+from energymeter.testing import FakeLoadSource
+import time
+import pytest
+
+
+class CountingMeter(SharedEnergyMeter):
+    """Meter that records the calls made while it ran."""
+
+    def __init__(self, calls, **kwargs):
+        SharedEnergyMeter.__init__(self, **kwargs)
+        self.calls = calls
+        self.calls_per_run = []
+
+    def begin(self):
+        self.calls_begin = len(self.calls)
+        SharedEnergyMeter.begin(self)
+
+    def end(self):
+        SharedEnergyMeter.end(self)
+        self.calls_per_run.append(len(self.calls) - self.calls_begin)
+
+
+def test_t_quantile():
+    # Values from the tables of Student's t distribution.
+    assert t_quantile(0.95, 4) == pytest.approx(2.776, abs=2e-3)
+    assert t_quantile(0.95, 30) == pytest.approx(2.042, abs=1e-3)
+    assert t_quantile(0.99, 10) == pytest.approx(3.169, abs=2e-3)
+    assert t_quantile(0.95, 1) == pytest.approx(12.706, abs=1e-3)
+    assert t_quantile(0.95, 2) == pytest.approx(4.303, abs=1e-3)
+
+
+def measure_work(warmup):
+    # The host idles at 10 W and each call uses 0.5 J more.
+    source = FakeLoadSource(["cpu"], [10])
+    sampler = EnergySampler(sources=[source], seconds_between_samples=0.005)
+    sampler.start()
+    calls = []
+
+    def work(joules):
+        calls.append(1)
+        time.sleep(0.002)
+        source.consume(joules)
+
+    meter = CountingMeter(calls, ignore_disk=True, sampler=sampler)
+    result = meter.measure(work, 0.5, warmup=warmup, min_runs=3, max_runs=10, target_ci=0.1,
+                           min_run_seconds=0.1, baseline_seconds=0.2)
+    sampler.shutdown()
+    return result, meter.calls_per_run, len(calls)
+
+
+def test_energy_per_call_is_net_of_baseline():
+    result, calls_per_run, total_calls = measure_work(warmup=2)
+
+    assert result["baseline_watts"]["cpu"] == pytest.approx(10, rel=0.05)
+    assert result["calls_per_run"] >= 20
+    assert 3 <= result["runs"] <= 10
+    # The first run of the meter measured the baseline, then every run made the same calls.
+    assert calls_per_run == [0] + [result["calls_per_run"]] * result["runs"]
+    assert total_calls > result["runs"] * result["calls_per_run"]
+    assert result["joules_per_call"]["cpu"] == pytest.approx(0.5, rel=0.1)
+    assert result["total_joules_per_call"] == pytest.approx(0.5, rel=0.1)
+    assert result["converged"] and result["total_ci"] <= 0.1 * result["total_joules_per_call"]
+
+
+def test_without_warmup_every_call_is_measured():
+    result, calls_per_run, total_calls = measure_work(warmup=0)
+
+    # The first run of the meter calibrates the calls of the rest and is not in the results.
+    assert calls_per_run[:2] == [0, 1]
+    assert calls_per_run[2:] == [result["calls_per_run"]] * result["runs"]
+    assert total_calls == sum(calls_per_run)
+    assert result["calls_per_run"] >= 20
+    # The single call, with the overhead of a whole run, does not skew the means.
+    assert result["joules_per_call"]["cpu"] == pytest.approx(0.5, rel=0.1)
+    assert result["seconds_per_call"] == pytest.approx(0.002, rel=0.5)
+
+
+def test_at_least_two_runs_are_required():
+    with pytest.raises(Exception):
+        measure(SharedEnergyMeter(ignore_disk=True), lambda: None, min_runs=1)
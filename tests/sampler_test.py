@@ -0,0 +1,101 @@
+from energymeter.sampler import EnergySampler, SharedEnergyMeter
+from energymeter.testing import make_sampler
+import threading
+import time
+import numpy as np
+
+
+def test_energy_between_interpolates_counters():
+    sampler = make_sampler()
+    for t in range(0, 100000, 10):
+        sampler.append(float(t), [10 * t, 20 * t, 3 * t, 0, 0, 0, 0])
+
+    energy = sampler.energy_between(15.0, 95.0)
+    np.testing.assert_allclose(energy["cpu"], [800, 1600])
+    np.testing.assert_allclose(energy["dram"], [240])
+    # The buffers grew beyond their initial capacity.
+    assert len(sampler.buffer) == 10000
+    # Intervals beyond the samples are clamped to the first and last samples.
+    np.testing.assert_allclose(sampler.energy_between(-5.0, 0.0)["cpu"], [0, 0])
+
+
+def test_overlapping_and_nested_meters():
+    sampler = make_sampler()
+    sampler.start()
+    try:
+        outer = SharedEnergyMeter(label="outer", ignore_disk=True, sampler=sampler)
+        inner = SharedEnergyMeter(label="inner", ignore_disk=True, include_idle=True,
+                                  sampler=sampler)
+        outer.begin()
+        time.sleep(0.05)
+        inner.begin()
+        time.sleep(0.05)
+        inner.end()
+        outer.end()
+
+        for meter in (outer, inner):
+            res = meter.get_total_joules_per_component()
+            np.testing.assert_allclose(res["cpu"], [10 * meter.duration, 20 * meter.duration])
+            np.testing.assert_allclose(res["dram"], [3 * meter.duration])
+            assert res["disk"] == 0
+        assert np.isclose(outer.get_total_joules_gpu(), 50 * outer.duration)
+        assert np.isclose(inner.get_total_joules_gpu(), 100 * inner.duration)
+    finally:
+        sampler.shutdown()
+
+
+def test_disk_energy_from_bytes():
+    sampler = make_sampler()
+    sampler.start()
+    try:
+        meter = SharedEnergyMeter(disk_avg_speed=1e9, disk_active_power=6, disk_idle_power=1,
+                                  sampler=sampler)
+        meter.begin()
+        time.sleep(0.02)
+        meter.end()
+        assert np.isclose(meter.get_total_joules_disk(), 3e6 * meter.duration / 1e9 * 6)
+    finally:
+        sampler.shutdown()
+
+
+def test_gpus_are_sampled_per_device():
+    from energymeter.sampler import NvmlSource
+    from energymeter.testing import FakeGpu, FakeNvml
+    import os
+    nvml = FakeNvml([FakeGpu(power=100, processes={os.getpid(): 30}),
+                     FakeGpu(power=50, energy_supported=False, processes={1: 80})])
+    sampler = EnergySampler(sources=[NvmlSource(nvml)], seconds_between_samples=0.01)
+    sampler.start()
+    try:
+        meter = SharedEnergyMeter(ignore_disk=True, sampler=sampler)
+        meter.begin()
+        time.sleep(0.1)
+        meter.end()
+        joules = meter.get_joules_per_gpu()
+        assert np.isclose(joules["gpu0"], 100 * meter.duration, rtol=0.1)
+        assert joules["gpu1"] == 0
+        meter.include_idle = True
+        assert np.isclose(meter.get_joules_per_gpu()["gpu1"], 50 * meter.duration)
+    finally:
+        sampler.shutdown()
+
+
+def test_listeners_are_added_and_removed_from_several_threads():
+    sampler = make_sampler()
+    seen = []
+
+    def register(i):
+        listeners = [lambda t, row, n=n: seen.append(n) for n in range(i * 100, i * 100 + 100)]
+        for listener in listeners:
+            sampler.add_listener(listener)
+        for listener in listeners[::2]:
+            sampler.remove_listener(listener)
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sampler.listeners) == 400
+    sampler.append(0.0, [0] * 7)
+    assert sorted(seen) == list(range(1, 800, 2))
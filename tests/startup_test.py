@@ -0,0 +1,42 @@
+from energymeter.nvml import NvmlReader
+from energymeter.rapl import RaplReader
+from energymeter.sampler import EnergySampler
+import builtins
+import os
+import subprocess
+import sys
+
+
+def loaded_modules(statement):
+    code = "import sys\n{}\nprint(' '.join(sys.modules))".format(statement)
+    return set(subprocess.check_output([sys.executable, "-c", code]).decode().split())
+
+
+def test_import_is_almost_free():
+    modules = loaded_modules("import energymeter")
+    assert "numpy" not in modules
+    assert "energymeter.energy_meter" not in modules
+
+
+def test_meters_do_not_import_backends_or_plotting():
+    modules = loaded_modules("from energymeter import EnergyMeter, SharedEnergyMeter\n"
+                             "EnergyMeter(ignore_disk=True)\n"
+                             "SharedEnergyMeter(ignore_disk=True)")
+    for heavy in ("matplotlib", "pandas", "pynvml", "pynvml_utils", "pyRAPL"):
+        assert heavy not in modules
+
+
+def test_construction_does_not_touch_the_hardware(monkeypatch):
+    from energymeter import EnergyMeter, SharedEnergyMeter
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Constructing a meter must not open files or devices.")
+
+    # No file is read (e.g. in /sys or /proc), and RAPL, NVML and the sampler are left alone
+    # until the meter begins.
+    for module, name in ((builtins, "open"), (os, "open"), (os, "listdir"), (os, "scandir")):
+        monkeypatch.setattr(module, name, fail)
+    for cls in (NvmlReader, RaplReader, EnergySampler):
+        monkeypatch.setattr(cls, "__init__", fail)
+    for cls in (EnergyMeter, SharedEnergyMeter):
+        cls(ignore_disk=True)